@@ -1,165 +1,474 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, request, jsonify
-import pandas as pd
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context, has_app_context, has_request_context, make_response, redirect, url_for
 import sqlite3
 import os
-from datetime import datetime
+import csv
+import functools
+import hashlib
+import hmac
+import inspect
+import io
+import itertools
+import re
+from datetime import datetime, timezone
+
+from autocomplete import AutocompleteIndex
+import build_db
+from dataset import BUSY_STATES, DatasetManager
+from location_resolver import LocationResolver
+import metrics
+from responses import OrjsonProvider, compact_results, compress_response, orjson
+from result_cache import DEFAULT_MAX_ROWS, DiskCache, MemoryCache, ResultCache, make_key
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# 按 Accept-Encoding 压缩 JSON 响应（RESPONSE_COMPRESSION=0 关闭，如由前端代理负责压缩时）
+app.config['RESPONSE_COMPRESSION'] = os.environ.get('RESPONSE_COMPRESSION', '1') != '0'
+# GET 响应允许浏览器 / CDN 缓存的秒数（HTTP_CACHE_MAX_AGE=0 时不加缓存头）；数据集重建后 ETag 随版本变化
+app.config['HTTP_CACHE_MAX_AGE'] = int(os.environ.get('HTTP_CACHE_MAX_AGE', 86400))
+
+# 指标采集（METRICS=0 关闭）：/metrics 输出 Prometheus 文本格式，响应头带 Server-Timing
+app.config['METRICS'] = os.environ.get('METRICS', '1') != '0'
+# 诊断接口（/api/slow-queries）的访问令牌：设置时需带 Authorization: Bearer <令牌>，未设置时只允许本机直接访问
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN') or None
 
-# 数据库文件路径
+# 数据库文件路径（重建后为指向 versions/ 中当前版本的符号链接）
 DB_PATH = 'wage_data.db'
 
+# 当前数据集：连接池（每线程长连接，DB_POOL=0 时退回每个请求新建连接）+ 内存结构，重建后热切换，切换后清理旧版本的查询结果缓存
+datasets = DatasetManager(DB_PATH, pooled=os.environ.get('DB_POOL', '1') != '0',
+                          warm=lambda dataset: warm_dataset(dataset),
+                          on_swap=lambda dataset: result_cache.retain(dataset_version(dataset)),
+                          factory=metrics.InstrumentedConnection if app.config['METRICS'] else sqlite3.Connection)
+
+
+# ASGI 入口（asgi.py）放入 environ 的取消令牌：客户端断开时置位，并中断请求正在执行的 SQLite 语句
+REQUEST_CANCEL_KEY = 'oflc.cancel'
+
+
+class RequestCancelled(Exception):
+    """客户端已断开，放弃当前请求"""
+
+
+def request_cancel_token():
+    """当前请求的取消令牌（不经 ASGI 入口时为 None）"""
+    return request.environ.get(REQUEST_CANCEL_KEY) if has_request_context() else None
+
+
+def current_dataset():
+    """当前请求使用的数据集：第一次访问时绑定并增加引用计数，整个请求读同一个版本；请求之外取当前数据集"""
+    if not has_app_context():
+        return datasets.current
+    if 'dataset' not in g:
+        g.dataset = datasets.acquire()
+    return g.dataset
+
+
+def get_db():
+    """取得当前请求使用的只读数据库连接"""
+    if 'db' not in g:
+        g.db = current_dataset().pool.acquire()
+        token = request_cancel_token()
+        if token is not None:
+            token.add_callback(g.db.interrupt)
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(error):
+    """请求结束时归还连接、释放数据集（已被替换的旧版本在最后一个请求结束后关闭连接）"""
+    conn = g.pop('db', None)
+    dataset = g.pop('dataset', None)
+    if conn is not None:
+        dataset.pool.release(conn, error)
+    if dataset is not None:
+        datasets.release(dataset)
+
+
+# 薪资查询引擎：sqlite（默认，逐条查询 wage_data）或 numpy（内存列式，首次使用时加载）
+app.config['WAGE_ENGINE'] = os.environ.get('WAGE_ENGINE', 'sqlite')
+# 自动完成是否使用进程内索引（AUTOCOMPLETE_INDEX=0 时直接查询 SQLite）
+app.config['AUTOCOMPLETE_INDEX'] = os.environ.get('AUTOCOMPLETE_INDEX', '1') != '0'
+
+# 查询结果缓存（RESULT_CACHE=0 关闭）；RESULT_CACHE_PATH 指定时再加一层多 worker 共享的磁盘缓存，
+# RESULT_CACHE_TTL 为条目有效秒数（0 表示只按 LRU 淘汰），RESULT_CACHE_MAX_ROWS 为每个 worker 进程内缓存的总行数上限
+app.config['RESULT_CACHE'] = os.environ.get('RESULT_CACHE', '1') != '0'
+_cache_ttl = float(os.environ.get('RESULT_CACHE_TTL', 0))
+result_cache = ResultCache(
+    MemoryCache(max_rows=int(os.environ.get('RESULT_CACHE_MAX_ROWS', DEFAULT_MAX_ROWS)), ttl=_cache_ttl),
+    DiskCache(os.environ['RESULT_CACHE_PATH'], ttl=_cache_ttl) if os.environ.get('RESULT_CACHE_PATH') else None,
+)
+
+# 基于数据库构建的只读内存结构（列式引擎、自动完成索引等）按名称缓存在各自的数据集上（Dataset.objects），
+# 下面的函数默认取当前请求的数据集，热切换前的预热传入新数据集
+
+
+def get_wage_engine(dataset=None):
+    """启用 numpy 引擎时返回已加载的列式引擎，否则返回 None（走 SQLite）"""
+    if app.config['WAGE_ENGINE'] != 'numpy':
+        return None
+    dataset = dataset or current_dataset()
+    engine = dataset.objects.get('wage_engine')
+    if engine is None:
+        version = dataset_version(dataset)
+        engine = dataset.load('wage_engine', lambda conn: load_wage_engine(conn, version, dataset.path))
+    return engine
+
+
+def load_wage_engine(conn, version, db_path=DB_PATH):
+    """优先 mmap 打开与数据库同一版本的列式文件（<db>.columns），没有或版本不符时从 SQLite 逐列读取"""
+    from wage_engine import ColumnarWageEngine  # 只在启用时导入 numpy，缩短 worker 启动时间
+    path = build_db.columns_path(os.path.realpath(db_path))
+    if os.path.exists(path):
+        try:
+            engine = ColumnarWageEngine.open(path)
+        except (OSError, ValueError) as e:
+            print(f"列式文件无法打开，改为从数据库加载: {e}")
+        else:
+            if engine.dataset_version == version:
+                return engine
+            print(f"列式文件的数据版本 {engine.dataset_version} 与数据库 {version} 不符，改为从数据库加载")
+    return ColumnarWageEngine.load(conn, version)
+
+
+def get_autocomplete_index(dataset=None):
+    """启用进程内自动完成索引时返回索引，否则返回 None（走 SQLite）"""
+    if not app.config['AUTOCOMPLETE_INDEX']:
+        return None
+    return (dataset or current_dataset()).load('autocomplete', AutocompleteIndex.load)
+
+
+def get_location_resolver(dataset=None):
+    """地区解析器（geography 内存索引 + 解析结果缓存）"""
+    return (dataset or current_dataset()).load('location_resolver', LocationResolver.load)
+
+
+def dataset_version(dataset=None):
+    """当前数据库的版本标识（结构版本 + 源数据校验和），各 worker、各台机器对同一份数据得到相同的值"""
+    dataset = dataset or current_dataset()
+
+    def load(conn):
+        info = build_db.load_build_info(conn)
+        if build_db.is_current(info):
+            return build_db.dataset_version(info)
+        # 没有构建信息的旧数据库：退回文件大小 + 修改时间
+        stat = os.stat(dataset.path)
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+    return dataset.load('version', load)
+
+
+def dataset_modified(dataset=None):
+    """当前数据库的构建时间（Last-Modified），没有构建信息的旧数据库取文件修改时间"""
+    dataset = dataset or current_dataset()
+
+    def load(conn):
+        info = build_db.load_build_info(conn)
+        if build_db.is_current(info) and info.get('built_at'):
+            return datetime.fromisoformat(info['built_at'])
+        return datetime.fromtimestamp(int(os.stat(dataset.path).st_mtime), timezone.utc)
+    return dataset.load('modified', load)
+
+
+def dataset_tables(dataset=None):
+    """数据集中的表名（含全文索引等虚拟表），每个数据集读取一次 sqlite_master
+
+    查询据此一次性选择新结构（occupations_fts、wage_levels、location_leaderboard）或旧数据库的退回查询，
+    而不是每次执行失败后再换一条语句：被中断（客户端断开）或其他原因失败的语句不应改走另一条查询。
+    """
+    return (dataset or current_dataset()).load('tables', lambda conn: frozenset(
+        name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")))
+
+
+# 就绪检查要求存在且非空的表
+READY_TABLES = ('wage_data', 'geography', 'occupations')
+
+
+def dataset_readiness(dataset=None):
+    """数据集的就绪状态：{'ready', 'counts', 'data_version', 'checksum', 'built_at'}，每个数据集只计算一次
+
+    当前结构版本的数据库直接取构建时写入 build_info 的行数和源数据校验和，数据库文件的校验和取自 .sha256 文件；
+    没有构建信息的旧数据库退回检查表是否存在并 COUNT(*)（同样只在加载时执行一次）。
+    """
+    dataset = dataset or current_dataset()
+
+    def load(conn):
+        info = build_db.load_build_info(conn)
+        if build_db.is_current(info):
+            counts = {table: int(info.get(f'rows_{table}') or 0) for table in READY_TABLES}
+        else:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            if not tables.issuperset(READY_TABLES):
+                return {'ready': False, 'reason': 'tables_missing', 'tables': sorted(tables)}
+            counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in READY_TABLES}
+            info = {}
+        try:
+            with open(f'{dataset.path}.sha256') as f:
+                checksum = f.read().split()[0]
+        except (OSError, IndexError):
+            checksum = None
+        state = {'ready': all(counts.values()), 'counts': counts, 'data_version': info.get('data_version'),
+                 'checksum': checksum, 'built_at': info.get('built_at')}
+        if not state['ready']:
+            state['reason'] = 'tables_empty'
+        return state
+    return dataset.load('readiness', load)
+
+
+def warm_dataset(dataset=None):
+    """预先建立全部只读内存结构（自动完成索引、地区解析、数据集版本，启用时还有列式引擎）
+
+    生产启动器（serve.py）在 gunicorn 主进程中 preload 后调用，fork 出的 worker 通过写时复制共享这些页面；
+    结束时关闭当前线程持有的 SQLite 连接，worker 不继承打开的数据库句柄。
+    热切换时在后台线程中对新数据集调用，切换后的第一个请求不必等待。
+    """
+    dataset = dataset or datasets.current
+    if dataset.identity is None:  # 数据库文件不存在
+        return
+    get_autocomplete_index(dataset)
+    get_location_resolver(dataset)
+    dataset_version(dataset)
+    dataset_modified(dataset)
+    dataset_tables(dataset)
+    dataset_readiness(dataset)
+    get_wage_engine(dataset)
+    dataset.pool.close()
+    if result_cache.disk is not None:
+        result_cache.disk.close()
+
+
+def cached_results(endpoint, params, compute, stream=False):
+    """按 (接口, 规范化参数, 数据集版本) 缓存 compute() 生成的结果，返回结果迭代器（stream 见 ResultCache.results）"""
+    if not app.config['RESULT_CACHE']:
+        return cancellable(compute())
+    return cancellable(result_cache.results(make_key(endpoint, params, dataset_version()), compute, stream))
+
+
+def cancellable(results):
+    """客户端断开后不再继续生成结果（被中断的 SQLite 语句同样转换为 RequestCancelled）"""
+    token = request_cancel_token()
+    if token is None:
+        return results
+    
+    def generate():
+        try:
+            for row in results:
+                if token.cancelled:
+                    raise RequestCancelled()
+                yield row
+        except sqlite3.OperationalError:
+            if token.cancelled:
+                raise RequestCancelled()
+            raise
+    return generate()
+
+
+def cache_validators():
+    """(数据集版本, 构建时间)；数据库不存在或无法打开时返回 None"""
+    try:
+        return dataset_version(), dataset_modified()
+    except (sqlite3.Error, OSError):
+        return None
+
+
+def http_cached(vary=()):
+    """GET 响应的 HTTP 缓存头：同一数据集版本内结果不变
+
+    ETag 由数据集版本、完整 URL 和 vary 中列出的请求头决定，不需要先执行查询：
+    If-None-Match / If-Modified-Since 命中时直接返回 304。只有 200 响应加缓存头，POST 不受影响。
+    没有可用的数据库时不加缓存头，由视图照常处理（参数校验、错误响应）。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            max_age = app.config['HTTP_CACHE_MAX_AGE']
+            validators = cache_validators() if request.method in ('GET', 'HEAD') and max_age else None
+            if validators is None:
+                return view(*args, **kwargs)
+            version, modified = validators
+            key = '\n'.join([version, request.full_path, *(request.headers.get(name, '') for name in vary)])
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and request.if_modified_since >= modified
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # 压缩后的字节不同，但内容等价，用弱 ETag
+            response.set_etag(etag, weak=True)
+            response.last_modified = modified
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.vary.update(vary)
+            if app.config['RESPONSE_COMPRESSION']:
+                response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
+
+
+def admin_only(view):
+    """诊断接口的访问控制：设置了 ADMIN_TOKEN 时校验 Bearer 令牌，否则只接受本机不经代理的请求，其余返回 403"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['ADMIN_TOKEN']
+        if token:
+            allowed = hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                          f'Bearer {token}'.encode('utf-8'))
+        else:
+            allowed = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+        if not allowed:
+            return jsonify({'error': 'Forbidden: set ADMIN_TOKEN and send it as a Bearer token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def request_data():
+    """搜索参数：POST 取 JSON 请求体，GET 取查询字符串（可被浏览器 / CDN 缓存的形式）"""
+    if request.method == 'POST':
+        return request.json
+    data = request.args.to_dict()
+    if 'stream' in data:
+        data['stream'] = data['stream'].lower() in ('1', 'true', 'yes')
+    return data
+
+
+@app.errorhandler(RequestCancelled)
+def request_cancelled(error):
+    """客户端已经收不到响应，只返回一个简短的状态（499，与 nginx 的约定一致）"""
+    return jsonify({'error': 'Request cancelled'}), 499
+
+
+@app.errorhandler(sqlite3.OperationalError)
+def sqlite_interrupted(error):
+    """视图中（进入结果迭代之前）被中断的语句：客户端已断开时按取消处理，其他错误照常作为服务器错误"""
+    token = request_cancel_token()
+    if token is not None and token.cancelled:
+        return request_cancelled(error)
+    raise error
+
+
 def init_database():
-    """初始化数据库并导入数据"""
-    if os.path.exists(DB_PATH):
-        print("数据库已存在，跳过初始化")
+    """初始化数据库：已有当前版本的数据库（如部署时用 build_db 预先构建）时只做校验，否则从CSV导入
+
+    数据文件存在时还比较 build_info 记录的源数据校验和，数据文件已被替换时同样重新导入。
+
+    多个 worker 同时启动时用文件锁保证只有一个在构建，其余等待后直接使用构建好的数据库。
+    """
+    info = build_db.read_build_info(DB_PATH)
+    if build_db.is_current(info) and build_db.matches_source(info):
+        print(f"数据库已存在（数据版本 {build_db.dataset_version(info)}），跳过初始化")
         return
     
-    print("开始初始化数据库...")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # 读取CSV文件
-    print("正在读取数据文件...")
-    
-    try:
-        # 检查CSV文件是否存在
-        csv_files = ['ALC_Export.csv', 'Geography.csv', 'oes_soc_occs.csv']
-        for file in csv_files:
-            if not os.path.exists(file):
-                print(f"错误：文件 {file} 不存在")
-                conn.close()
+    with build_db.build_lock(DB_PATH):
+        info = build_db.read_build_info(DB_PATH)
+        if build_db.is_current(info):
+            if build_db.matches_source(info):
+                print("数据库已由其他进程构建完成，跳过初始化")
                 return
-            else:
-                print(f"文件 {file} 存在")
-        
-        # 读取主要薪资数据
-        print("读取ALC_Export.csv...")
-        alc_data = pd.read_csv('ALC_Export.csv')
-        alc_data.columns = ['area', 'soc_code', 'geo_lvl', 'level1', 'level2', 'level3', 'level4', 'average', 'label']
-        print(f"ALC数据行数: {len(alc_data)}")
+            print(f"数据文件已变化（数据库的数据版本 {build_db.dataset_version(info)} 与源文件的校验和不符）")
         
-        # 读取地理信息
-        print("读取Geography.csv...")
-        geo_data = pd.read_csv('Geography.csv')
-        geo_data.columns = ['area', 'area_name', 'state_ab', 'state', 'county_town_name']
-        print(f"地理数据行数: {len(geo_data)}")
-        
-        # 读取职业信息
-        print("读取oes_soc_occs.csv...")
-        occ_data = pd.read_csv('oes_soc_occs.csv')
-        occ_data.columns = ['soc_code', 'title', 'description']
-        print(f"职业数据行数: {len(occ_data)}")
+        missing = build_db.missing_files()
+        if missing:
+            if os.path.exists(DB_PATH):
+                print("数据库不是当前版本，但缺少数据文件无法重建，继续使用现有数据库")
+                return
+            for file in missing:
+                print(f"错误：文件 {file} 不存在")
+            print(f"当前工作目录: {os.getcwd()}")
+            print(f"目录中的文件: {os.listdir('.')}")
+            return
         
-    except Exception as e:
-        print(f"读取CSV文件时出错: {e}")
-        print(f"当前工作目录: {os.getcwd()}")
-        print(f"目录中的文件: {os.listdir('.')}")
-        conn.close()
-        return
-    
-    # 创建表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS wage_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            area TEXT,
-            soc_code TEXT,
-            geo_lvl INTEGER,
-            level1 REAL,
-            level2 REAL,
-            level3 REAL,
-            level4 REAL,
-            average REAL,
-            label TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS geography (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            area TEXT,
-            area_name TEXT,
-            state_ab TEXT,
-            state TEXT,
-            county_town_name TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS occupations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            soc_code TEXT,
-            title TEXT,
-            description TEXT
-        )
-    ''')
-    
-    # 插入数据
-    print("正在导入薪资数据...")
-    alc_data.to_sql('wage_data', conn, if_exists='append', index=False)
-    
-    print("正在导入地理数据...")
-    geo_data.to_sql('geography', conn, if_exists='append', index=False)
-    
-    print("正在导入职业数据...")
-    occ_data.to_sql('occupations', conn, if_exists='append', index=False)
-    
-    # 创建索引以提高查询性能
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_wage_area ON wage_data(area)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_wage_soc ON wage_data(soc_code)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_geo_area ON geography(area)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_geo_state ON geography(state)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_occ_soc ON occupations(soc_code)')
-    
-    conn.commit()
-    conn.close()
-    print("数据库初始化完成！")
+        print("开始初始化数据库..." if not os.path.exists(DB_PATH) else "数据库不是当前版本，重新构建...")
+        # 构建到 versions/ 下的新文件，完成后把 DB_PATH 原子地指向它，导入中途失败不会留下不完整的数据库
+        path, stats = build_db.build_version(DB_PATH)
+        build_db.publish_version(DB_PATH, path)
+        build_db.prune_versions(DB_PATH)
+    print(f"导入行数: {stats['rows']}")
+    print(f"数据库初始化完成！耗时 {stats['seconds']:.1f}s，{stats['rows_per_sec']} 行/秒")
 
 # 重要：确保在生产环境（如 gunicorn/Railway）导入时也会初始化数据库
 # 由于在 gunicorn 下不会执行 `if __name__ == '__main__':`，
-# 因此这里进行一次幂等初始化（函数内部已判断文件存在则跳过）。
+# 因此这里进行一次幂等初始化（已有当前版本的数据库时只校验版本，不会重新导入）。
 try:
     if not os.path.exists(DB_PATH):
         print("检测到数据库文件不存在，正在进行导入初始化…")
     else:
         print("检测到数据库文件已存在，按需跳过初始化…")
     init_database()
+    # 启动时预先建立自动完成索引，第一次按键不必等待
+    if os.path.exists(DB_PATH):
+        get_autocomplete_index(datasets.current)
 except Exception as _e:
     print(f"应用导入阶段初始化数据库失败: {_e}")
 
 
+# FTS5 bm25() 列权重：soc_code(不索引), title, alt_titles, description
+FTS_WEIGHTS = (0.0, 10.0, 5.0, 1.0)
+
+
+def fts_query(text, columns=None):
+    """把用户输入转换为FTS5查询：每个词加引号做前缀匹配，可限定列"""
+    tokens = re.findall(r'\w+', text)
+    if not tokens:
+        return None
+    query = ' '.join(f'"{token}"*' for token in tokens)
+    if columns:
+        query = '{%s}: (%s)' % (' '.join(columns), query)
+    return query
+
+
+def match_occupations(cursor, position):
+    """按职位名称匹配职业 [(soc_code, title)]
+
+    优先使用全文索引并按BM25相关度排序；旧数据库没有 occupations_fts 时退回 LIKE 扫描。
+    """
+    query = fts_query(position)
+    if query and 'occupations_fts' in dataset_tables():
+        cursor.execute('''
+            SELECT soc_code, title
+            FROM occupations_fts
+            WHERE occupations_fts MATCH ?
+            ORDER BY bm25(occupations_fts, ?, ?, ?, ?)
+        ''', (query, *FTS_WEIGHTS))
+        return cursor.fetchall()
+    cursor.execute('''
+        SELECT DISTINCT soc_code, title 
+        FROM occupations 
+        WHERE title LIKE ? OR description LIKE ?
+    ''', ('%' + position + '%', '%' + position + '%'))
+    return cursor.fetchall()
+
+
+@app.route('/livez')
+def liveness():
+    """存活探针：进程能处理请求即返回 200，不访问数据集和数据库（失败时应重启进程）"""
+    return jsonify({'alive': True})
+
+
+@app.route('/readyz')
 @app.route('/health')
 def health():
-    """健康检查：数据库是否就绪。就绪返回200，否则503。"""
+    """就绪探针：当前数据集可以提供查询时返回 200，否则 503
+
+    状态在加载数据集时计算一次（dataset_readiness），之后的探针只读内存、不执行 SQL；数据集热切换后随之更新。
+    """
     try:
         if not os.path.exists(DB_PATH):
             return jsonify({
                 'ready': False,
                 'reason': 'db_file_missing'
             }), 503
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        # 确认三张表存在
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = {row[0] for row in cursor.fetchall()}
-        required = {'wage_data', 'geography', 'occupations'}
-        if not required.issubset(tables):
-            conn.close()
-            return jsonify({'ready': False, 'reason': 'tables_missing', 'tables': list(tables)}), 503
-        # 行数>0视为就绪
-        cursor.execute("SELECT COUNT(*) FROM wage_data")
-        w = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM geography")
-        g = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM occupations")
-        o = cursor.fetchone()[0]
-        conn.close()
-        ready = (w > 0 and g > 0 and o > 0)
-        return (jsonify({'ready': ready, 'counts': {'wage_data': w, 'geography': g, 'occupations': o}}), 200) if ready else \
-               (jsonify({'ready': False, 'counts': {'wage_data': w, 'geography': g, 'occupations': o}}), 503)
+        dataset = current_dataset()
+        state = {**dataset_readiness(dataset), 'dataset_version': dataset_version(dataset)}
     except Exception as e:
         return jsonify({'ready': False, 'error': str(e)}), 503
+    return jsonify(state), 200 if state['ready'] else 503
 
 @app.route('/')
 def index():
@@ -182,7 +491,7 @@ def debug():
             <p><a href="/">返回主页</a></p>
             """
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查表是否存在
@@ -220,8 +529,6 @@ def debug():
         cursor.execute("SELECT title FROM occupations LIMIT 5")
         sample_occupations = cursor.fetchall()
         
-        conn.close()
-        
         return f"""
         <h1>数据库调试信息</h1>
         <p>数据库文件: {DB_PATH}</p>
@@ -244,63 +551,170 @@ def debug():
         <p><a href='/'>返回主页</a></p>
         """
 
-@app.route('/api/search/forward', methods=['POST'])
-def forward_search():
-    """正向查询：职位名称+地区 → Level 1-4薪资"""
-    data = request.json
-    position = data.get('position', '').strip()
-    location = data.get('location', '').strip()
-    county = data.get('county', '').strip()
-    
-    if not position or not location:
-        return jsonify({'error': 'Job title and location cannot be empty'}), 400
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # 查询匹配的职业
-    cursor.execute('''
-        SELECT DISTINCT soc_code, title 
-        FROM occupations 
-        WHERE title LIKE ? OR description LIKE ?
-    ''', ('%' + position + '%', '%' + position + '%'))
-    
-    occupations = cursor.fetchall()
-    
-    if not occupations:
-        conn.close()
-        return jsonify({'error': 'No matching occupations found'}), 404
-    
+@app.before_request
+def start_request_metrics():
+    """开始统计本请求的耗时和 SQL"""
+    if app.config['METRICS']:
+        g.metrics = metrics.begin_request(request.endpoint)
+
+
+@app.after_request
+def add_server_timing(response):
+    """Server-Timing：本请求到响应头发出为止的总耗时和 SQL 耗时"""
+    stats = g.get('metrics')
+    if stats is not None:
+        response.headers['Server-Timing'] = stats.server_timing()
+        g.status = response.status_code
+        if inspect.isgenerator(response.response):
+            # 流式响应在 teardown 之后才生成：改为响应关闭（生成完毕）时记录，生成期间的 SQL 仍计入本请求
+            # （错误页等经 run_wsgi_app 转换的响应虽然 is_streamed，但不再执行查询，照常在 teardown 记录）
+            del g.metrics
+            labels = (request.endpoint or 'unmatched', request.method, response.status_code)
+            response.call_on_close(lambda: metrics.end_request(stats, *labels))
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(error):
+    """请求结束后记录请求指标（流式响应见 add_server_timing）"""
+    stats = g.pop('metrics', None)
+    if stats is not None:
+        metrics.end_request(stats, request.endpoint or 'unmatched', request.method,
+                            500 if error is not None else g.get('status', 500))
+
+
+@app.after_request
+def compress_json_response(response):
+    """按 Accept-Encoding 压缩 JSON 响应"""
+    if app.config['RESPONSE_COMPRESSION']:
+        compress_response(response, request.accept_encodings)
+    return response
+
+
+def results_response(rows, data, **extra):
+    """结果列表的 JSON 响应：默认 {'results': [...]}，format=compact 时按列输出、字符串列字典编码"""
+    if data.get('format') == 'compact':
+        return jsonify({**compact_results(rows), **extra})
+    return jsonify({'results': rows, **extra})
+
+
+def wants_stream(data):
+    """是否以 NDJSON 流式输出（stream=true 或 Accept: application/x-ndjson）"""
+    return bool(data.get('stream')) or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def respond_with_results(results, data, not_found_error):
+    """把查询结果（生成器）按请求参数输出
+
+    - 默认：{'results': [...]}，一次性返回全部结果（原行为）
+    - format=compact：按列输出，重复的字符串只列出一次（见 responses.compact_results），可与分页组合
+    - limit / cursor：分页，返回 {'results': [...], 'next_cursor': ...}，next_cursor 为 null 表示没有下一页
+    - stream=true 或 Accept: application/x-ndjson：NDJSON 流式输出，每行一个结果，边查询边发送；
+      分页时若还有下一页，最后追加一行 {"next_cursor": ...}
+    """
+    if data.get('format', 'json') not in ('json', 'compact'):
+        return jsonify({'error': 'Format must be json or compact'}), 400
+    try:
+        offset = int(data.get('cursor') or 0)
+        limit = int(data['limit']) if data.get('limit') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid pagination cursor or limit'}), 400
+    if offset < 0 or (limit is not None and limit <= 0):
+        return jsonify({'error': 'Invalid pagination cursor or limit'}), 400
+    
+    # 多取一条用于判断是否还有下一页
+    stop = offset + limit + 1 if limit is not None else None
+    results = itertools.islice(results, offset, stop)
+    first = next(results, None)
+    if first is None:
+        if offset:
+            return results_response([], data, next_cursor=None)
+        return jsonify({'error': not_found_error}), 404
+    
+    if wants_stream(data):
+        def generate():
+            count = 0
+            for row in itertools.chain([first], results):
+                count += 1
+                if limit is not None and count > limit:
+                    yield app.json.dumps({'next_cursor': str(offset + limit)}) + '\n'
+                    break
+                yield app.json.dumps(row) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    rows = [first]
+    rows.extend(results)
+    if limit is None:
+        return results_response(rows, data)
+    has_more = len(rows) > limit
+    return results_response(rows[:limit], data, next_cursor=str(offset + limit) if has_more else None)
+
+
+def fetch_forward_wages(cursor, soc_codes, areas):
+    """一次性取出 职业 × 地区 的全部薪资数据：{(area, soc_code): [level1..level4, average, label]}
+
+    调用方在内存中做哈希连接，避免逐个 (职业, 地区) 查询 wage_data 造成的 N+1 问题。
+    """
+    soc_codes = list(soc_codes)
+    areas = list(areas)
+    engine = get_wage_engine()
+    if engine is not None:
+        return engine.forward(soc_codes, areas)
+    wage_map = {}
+    if soc_codes and areas:
+        cursor.execute('''
+            SELECT area, soc_code, level1, level2, level3, level4, average, label
+            FROM wage_data
+            WHERE soc_code IN (%s) AND area IN (%s)
+            ORDER BY id
+        ''' % (','.join('?' * len(soc_codes)), ','.join('?' * len(areas))), soc_codes + areas)
+        for area, soc_code, *wage_row in cursor.fetchall():
+            # 与原逐条查询的 fetchone() 一致：同一 (地区, 职业) 只取第一条
+            wage_map.setdefault((area, soc_code), wage_row)
+    return wage_map
+
+
+# 按 (职业, 地区) 组合取薪资时每条语句最多的组合数（每个组合占 2 个 SQL 参数）
+PAIR_CHUNK_SIZE = 5000
+
+
+def fetch_wage_pairs(cursor, pairs):
+    """按指定的 (soc_code, area) 组合取出薪资数据，返回值同 fetch_forward_wages
+
+    批量查询中各组的职业和地区互不相同，只取真正需要的组合，避免 职业并集 × 地区并集 的膨胀。
+    """
+    engine = get_wage_engine()
+    wage_map = {}
+    if engine is not None:
+        areas_by_soc = {}
+        for soc_code, area in pairs:
+            areas_by_soc.setdefault(soc_code, set()).add(area)
+        for soc_code, areas in areas_by_soc.items():
+            wage_map.update(engine.forward([soc_code], areas))
+        return wage_map
+    pairs = sorted(pairs)
+    for start in range(0, len(pairs), PAIR_CHUNK_SIZE):
+        chunk = pairs[start:start + PAIR_CHUNK_SIZE]
+        cursor.execute('''
+            WITH wanted(soc_code, area) AS (VALUES %s)
+            SELECT w.area, w.soc_code, w.level1, w.level2, w.level3, w.level4, w.average, w.label
+            FROM wanted
+            JOIN wage_data w ON w.soc_code = wanted.soc_code AND w.area = wanted.area
+            ORDER BY w.id
+        ''' % ','.join(['(?, ?)'] * len(chunk)), [value for pair in chunk for value in pair])
+        for area, soc_code, *wage_row in cursor.fetchall():
+            wage_map.setdefault((area, soc_code), wage_row)
+    return wage_map
+
+
+def build_forward_results(occupations, locations, wage_map):
+    """按 职业 × 地区 组合正向查询结果（按职位+地区+县去重，时薪换算为年薪）"""
     results = []
     seen_combinations = set()  # 用于去重
     
     for soc_code, title in occupations:
-        # 查询地理信息
-        if county:
-            cursor.execute('''
-                SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
-                FROM geography g
-                WHERE (g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?)
-                AND g.county_town_name LIKE ?
-            ''', ('%' + location + '%', '%' + location + '%', '%' + location + '%', '%' + county + '%'))
-        else:
-            cursor.execute('''
-                SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
-                FROM geography g
-                WHERE g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?
-            ''', ('%' + location + '%', '%' + location + '%', '%' + location + '%'))
-        
-        locations = cursor.fetchall()
-        
         for area, area_name, state, county_town in locations:
-            # 查询薪资数据
-            cursor.execute('''
-                SELECT level1, level2, level3, level4, average, label
-                FROM wage_data
-                WHERE area = ? AND soc_code = ?
-            ''', (area, soc_code))
-            
-            wage_data = cursor.fetchone()
+            wage_data = wage_map.get((area, soc_code))
             
             if wage_data:
                 level1, level2, level3, level4, average, label = wage_data
@@ -324,138 +738,386 @@ def forward_search():
                         'label': label
                     })
     
-    conn.close()
+    return results
+
+
+@app.route('/api/search/forward', methods=['GET', 'POST'])
+@http_cached()
+def forward_search():
+    """正向查询：职位名称+地区 → Level 1-4薪资"""
+    data = request_data()
+    position = data.get('position', '').strip()
+    location = data.get('location', '').strip()
+    county = data.get('county', '').strip()
+    
+    if not position or not location:
+        return jsonify({'error': 'Job title and location cannot be empty'}), 400
+    if data.get('format', 'json') not in ('json', 'compact'):
+        return jsonify({'error': 'Format must be json or compact'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # 查询匹配的职业（按相关度排序）
+    occupations = match_occupations(cursor, position)
+    
+    if not occupations:
+        return jsonify({'error': 'No matching occupations found'}), 404
+    
+    def compute():
+        # 解析地理信息（只解析一次，而不是每个职业查询一次；结果跨请求缓存）
+        locations = get_location_resolver().resolve(location, county)
+        
+        # 一次性取出 匹配职业 × 匹配地区 的全部薪资数据
+        wage_map = fetch_forward_wages(
+            cursor,
+            [soc_code for soc_code, _ in occupations],
+            {area for area, _, _, _ in locations}
+        )
+        return build_forward_results(occupations, locations, wage_map)
+    
+    results = list(cached_results('forward', [position.lower(), location.lower(), county.lower()], compute))
     
     if not results:
         return jsonify({'error': 'No matching wage data found'}), 404
     
-    return jsonify({'results': results})
+    return results_response(results, data)
+
+# 批量正向查询单次最多的条数
+MAX_BATCH_SIZE = 2000
+
 
-@app.route('/api/search/reverse', methods=['POST'])
+def read_batch_queries():
+    """读取批量查询：JSON 数组（或 {"queries": [...]}），或 CSV（上传文件字段 file / text/csv 请求体，
+    列名 position,location,county）。返回 [{position, location, county}]"""
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8-sig')
+    elif request.mimetype == 'text/csv':
+        text = request.get_data(as_text=True)
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('queries')
+        if not isinstance(data, list):
+            return None
+        return [item if isinstance(item, dict) else {} for item in data]
+    reader = csv.DictReader(io.StringIO(text))
+    return [{(key or '').strip().lower(): value for key, value in row.items()} for row in reader]
+
+
+@app.route('/api/search/forward/batch', methods=['POST'])
+def forward_search_batch():
+    """批量正向查询：多组 职位名称+地区 → 每组一行 NDJSON 结果
+
+    所有职位和地区各只解析一次，全部组合的薪资数据按 (职业, 地区) 分组连接一次取出，再逐组流式返回。
+    """
+    try:
+        queries = read_batch_queries()
+    except UnicodeDecodeError:  # 如 Excel 导出的 cp1252 CSV
+        return jsonify({'error': 'CSV file must be UTF-8 encoded'}), 400
+    if queries is None:
+        return jsonify({'error': 'Expected a JSON array of queries or a CSV file'}), 400
+    if len(queries) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} queries per batch'}), 400
+    
+    queries = [{
+        'position': str(q.get('position') or '').strip(),
+        'location': str(q.get('location') or '').strip(),
+        'county': str(q.get('county') or '').strip(),
+    } for q in queries]
+    
+    cursor = get_db().cursor()
+    resolver = get_location_resolver()
+    
+    # 相同的职位/地区输入只解析一次
+    occupations_by_position = {}
+    locations_by_input = {}
+    for q in queries:
+        if not q['position'] or not q['location']:
+            continue
+        if q['position'] not in occupations_by_position:
+            occupations_by_position[q['position']] = match_occupations(cursor, q['position'])
+        key = (q['location'], q['county'])
+        if key not in locations_by_input:
+            locations_by_input[key] = resolver.resolve(q['location'], q['county'])
+    
+    # 所有组合需要的薪资数据一次取出
+    pairs = set()
+    for q in queries:
+        if q['position'] and q['location']:
+            locations = locations_by_input[(q['location'], q['county'])]
+            for soc_code, _ in occupations_by_position[q['position']]:
+                pairs.update((soc_code, area) for area, _, _, _ in locations)
+    wage_map = fetch_wage_pairs(cursor, pairs)
+    
+    def generate():
+        for index, q in enumerate(queries):
+            line = {'index': index, **q}
+            if not q['position'] or not q['location']:
+                line.update(status=400, error='Job title and location cannot be empty')
+            else:
+                occupations = occupations_by_position[q['position']]
+                results = build_forward_results(
+                    occupations, locations_by_input[(q['location'], q['county'])], wage_map)
+                if not occupations:
+                    line.update(status=404, error='No matching occupations found')
+                elif not results:
+                    line.update(status=404, error='No matching wage data found')
+                else:
+                    line.update(status=200, results=results)
+            yield app.json.dumps(line) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/search/reverse', methods=['GET', 'POST'])
+@http_cached(vary=('Accept',))
 def reverse_search():
     """根据薪资查询：年薪范围+地区 → 符合条件的职位及level"""
-    data = request.json
-    min_salary = float(data.get('min_salary', 0))
-    max_salary = float(data.get('max_salary', 0))
+    data = request_data()
+    try:
+        min_salary = float(data.get('min_salary', 0))
+        max_salary = float(data.get('max_salary', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Salary range must be numeric'}), 400
     location = data.get('location', '').strip()
     county = data.get('county', '').strip()
     
     if not min_salary or not max_salary or not location:
         return jsonify({'error': 'Salary range and location cannot be empty'}), 400
     
+    # 参与匹配的 Level（默认只按 Level 2 筛选）
+    levels = parse_levels(data.get('levels', [2]))
+    if levels is None:
+        return jsonify({'error': 'Levels must be a non-empty list of 1-4'}), 400
+    
     # 将年薪转换为时薪进行比较
     min_hourly = min_salary / 2080
     max_hourly = max_salary / 2080
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
-    # 查询地理信息
-    if county:
-        cursor.execute('''
-            SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
-            FROM geography g
-            WHERE (g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?)
-            AND g.county_town_name LIKE ?
-        ''', ('%' + location + '%', '%' + location + '%', '%' + location + '%', '%' + county + '%'))
-    else:
-        cursor.execute('''
-            SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
-            FROM geography g
-            WHERE g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?
-        ''', ('%' + location + '%', '%' + location + '%', '%' + location + '%'))
-    
-    locations = cursor.fetchall()
+    # 解析地理信息（结果跨请求缓存）
+    locations = get_location_resolver().resolve(location, county)
     
     if not locations:
-        conn.close()
         return jsonify({'error': 'No matching locations found'}), 404
     
-    results = []
-    
-    for area, area_name, state, county_town in locations:
-        # 查询薪资数据 - 只查询Level 2在指定年薪范围内的职位
-        cursor.execute('''
+    results = cached_results(
+        'reverse', [min_hourly, max_hourly, location.lower(), county.lower(), levels],
+        lambda: iter_reverse_results(cursor, locations, min_hourly, max_hourly, levels), wants_stream(data))
+    return respond_with_results(results, data, 'No matching salary data found')
+
+
+def parse_levels(value):
+    """levels 参数（[1, 2] 或 "1,2"）→ 去重排序的 Level 列表，不合法时返回 None"""
+    if isinstance(value, str):
+        value = value.split(',')
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    try:
+        levels = sorted({int(level) for level in value})
+    except (TypeError, ValueError):
+        return None
+    if not levels or not set(levels) <= {1, 2, 3, 4}:
+        return None
+    return levels
+
+
+def fetch_reverse_wages(cursor, area, min_hourly, max_hourly, levels):
+    """某地区任一选中 Level 的时薪落在 [min, max] 内的行，按行号排序
+
+    按 wage_levels 的 (地区, Level, 时薪) 主键对每个 Level 做一次区间查找；
+    旧数据库没有 wage_levels 时退回逐行判断各 Level 的扫描。
+    """
+    if 'wage_levels' in dataset_tables():
+        return cursor.execute('''
             SELECT w.soc_code, w.level1, w.level2, w.level3, w.level4, w.average, w.label,
                    o.title
             FROM wage_data w
             JOIN occupations o ON w.soc_code = o.soc_code
-            WHERE w.area = ? AND w.level2 IS NOT NULL AND w.level2 >= ? AND w.level2 <= ?
-        ''', (area, min_hourly, max_hourly))
-        
-        wage_data = cursor.fetchall()
+            WHERE w.id IN (
+                SELECT wage_id FROM wage_levels
+                WHERE area = ? AND level IN (%s) AND wage >= ? AND wage <= ?
+            )
+            ORDER BY w.id, o.id
+        ''' % ','.join('?' * len(levels)), (area, *levels, min_hourly, max_hourly))
+    conditions = ' OR '.join(
+        f'(w.level{level} IS NOT NULL AND w.level{level} >= ? AND w.level{level} <= ?)' for level in levels)
+    return cursor.execute('''
+        SELECT w.soc_code, w.level1, w.level2, w.level3, w.level4, w.average, w.label,
+               o.title
+        FROM wage_data w
+        JOIN occupations o ON w.soc_code = o.soc_code
+        WHERE w.area = ? AND (%s)
+        ORDER BY w.id, o.id
+    ''' % conditions, (area, *[bound for _ in levels for bound in (min_hourly, max_hourly)]))
+
+
+def iter_reverse_results(cursor, locations, min_hourly, max_hourly, levels=(2,)):
+    """逐行生成根据薪资查询的结果（SQLite 路径直接迭代游标，不整体读入内存）"""
+    engine = get_wage_engine()
+    
+    for area, area_name, state, county_town in locations:
+        # 查询薪资数据 - 任一选中 Level 在指定年薪范围内的职位
+        if engine is not None:
+            wage_data = engine.reverse(area, min_hourly, max_hourly, levels)
+        else:
+            wage_data = fetch_reverse_wages(cursor, area, min_hourly, max_hourly, levels)
         
         for soc_code, level1, level2, level3, level4, average, label, title in wage_data:
-            # 由于查询已经过滤了Level 2在范围内的职位，直接添加结果
-            results.append({
+            values = (level1, level2, level3, level4)
+            yield {
                 'occupation': title,
                 'soc_code': soc_code,
                 'location': area_name + ', ' + state,
                 'county': county_town,
-                'matching_levels': [{'level': 2, 'salary': round(level2 * 2080, 2)}],
+                'matching_levels': [
+                    {'level': level, 'salary': round(values[level - 1] * 2080, 2)}
+                    for level in levels
+                    if values[level - 1] is not None and min_hourly <= values[level - 1] <= max_hourly
+                ],
                 'level1': round(level1 * 2080, 2) if level1 else None,
                 'level2': round(level2 * 2080, 2) if level2 else None,
                 'level3': round(level3 * 2080, 2) if level3 else None,
                 'level4': round(level4 * 2080, 2) if level4 else None,
                 'label': label
-            })
-    
-    conn.close()
-    
-    if not results:
-        return jsonify({'error': 'No matching salary data found'}), 404
-    
-    return jsonify({'results': results})
+            }
 
-@app.route('/api/search/location', methods=['POST'])
+@app.route('/api/search/location', methods=['GET', 'POST'])
+@http_cached(vary=('Accept',))
 def location_search():
     """地区查询：职位和薪资水平 → 显示哪个州可以达到指定level的水平"""
-    data = request.json
+    data = request_data()
     position = data.get('position', '').strip()
-    target_level = int(data.get('target_level', 2))
-    target_salary = float(data.get('target_salary', 0))
+    try:
+        target_level = int(data.get('target_level', 2))
+        target_salary = float(data.get('target_salary', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Target level and target salary must be numeric'}), 400
     
     if not position or not target_level or not target_salary:
         return jsonify({'error': 'Job title, target level and target salary cannot be empty'}), 400
+    if target_level not in (1, 2, 3, 4):
+        return jsonify({'error': 'Target level must be 1-4'}), 400
+    
+    # 每个职业最多返回的地区数（可选）
+    top_k = data.get('top_k')
+    if top_k is not None:
+        try:
+            top_k = int(top_k)
+        except (TypeError, ValueError):
+            top_k = 0
+        if top_k < 1:
+            return jsonify({'error': 'top_k must be a positive integer'}), 400
     
     # 将年薪转换为时薪进行比较
     target_hourly = target_salary / 2080
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
-    # 查询匹配的职业
-    cursor.execute('''
-        SELECT DISTINCT soc_code, title 
-        FROM occupations 
-        WHERE title LIKE ? OR description LIKE ?
-    ''', ('%' + position + '%', '%' + position + '%'))
-    
-    occupations = cursor.fetchall()
+    # 查询匹配的职业（按相关度排序）
+    occupations = match_occupations(cursor, position)
     
     if not occupations:
-        conn.close()
         return jsonify({'error': 'No matching occupations found'}), 404
     
-    results = []
-    seen_combinations = set()  # 用于按州和县去重
+    # 州过滤（可选）
+    states = resolve_states(cursor, data.get('state', ''))
     
-    for soc_code, title in occupations:
-        # 查询薪资数据，按州和县分组
+    results = cached_results(
+        'location', [position.lower(), target_level, target_hourly, sorted(states) if states is not None else None, top_k],
+        lambda: iter_location_results(cursor, occupations, target_level, target_hourly, states, top_k),
+        wants_stream(data))
+    return respond_with_results(results, data, 'No matching locations found')
+
+
+def resolve_states(cursor, value):
+    """state 参数（州名或缩写，多个用逗号分隔）→ 匹配的州名集合，未指定时返回 None
+
+    先按州名或缩写精确匹配（不区分大小写），没有时再按州名包含输入匹配。
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    names = [str(name).strip().lower() for name in value or () if str(name).strip()]
+    if not names:
+        return None
+    cursor.execute('SELECT DISTINCT state, state_ab FROM geography WHERE state IS NOT NULL')
+    known = cursor.fetchall()
+    states = set()
+    for name in names:
+        exact = {state for state, state_ab in known if name in (state.lower(), (state_ab or '').lower())}
+        states |= exact or {state for state, _ in known if name in state.lower()}
+    return states
+
+
+def _geo_order(row):
+    """(州, 县) 的排序键，与 SQL 中 NULL 排在最前的升序一致"""
+    state, county = row[6], row[7]
+    return (state is not None, state or '', county is not None, county or '')
+
+
+def fetch_location_wages(cursor, soc_code, target_level, target_hourly, states=None):
+    """某职业目标 Level ≥ target 的每个 (州, 县) 及其最低值，按最低值升序、同值按 (州, 县) 排序，
+    生成 (level1..level4, average, label, state, county, min_target_salary)
+
+    location_leaderboard 按 (职业, Level, 时薪) 聚簇，从 target 处开始顺序读取即为升序，
+    调用方只取前几个地区时不必读完；同一时薪的地区在 Python 中按 (州, 县) 排序。
+    旧数据库没有 location_leaderboard 时退回 GROUP BY 查询。
+    """
+    state_filter = ' AND g.state IN (%s)' % ','.join('?' * len(states)) if states is not None else ''
+    params = tuple(sorted(states)) if states is not None else ()
+    if 'location_leaderboard' not in dataset_tables():
         level_column = 'level' + str(target_level)
-        cursor.execute('''
+        yield from cursor.execute('''
             SELECT w.level1, w.level2, w.level3, w.level4, w.average, w.label,
                    g.state, g.county_town_name, 
                    MIN(w.''' + level_column + ''') as min_target_salary
             FROM wage_data w
             JOIN geography g ON w.area = g.area
-            WHERE w.soc_code = ? AND w.''' + level_column + ''' IS NOT NULL AND w.''' + level_column + ''' >= ?
+            WHERE w.soc_code = ? AND w.''' + level_column + ''' IS NOT NULL AND w.''' + level_column + ''' >= ?''' + state_filter + '''
             GROUP BY g.state, g.county_town_name
             ORDER BY min_target_salary ASC
-        ''', (soc_code, target_hourly))
-        
-        wage_data = cursor.fetchall()
+        ''', (soc_code, target_hourly, *params))
+        return
+    
+    rows = cursor.execute('''
+        SELECT w.level1, w.level2, w.level3, w.level4, w.average, w.label,
+               g.state, g.county_town_name, l.wage, l.wage_id
+        FROM location_leaderboard l
+        JOIN wage_data w ON w.id = l.wage_id
+        JOIN geography g ON g.area = l.area
+        WHERE l.soc_code = ? AND l.level = ? AND l.wage >= ?''' + state_filter + '''
+        ORDER BY l.wage, l.wage_id
+    ''', (soc_code, target_level, target_hourly, *params))
+    
+    # 按时薪升序读取时，每个 (州, 县) 第一次出现的就是其最低值（同值取行号最小者）
+    seen = set()
+    for _, tied in itertools.groupby(rows, key=lambda row: row[8]):
+        for row in sorted(tied, key=lambda row: (_geo_order(row), row[9])):
+            if (row[6], row[7]) not in seen:
+                seen.add((row[6], row[7]))
+                yield row[:9]
+
+
+def iter_location_results(cursor, occupations, target_level, target_hourly, states=None, top_k=None):
+    """逐行生成地区查询的结果（SQLite 路径直接迭代游标，不整体读入内存）
+
+    states 限定州名集合；top_k 为每个职业最多返回的地区数（达到后不再读取该职业的其余地区）。
+    """
+    seen_combinations = set()  # 用于按州和县去重
+    
+    engine = get_wage_engine()
+    
+    for soc_code, title in occupations:
+        # 查询薪资数据，按州和县分组
+        if engine is not None:
+            wage_data = engine.location(soc_code, target_level, target_hourly, states)
+        else:
+            wage_data = fetch_location_wages(cursor, soc_code, target_level, target_hourly, states)
         
+        count = 0
         for row in wage_data:
             level1, level2, level3, level4, average, label, state, county_town, min_target_salary = row
             
@@ -465,7 +1127,7 @@ def location_search():
             if unique_key not in seen_combinations:
                 seen_combinations.add(unique_key)
                 
-                results.append({
+                yield {
                     'occupation': title,
                     'soc_code': soc_code,
                     'location': state,  # 只显示州名称
@@ -477,79 +1139,149 @@ def location_search():
                     'level3': round(level3 * 2080, 2) if level3 else None,
                     'level4': round(level4 * 2080, 2) if level4 else None,
                     'label': label
-                })
-    
-    conn.close()
-    
-    if not results:
-        return jsonify({'error': 'No matching locations found'}), 404
-    
-    return jsonify({'results': results})
+                }
+                count += 1
+                if top_k is not None and count >= top_k:
+                    break
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """查询结果缓存和地区解析缓存的命中统计"""
+    stats = {'enabled': app.config['RESULT_CACHE'], **result_cache.stats()}
+    dataset = current_dataset()
+    resolver = dataset.objects.get('location_resolver')
+    return jsonify({
+        'dataset_version': dataset.objects.get('version'),
+        'result_cache': stats,
+        'location_resolver': {'hits': resolver.hits, 'misses': resolver.misses} if resolver else None,
+    })
+
+@app.route('/api/slow-queries', methods=['GET', 'DELETE'])
+@admin_only
+def slow_queries():
+    """本进程的慢查询汇总（按语句形状，附最慢一次的耗时、行数和查询计划，不含参数）；DELETE 清空"""
+    if request.method == 'DELETE':
+        metrics.slow_log.clear()
+    return jsonify({'metrics': app.config['METRICS'], **metrics.slow_log.stats()})
+
+CACHE_LOOKUPS = metrics.registry.counter('oflc_cache_lookups_total', '查询结果缓存、地区解析缓存的查找次数',
+                                         ('cache', 'result'))
+CACHE_HIT_RATIO = metrics.registry.gauge('oflc_cache_hit_ratio', '缓存命中率（由汇总后的查找次数计算）', ('cache',))
+
+
+@metrics.registry.collector
+def collect_cache_metrics():
+    """把结果缓存、地区解析器自己维护的命中计数同步到指标（地区解析器随数据集切换重新计数）"""
+    CACHE_LOOKUPS.set(('result', 'memory_hit'), result_cache.hits - result_cache.disk_hits)
+    CACHE_LOOKUPS.set(('result', 'disk_hit'), result_cache.disk_hits)
+    CACHE_LOOKUPS.set(('result', 'miss'), result_cache.misses)
+    resolver = datasets.current.objects.get('location_resolver')
+    if resolver is not None:
+        CACHE_LOOKUPS.set(('location', 'hit'), resolver.hits)
+        CACHE_LOOKUPS.set(('location', 'miss'), resolver.misses)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标（文本格式）；设置 METRICS_DIR 时汇总全部 worker"""
+    snapshot = metrics.registry.collect()
+    lookups = snapshot.get(CACHE_LOOKUPS.name, {})
+    ratios = snapshot.setdefault(CACHE_HIT_RATIO.name, {})
+    for cache, hits in (('result', ('memory_hit', 'disk_hit')), ('location', ('hit',))):
+        hit = sum(lookups.get(metrics.label_key((cache, result)), 0) for result in hits)
+        total = hit + lookups.get(metrics.label_key((cache, 'miss')), 0)
+        if total:
+            ratios[metrics.label_key((cache,))] = round(hit / total, 4)
+    return Response(metrics.registry.render(snapshot), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/occupations')
+@http_cached()
 def get_occupations():
     """获取所有职业列表"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('SELECT DISTINCT soc_code, title FROM occupations ORDER BY title')
     occupations = cursor.fetchall()
     
-    conn.close()
-    
     return jsonify({'occupations': [{'soc_code': soc, 'title': title} for soc, title in occupations]})
 
 @app.route('/api/locations')
+@http_cached()
 def get_locations():
     """获取所有地区列表"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('SELECT DISTINCT state, area_name FROM geography ORDER BY state, area_name')
     locations = cursor.fetchall()
     
-    conn.close()
-    
     return jsonify({'locations': [{'state': state, 'area_name': area} for state, area in locations]})
 
 @app.route('/api/search/occupations')
+@http_cached()
 def search_occupations():
     """搜索职业"""
     query = request.args.get('q', '').strip()
     if not query:
         return jsonify({'occupations': []})
     
-    conn = sqlite3.connect(DB_PATH)
+    index = get_autocomplete_index()
+    if index is not None:
+        return jsonify({'occupations': index.occupations(query)})
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    # 改进搜索逻辑：优先匹配标题，然后匹配描述
-    cursor.execute('''
-        SELECT DISTINCT soc_code, title 
-        FROM occupations 
-        WHERE title LIKE ?
-        ORDER BY 
-            CASE 
-                WHEN title LIKE ? THEN 1
-                WHEN title LIKE ? THEN 2
-                ELSE 3
-            END,
-            title
-        LIMIT 20
-    ''', ('%' + query + '%', query + '%', '%' + query + '%'))
+    # 全文索引匹配标题和O*NET别名标题：标题以输入开头的优先，其余按BM25相关度排序
+    occupations = None
+    fts = fts_query(query, columns=('title', 'alt_titles'))
+    if fts and 'occupations_fts' in dataset_tables():
+        cursor.execute('''
+            SELECT soc_code, title
+            FROM occupations_fts
+            WHERE occupations_fts MATCH ?
+            ORDER BY
+                CASE WHEN title LIKE ? THEN 1 ELSE 2 END,
+                bm25(occupations_fts, ?, ?, ?, ?),
+                title
+            LIMIT 20
+        ''', (fts, query + '%', *FTS_WEIGHTS))
+        occupations = cursor.fetchall()
     
-    occupations = cursor.fetchall()
-    conn.close()
+    if occupations is None:
+        # 旧数据库没有全文索引：优先匹配标题开头，然后匹配标题中间
+        cursor.execute('''
+            SELECT DISTINCT soc_code, title 
+            FROM occupations 
+            WHERE title LIKE ?
+            ORDER BY 
+                CASE 
+                    WHEN title LIKE ? THEN 1
+                    WHEN title LIKE ? THEN 2
+                    ELSE 3
+                END,
+                title
+            LIMIT 20
+        ''', ('%' + query + '%', query + '%', '%' + query + '%'))
+        
+        occupations = cursor.fetchall()
     
     return jsonify({'occupations': [{'soc_code': soc, 'title': title} for soc, title in occupations]})
 
 @app.route('/api/search/states')
+@http_cached()
 def search_states():
     """搜索州"""
     query = request.args.get('q', '').strip()
     if not query:
         return jsonify({'states': []})
     
-    conn = sqlite3.connect(DB_PATH)
+    index = get_autocomplete_index()
+    if index is not None:
+        return jsonify({'states': index.states(query)})
+    
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -561,11 +1293,11 @@ def search_states():
     ''', ('%' + query + '%', '%' + query + '%'))
     
     states = cursor.fetchall()
-    conn.close()
     
     return jsonify({'states': [{'state': state, 'state_ab': state_ab} for state, state_ab in states]})
 
 @app.route('/api/search/counties')
+@http_cached()
 def search_counties():
     """搜索县/镇"""
     query = request.args.get('q', '').strip()
@@ -574,7 +1306,11 @@ def search_counties():
     if not query:
         return jsonify({'counties': []})
     
-    conn = sqlite3.connect(DB_PATH)
+    index = get_autocomplete_index()
+    if index is not None:
+        return jsonify({'counties': index.counties(query, state)})
+    
+    conn = get_db()
     cursor = conn.cursor()
     
     if state:
@@ -595,87 +1331,69 @@ def search_counties():
         ''', ('%' + query + '%',))
     
     counties = cursor.fetchall()
-    conn.close()
     
     return jsonify({'counties': [{'county': county[0]} for county in counties]})
 
-@app.route('/api/init-db', methods=['POST'])
+@app.route('/api/init-db', methods=['GET', 'POST'])
 def force_init_db():
-    """强制重新初始化数据库"""
-    try:
-        # 删除现有数据库
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
-            print("已删除现有数据库")
-        
-        # 重新初始化
-        init_database()
-        
-        # 检查数据
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM wage_data")
-        wage_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM geography")
-        geo_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM occupations")
-        occ_count = cursor.fetchone()[0]
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'message': '数据库重新初始化成功',
-            'data_counts': {
-                'wage_data': wage_count,
-                'geography': geo_count,
-                'occupations': occ_count
-            }
-        })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    """重新初始化数据库：POST 在后台重建并热切换（返回 202），GET 查询重建进度
+
+    新版本在 versions/ 下构建、校验、预热之后才替换当前数据库，重建期间查询照常使用旧版本。
+    请求体为 {"wait": true} 时等待重建完成再返回（与原来的同步接口相同的结果格式）。
+    """
+    if request.method == 'GET':
+        return jsonify(datasets.status())
+    job = datasets.start_rebuild()
+    if job is None:
+        return jsonify({'success': False, 'error': 'A rebuild is already in progress',
+                        'status': datasets.status()}), 409
+    if not (request.get_json(silent=True) or {}).get('wait'):
+        return jsonify({'success': True, 'message': '已开始后台重建', 'status': datasets.status()}), 202
+    job.join()
+    status = datasets.status()
+    if status['state'] != 'done':
+        return jsonify({'success': False, 'error': status.get('error'), 'status': status}), 500
+    return jsonify({
+        'success': True,
+        'message': '数据库重新初始化成功',
+        'data_counts': status['counts'],
+        'status': status,
+    })
 
 @app.route('/init-db-simple')
 def init_db_simple():
-    """简单的数据库重新初始化页面"""
-    try:
-        # 删除现有数据库
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
-            print("已删除现有数据库")
-        
-        # 重新初始化
-        init_database()
-        
-        # 检查数据
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM wage_data")
-        wage_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM geography")
-        geo_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM occupations")
-        occ_count = cursor.fetchone()[0]
-        conn.close()
-        
+    """简单的数据库重新初始化页面：启动后台重建后跳转到进度页（重建进行中时只显示进度），每 2 秒刷新"""
+    if 'status' not in request.args:
+        datasets.start_rebuild()
+        return redirect(url_for('init_db_simple', status=1))
+
+    status = datasets.status()
+    if status['state'] in BUSY_STATES:
+        return f"""
+        <meta http-equiv="refresh" content="2">
+        <h1>正在重建数据库…</h1>
+        <p>阶段: {status['state']} {status.get('stage') or ''}（{status.get('step')}/{status.get('steps')}），
+        本阶段已导入 {status.get('rows', 0)} 行，已用时 {status.get('elapsed')}s</p>
+        <p>重建期间查询照常使用当前数据库，完成后自动切换。</p>
+        """
+    if status['state'] == 'done':
+        counts = status['counts']
         return f"""
         <h1>数据库重新初始化完成</h1>
-        <p style="color: green;">✅ 数据库重新初始化成功！</p>
-        <p>薪资数据行数: {wage_count}</p>
-        <p>地理数据行数: {geo_count}</p>
-        <p>职业数据行数: {occ_count}</p>
+        <p style="color: green;">✅ 数据库重新初始化成功！（{status['seconds']:.1f}s，数据版本 {status['version']}）</p>
+        <p>薪资数据行数: {counts['wage_data']}</p>
+        <p>地理数据行数: {counts['geography']}</p>
+        <p>职业数据行数: {counts['occupations']}</p>
         <p><a href="/debug">查看详细调试信息</a></p>
         <p><a href="/">返回主页测试搜索功能</a></p>
         """
-    except Exception as e:
-        return f"""
-        <h1>数据库重新初始化失败</h1>
-        <p style="color: red;">❌ 错误: {str(e)}</p>
-        <p><a href="/debug">返回调试页面</a></p>
-        <p><a href="/">返回主页</a></p>
-        """
+    return f"""
+    <h1>数据库重新初始化失败</h1>
+    <p style="color: red;">❌ 错误: {status.get('error') or status['state']}</p>
+    <p>当前数据库未被替换，查询照常可用。</p>
+    <p><a href="/debug">返回调试页面</a></p>
+    <p><a href="/">返回主页</a></p>
+    """
 
 if __name__ == '__main__':
     # 初始化数据库
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI 入口
+Flask 应用本身是同步的，这里把它包装成 ASGI 应用交给 uvicorn 运行：
+- 请求在有界线程池中执行（SQLite 查询是阻塞的），事件循环只负责收发：慢客户端、空闲的长连接不占线程
+- 线程全忙时最多再排队 ASGI_QUEUE 个请求，超出直接返回 503，不无限堆积
+- 客户端断开时取消请求：还在排队的直接丢弃，正在执行的中断当前 SQLite 语句（Connection.interrupt）
+  并停止继续生成结果，线程立即空出来处理下一个请求
+- 响应体分块发送，线程与事件循环之间的在途块数有上限：客户端接收慢时查询线程等待，结果不会堆在内存里
+
+用法:
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+    ASGI_THREADS=8 ASGI_QUEUE=64 uvicorn asgi:app ...
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from app import REQUEST_CANCEL_KEY, app as flask_app
+
+# 执行请求的线程数（即同时执行的请求数上限）
+DEFAULT_THREADS = 8
+# 线程全忙时允许排队的请求数
+DEFAULT_QUEUE = 64
+# 响应体按这个大小攒块发送（事件循环空闲时不等攒满，保证首字节时间）
+CHUNK_SIZE = 64 * 1024
+# 线程与事件循环之间最多在途的响应块数
+MAX_IN_FLIGHT = 4
+
+BUSY_BODY = b'{"error": "Server busy, please retry"}\n'
+
+
+class CancelToken:
+    """一个请求的取消状态：客户端断开时置位，并调用请求执行期间登记的回调（如 SQLite 连接的 interrupt）"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._finished = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        with self._lock:
+            if not self._finished:
+                self._callbacks.append(callback)
+
+    def cancel(self):
+        """客户端断开（事件循环线程调用）；请求已结束时不做任何事，以免打断线程接下来处理的其他请求"""
+        with self._lock:
+            if self.cancelled or self._finished:
+                return
+            self.cancelled = True
+            for callback in self._callbacks:
+                callback()
+
+    def finish(self):
+        """请求在线程中执行完毕，之后不再调用回调"""
+        with self._lock:
+            self._finished = True
+            self._callbacks.clear()
+
+
+class _ResponseChannel:
+    """执行线程 → 事件循环的响应消息通道，在途的响应块数有上限"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self._in_flight = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, message):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    def idle(self):
+        """事件循环已发完所有响应块"""
+        return self._in_flight == 0
+
+    def send_body(self, data):
+        """线程侧：等到有在途名额后交给事件循环发送，通道已关闭（客户端断开）时返回 False"""
+        with self._cond:
+            while self._in_flight >= MAX_IN_FLIGHT and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._in_flight += 1
+        self.put(('body', data))
+        return True
+
+    def sent(self):
+        """事件循环侧：一个响应块已发出"""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class AsgiApp:
+    """把 WSGI 应用包装为 ASGI 应用，请求在有界线程池中执行"""
+
+    def __init__(self, wsgi_app, threads=DEFAULT_THREADS, queue=DEFAULT_QUEUE):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_queue = queue
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.active = 0       # 已交给线程池（执行中 + 排队）的请求数
+        self.rejected = 0     # 因排队已满返回 503 的请求数
+        self.cancelled = 0    # 客户端断开而取消的请求数
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return  # 不支持 websocket
+
+        if self.active >= self.threads + self.max_queue:
+            self.rejected += 1
+            await send({'type': 'http.response.start', 'status': 503, 'headers': [
+                (b'content-type', b'application/json'), (b'retry-after', b'1')]})
+            await send({'type': 'http.response.body', 'body': BUSY_BODY})
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            return  # 请求体还没收完客户端就断开了
+
+        token = CancelToken()
+        environ = self._environ(scope, body, token)
+        channel = _ResponseChannel(asyncio.get_running_loop())
+        self.active += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._run, environ, token, channel)
+        future.add_done_callback(self._done)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            while True:
+                message = asyncio.ensure_future(channel.queue.get())
+                await asyncio.wait({message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not message.done():
+                    message.cancel()
+                    self.cancelled += 1
+                    token.cancel()
+                    return
+                kind, payload = message.result()
+                if kind == 'start':
+                    status, headers = payload
+                    await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': payload, 'more_body': True})
+                    channel.sent()
+                elif kind == 'end':
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                else:  # 'error'：响应头还没发出时返回 500，否则只能中止连接
+                    if payload:
+                        raise RuntimeError('WSGI application failed while streaming the response')
+                    await send({'type': 'http.response.start', 'status': 500,
+                                'headers': [(b'content-type', b'text/plain')]})
+                    await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+                    return
+        finally:
+            channel.close()
+            disconnected.cancel()
+
+    def _done(self, future):
+        self.active -= 1
+
+    def _run(self, environ, token, channel):
+        """在线程池中执行 WSGI 应用，把响应头和响应块交给事件循环"""
+        if token.cancelled:
+            token.finish()
+            return  # 排队期间客户端已断开
+        response = []
+        started = False
+        iterable = None
+        buffer, size = [], 0
+        try:
+            def start_response(status, headers, exc_info=None):
+                if exc_info and started:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                response[:] = [status, headers]
+                return write
+
+            def write(data):
+                """WSGI 的 write()：直接写出的数据追加到响应体，在返回的可迭代对象之前发送"""
+                nonlocal size
+                if data:
+                    buffer.append(data)
+                    size += len(data)
+
+            iterable = self.wsgi_app(environ, start_response)
+            for data in iterable:
+                if token.cancelled:
+                    return
+                if not started:
+                    channel.put(('start', response))
+                    started = True
+                if data:
+                    buffer.append(data)
+                    size += len(data)
+                if buffer and (size >= CHUNK_SIZE or channel.idle()):
+                    if not channel.send_body(b''.join(buffer)):
+                        return
+                    buffer, size = [], 0
+            if not started:
+                channel.put(('start', response))
+            if buffer and not channel.send_body(b''.join(buffer)):
+                return
+            channel.put(('end', None))
+        except Exception:
+            if not token.cancelled:
+                traceback.print_exc(file=environ['wsgi.errors'])
+                channel.put(('error', started))
+        finally:
+            try:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+            finally:
+                token.finish()
+
+    @staticmethod
+    async def _read_body(receive):
+        """读完请求体，客户端中途断开时返回 None"""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    def _environ(scope, body, token):
+        """ASGI scope → WSGI environ"""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            REQUEST_CANCEL_KEY: token,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsgiApp(
+    flask_app,
+    threads=int(os.environ.get('ASGI_THREADS', DEFAULT_THREADS)),
+    queue=int(os.environ.get('ASGI_QUEUE', DEFAULT_QUEUE)),
+)
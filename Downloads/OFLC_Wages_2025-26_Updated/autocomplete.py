@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+自动完成索引
+启动时从数据库读取职业、州、县名称，在进程内建立后缀有序数组，
+前端每次按键的 /api/search/occupations|states|counties 请求直接在内存中完成，不再访问 SQLite。
+匹配语义与原来的 LIKE '%q%'（不区分大小写的子串匹配）一致。
+"""
+
+import sqlite3
+from bisect import bisect_left
+
+# 默认每次返回的候选数量，与原 SQL 的 LIMIT 20 一致
+DEFAULT_LIMIT = 20
+
+
+class InfixIndex:
+    """子串查找：把每个字符串的所有后缀排序，查找 q 即二分定位以 q 开头的后缀区间"""
+
+    def __init__(self, keys):
+        entries = sorted(
+            (key[i:], key_id)
+            for key_id, key in enumerate(k.lower() for k in keys)
+            for i in range(len(key))
+        )
+        self._suffixes = [suffix for suffix, _ in entries]
+        self._ids = [key_id for _, key_id in entries]
+
+    def search(self, query):
+        """返回包含 query 的字符串编号集合"""
+        q = query.lower()
+        lo = bisect_left(self._suffixes, q)
+        hi = bisect_left(self._suffixes, q + '\U0010ffff', lo)
+        return set(self._ids[lo:hi])
+
+
+class AutocompleteIndex:
+    """职业、州、县的自动完成数据"""
+
+    def __init__(self, occupations, alt_titles, states, counties):
+        # 职业：[(soc_code, title)]，alt_titles: {soc_code: [O*NET 别名标题]}
+        self._occupations = occupations
+        self._occupation_titles = InfixIndex([title for _, title in occupations])
+        alt_keys = []
+        self._alt_owner = []
+        for i, (soc_code, _) in enumerate(occupations):
+            for alt in alt_titles.get(soc_code, ()):
+                alt_keys.append(alt)
+                self._alt_owner.append(i)
+        self._occupation_alts = InfixIndex(alt_keys)
+
+        # 州：按州名排序的 [(state, state_ab)]，州名和缩写都可匹配
+        self._states = sorted(states)
+        self._state_names = InfixIndex([state for state, _ in self._states])
+        self._state_abbrevs = InfixIndex([state_ab for _, state_ab in self._states])
+
+        # 县：按县名排序，记录每个县所在的州（用于按州过滤）
+        self._counties = sorted(counties)
+        self._county_states = [counties[county] for county in self._counties]
+        self._county_names = InfixIndex(self._counties)
+        self._all_state_names = sorted({state for states in counties.values() for state in states})
+        self._all_state_index = InfixIndex(self._all_state_names)
+
+    @classmethod
+    def load(cls, conn):
+        """从 SQLite 读取一次并建立索引"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT soc_code, title FROM occupations WHERE title IS NOT NULL')
+        occupations = cursor.fetchall()
+
+        alt_titles = {}
+        try:
+            cursor.execute("SELECT soc_code, alt_titles FROM occupations_fts WHERE alt_titles != ''")
+            for soc_code, alts in cursor.fetchall():
+                alt_titles[soc_code] = alts.split('; ')
+        except sqlite3.OperationalError:
+            pass  # 旧数据库没有全文索引表，只按标题匹配
+
+        cursor.execute('''
+            SELECT DISTINCT state, state_ab FROM geography
+            WHERE state IS NOT NULL AND state_ab IS NOT NULL
+        ''')
+        states = cursor.fetchall()
+
+        counties = {}
+        cursor.execute('''
+            SELECT DISTINCT county_town_name, state FROM geography
+            WHERE county_town_name IS NOT NULL
+        ''')
+        for county, state in cursor.fetchall():
+            counties.setdefault(county, set()).add(state)
+
+        return cls(occupations, alt_titles, states, counties)
+
+    def occupations(self, query, limit=DEFAULT_LIMIT):
+        """职业候选：标题以输入开头 > 标题包含输入 > 仅别名标题包含输入，同级按标题排序"""
+        q = query.lower()
+        in_title = self._occupation_titles.search(q)
+        in_alt = {self._alt_owner[i] for i in self._occupation_alts.search(q)}
+
+        def rank(i):
+            title = self._occupations[i][1]
+            if i in in_title:
+                tier = 1 if title.lower().startswith(q) else 2
+            else:
+                tier = 3
+            return tier, title
+
+        matched = sorted(in_title | in_alt, key=rank)[:limit]
+        return [{'soc_code': self._occupations[i][0], 'title': self._occupations[i][1]} for i in matched]
+
+    def states(self, query, limit=DEFAULT_LIMIT):
+        """州候选：州名或缩写包含输入，按州名排序"""
+        matched = sorted(self._state_names.search(query) | self._state_abbrevs.search(query))[:limit]
+        return [{'state': self._states[i][0], 'state_ab': self._states[i][1]} for i in matched]
+
+    def counties(self, query, state='', limit=DEFAULT_LIMIT):
+        """县候选：县名包含输入（可限定所在州名包含 state），按县名排序"""
+        matched = sorted(self._county_names.search(query))
+        if state:
+            states = {self._all_state_names[i] for i in self._all_state_index.search(state)}
+            matched = [i for i in matched if self._county_states[i] & states]
+        return [{'county': self._counties[i]} for i in matched[:limit]]
@@ -0,0 +1,1286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准脚本
+在进程内（Flask test client）对查询接口计时。当前目录下没有 ALC_Export.csv 时先用 generate_alc 生成合成数据
+（默认种子，与 benchmark_baseline.json 的数据版本相同），导入 app 时据此构建 wage_data.db
+
+用法:
+    python3 benchmark.py                # 运行全部基准
+    python3 benchmark.py forward        # 只运行指定基准
+    python3 benchmark.py routes --save-baseline   # 全部接口，保存为基线；不带参数时与基线比较，有退化时退出码为 1
+"""
+
+import concurrent.futures
+import contextlib
+import csv
+import http.client
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import generate_alc
+
+# 必须在导入 app 之前：app 导入时按 ALC_Export.csv 初始化数据库
+generate_alc.ensure_alc()
+
+import app as wage_app
+import build_db
+import metrics
+from wage_engine import ColumnarWageEngine
+
+# 除 cache 基准外都测量实际查询，关闭查询结果缓存
+wage_app.app.config['RESULT_CACHE'] = False
+# 宽查询会让慢查询日志刷屏
+metrics.slow_log.threshold = None
+
+FORWARD_CASES = [
+    {"position": "Manager", "location": "California"},
+    {"position": "Manager", "location": "California", "county": "Orange County"},
+    {"position": "Engineer", "location": "Texas"},
+    {"position": "Software", "location": "New York"},
+]
+
+# 三种查询各取几条有代表性的请求
+SEARCH_CASES = [
+    ('/api/search/forward', {"position": "Manager", "location": "California"}),
+    ('/api/search/forward', {"position": "Engineer", "location": "Texas"}),
+    ('/api/search/reverse', {"min_salary": 60000, "max_salary": 100000, "location": "California"}),
+    ('/api/search/reverse', {"min_salary": 60000, "max_salary": 100000, "location": "New York", "county": "Kings"}),
+    ('/api/search/location', {"position": "Marketing Manager", "target_level": 2, "target_salary": 80000}),
+    ('/api/search/location', {"position": "Software", "target_level": 4, "target_salary": 150000}),
+]
+
+# 职业匹配质量：(输入, 期望的 SOC 代码)
+OCCUPATION_QUALITY_CASES = [
+    ("Software Developer", "15-1252"),
+    ("registered nurse", "29-1141"),
+    ("Data Scientist", "15-2051"),
+    ("accountant", "13-2011"),
+    ("web developer", "15-1254"),
+    ("Marketing Manager", "11-2021"),
+    ("Chief Sustainability Officer", "11-1011"),
+    ("Manufacturing Engineer", "17-2112"),
+    ("Customs Broker", "13-1041"),
+    ("Health Informatics Specialist", "15-1211"),
+]
+
+# 按键风暴：逐字输入这些词，每个前缀（≥2 个字符）发一次自动完成请求
+KEYSTROKE_WORDS = [
+    ('/api/search/occupations', "Software Developers"),
+    ('/api/search/occupations', "Registered Nurse"),
+    ('/api/search/occupations', "Marketing Manager"),
+    ('/api/search/states', "California"),
+    ('/api/search/states', "New York"),
+    ('/api/search/counties', "Orange County"),
+    ('/api/search/counties', "Los Angeles County"),
+]
+
+# 大结果集：整州 + 宽薪资范围的根据薪资查询、常见职位的地区查询
+LARGE_CASES = [
+    ('/api/search/reverse', {"min_salary": 30000, "max_salary": 250000, "location": "California"}),
+    ('/api/search/location', {"position": "Manager", "target_level": 1, "target_salary": 30000}),
+]
+
+# 服务器模式负载测试：占用线程很久的宽查询
+BROAD_REQUESTS = [
+    ('POST', '/api/search/location', {"position": "Manager", "target_level": 1, "target_salary": 30000}),
+    ('POST', '/api/search/reverse', {"min_salary": 30000, "max_salary": 250000, "location": "California"}),
+]
+
+# 服务器模式：(名称, 启动命令, 额外环境变量)，{port} 替换为空闲端口
+SERVER_MODES = [
+    ("gunicorn sync", ['gunicorn', 'app:app', '--workers', '1', '--bind', '127.0.0.1:{port}'], {}),
+    ("uvicorn 2 线程", ['uvicorn', 'asgi:app', '--log-level', 'warning', '--port', '{port}'], {'ASGI_THREADS': '2'}),
+    ("uvicorn 8 线程", ['uvicorn', 'asgi:app', '--log-level', 'warning', '--port', '{port}'], {'ASGI_THREADS': '8'}),
+]
+
+# 生产启动器 vs Flask 开发服务器
+LAUNCHER_MODES = [
+    ("app.run", [sys.executable, 'app.py'], {'PORT': '{port}'}),
+    ("serve.py", [sys.executable, '-m', 'serve'], {'PORT': '{port}'}),
+    ("serve.py numpy 引擎", [sys.executable, '-m', 'serve'], {'PORT': '{port}', 'WAGE_ENGINE': 'numpy'}),
+]
+
+# 负载测试混合请求：模拟前端自动完成 + 小范围查询
+LOAD_REQUESTS = [
+    ('GET', '/api/search/occupations?q=man', None),
+    ('GET', '/api/search/states?q=cal', None),
+    ('GET', '/api/search/counties?q=ora', None),
+    ('GET', '/health', None),
+    ('POST', '/api/search/forward', {"position": "Marketing Manager", "location": "California", "county": "Orange County"}),
+]
+
+
+class QueryCounter:
+    """通过 sqlite3 trace 回调统计执行的 SQL 语句数"""
+
+    def __init__(self):
+        self.count = 0
+        self._connect = sqlite3.connect
+
+    def __enter__(self):
+        def connect(*args, **kwargs):
+            conn = self._connect(*args, **kwargs)
+            conn.set_trace_callback(self._trace)
+            return conn
+        sqlite3.connect = connect
+        wage_app.datasets.current.pool.reset()  # 让长连接在计数期间重新打开
+        return self
+
+    def __exit__(self, *exc):
+        sqlite3.connect = self._connect
+        wage_app.datasets.current.pool.reset()
+
+    def _trace(self, statement):
+        self.count += 1
+
+
+def percentile(samples, pct):
+    """返回样本的百分位数（最近秩法）"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def report(name, samples, queries=None):
+    """打印一组计时结果（毫秒）"""
+    line = (f"   {name:<28} p50={statistics.median(samples) * 1000:9.2f}ms  "
+            f"p99={percentile(samples, 99) * 1000:9.2f}ms")
+    if queries is not None:
+        line += f"  queries={queries}"
+    print(line)
+
+
+def legacy_forward_search(position, location, county=''):
+    """旧版正向查询的 N+1 实现（每个职业查询一次地理，每个职业×地区查询一次薪资），仅供对比"""
+    conn = sqlite3.connect(wage_app.DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT DISTINCT soc_code, title
+        FROM occupations
+        WHERE title LIKE ? OR description LIKE ?
+    ''', ('%' + position + '%', '%' + position + '%'))
+    results = []
+    seen_combinations = set()
+    for soc_code, title in cursor.fetchall():
+        if county:
+            cursor.execute('''
+                SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
+                FROM geography g
+                WHERE (g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?)
+                AND g.county_town_name LIKE ?
+            ''', ('%' + location + '%', '%' + location + '%', '%' + location + '%', '%' + county + '%'))
+        else:
+            cursor.execute('''
+                SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
+                FROM geography g
+                WHERE g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?
+            ''', ('%' + location + '%', '%' + location + '%', '%' + location + '%'))
+        for area, area_name, state, county_town in cursor.fetchall():
+            wage = conn.execute('''
+                SELECT level1, level2, level3, level4, average, label
+                FROM wage_data
+                WHERE area = ? AND soc_code = ?
+            ''', (area, soc_code)).fetchone()
+            unique_key = f"{title}_{area_name}_{state}_{county_town}"
+            if wage and unique_key not in seen_combinations:
+                seen_combinations.add(unique_key)
+                results.append((soc_code, area))
+    conn.close()
+    return results
+
+
+def bench_forward(rounds=10):
+    """正向查询：旧 N+1 循环 vs 集合式查询"""
+    print("=== 正向查询 (forward_search) ===")
+    client = wage_app.app.test_client()
+    for case in FORWARD_CASES:
+        print(f"-- {case}")
+        samples = []
+        with QueryCounter() as counter:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                legacy_forward_search(case['position'], case['location'], case.get('county', ''))
+                samples.append(time.perf_counter() - start)
+        report("旧版 N+1", samples, counter.count // rounds)
+
+        samples = []
+        with QueryCounter() as counter:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                response = client.post('/api/search/forward', json=case)
+                samples.append(time.perf_counter() - start)
+        report("集合式查询", samples, counter.count // rounds)
+        rows = len(response.get_json().get('results', []))
+        print(f"   结果行数: {rows}")
+
+
+def run_load(threads, requests_per_thread):
+    """多线程并发打请求，返回 (吞吐量 req/s, 单请求耗时样本)"""
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        client = wage_app.app.test_client()
+        local = []
+        for i in range(requests_per_thread):
+            method, url, body = LOAD_REQUESTS[i % len(LOAD_REQUESTS)]
+            start = time.perf_counter()
+            if method == 'GET':
+                client.get(url)
+            else:
+                client.post(url, json=body)
+            local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return len(samples) / elapsed, samples
+
+
+def bench_pool(threads=8, requests_per_thread=200):
+    """连接管理：每请求新建连接 vs 每线程长连接"""
+    print("=== 连接池负载测试 ===")
+    pool = wage_app.datasets.current.pool
+    original = pool.pooled
+    try:
+        for pooled, name in ((False, "每请求新建连接"), (True, "每线程长连接")):
+            pool.pooled = pooled
+            pool.reset()
+            throughput, samples = run_load(threads, requests_per_thread)
+            report(name, samples)
+            print(f"   吞吐量: {throughput:.0f} req/s ({threads} 线程)")
+    finally:
+        pool.pooled = original
+        pool.reset()
+
+
+def bench_engine(rounds=20):
+    """薪资引擎：SQLite vs numpy 列式"""
+    print("=== 薪资引擎 (WAGE_ENGINE) ===")
+    client = wage_app.app.test_client()
+    original = wage_app.app.config['WAGE_ENGINE']
+    try:
+        start = time.perf_counter()
+        with wage_app.app.app_context():
+            engine = ColumnarWageEngine.load(wage_app.get_db())
+        print(f"   列式引擎加载: {(time.perf_counter() - start) * 1000:.0f}ms, {len(engine)} 行")
+        for url, body in SEARCH_CASES:
+            print(f"-- {url} {body}")
+            for name in ('sqlite', 'numpy'):
+                wage_app.app.config['WAGE_ENGINE'] = name
+                client.post(url, json=body)  # 预热（numpy 引擎首次加载）
+                samples = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    client.post(url, json=body)
+                    samples.append(time.perf_counter() - start)
+                report(name, samples)
+    finally:
+        wage_app.app.config['WAGE_ENGINE'] = original
+
+
+def like_occupations(cursor, position):
+    """旧版 LIKE 全表扫描匹配职业，仅供对比"""
+    cursor.execute('''
+        SELECT DISTINCT soc_code, title
+        FROM occupations
+        WHERE title LIKE ? OR description LIKE ?
+    ''', ('%' + position + '%', '%' + position + '%'))
+    return cursor.fetchall()
+
+
+def bench_fts(rounds=200):
+    """职业匹配：LIKE 扫描 vs FTS5 + BM25（延迟和期望职业的排名）"""
+    print("=== 职业全文索引 (occupations_fts) ===")
+    conn = sqlite3.connect(wage_app.DB_PATH)
+    cursor = conn.cursor()
+    matchers = (("LIKE 扫描", like_occupations), ("FTS5 BM25", wage_app.match_occupations))
+    for name, match in matchers:
+        samples = []
+        ranks = []
+        for position, expected in OCCUPATION_QUALITY_CASES:
+            for _ in range(rounds // len(OCCUPATION_QUALITY_CASES)):
+                start = time.perf_counter()
+                rows = match(cursor, position)
+                samples.append(time.perf_counter() - start)
+            codes = [soc for soc, _ in rows]
+            ranks.append(codes.index(expected) + 1 if expected in codes else None)
+        report(name, samples)
+        found = [r for r in ranks if r]
+        mrr = sum(1.0 / r for r in found) / len(ranks)
+        print(f"   命中 {len(found)}/{len(ranks)}，MRR={mrr:.2f}，排名: {ranks}")
+    conn.close()
+
+
+def bench_autocomplete(threads=8, storms_per_thread=5):
+    """自动完成按键风暴：SQLite LIKE vs 进程内索引"""
+    print("=== 自动完成按键风暴 ===")
+    urls = [f"{endpoint}?q={word[:n]}" for endpoint, word in KEYSTROKE_WORDS for n in range(2, len(word) + 1)]
+    original = wage_app.app.config['AUTOCOMPLETE_INDEX']
+    try:
+        for enabled, name in ((False, "SQLite LIKE"), (True, "进程内索引")):
+            wage_app.app.config['AUTOCOMPLETE_INDEX'] = enabled
+            samples = []
+            lock = threading.Lock()
+
+            def worker():
+                client = wage_app.app.test_client()
+                local = []
+                for _ in range(storms_per_thread):
+                    for url in urls:
+                        start = time.perf_counter()
+                        client.get(url)
+                        local.append(time.perf_counter() - start)
+                with lock:
+                    samples.extend(local)
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            start = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - start
+            report(name, samples)
+            print(f"   吞吐量: {len(samples) / elapsed:.0f} req/s ({threads} 线程, {len(samples)} 次按键)")
+    finally:
+        wage_app.app.config['AUTOCOMPLETE_INDEX'] = original
+
+
+def batch_queries(n=1000, seed=7):
+    """从 oes_soc_occs.csv / Geography.csv 随机组合 n 个 (职位, 州, 县) 查询"""
+    rng = random.Random(seed)
+    with open('oes_soc_occs.csv', newline='') as f:
+        titles = [row['Title'] for row in csv.DictReader(f)]
+    with open('Geography.csv', newline='') as f:
+        places = [(row['State'], row['CountyTownName']) for row in csv.DictReader(f)]
+    queries = []
+    for _ in range(n):
+        state, county = rng.choice(places)
+        queries.append({"position": rng.choice(titles), "location": state, "county": county})
+    return queries
+
+
+def bench_batch(n=1000):
+    """批量正向查询：n 次单独请求 vs 一次批量请求"""
+    print("=== 批量正向查询 ===")
+    client = wage_app.app.test_client()
+    queries = batch_queries(n)
+
+    with QueryCounter() as counter:
+        start = time.perf_counter()
+        for query in queries:
+            client.post('/api/search/forward', json=query)
+        elapsed = time.perf_counter() - start
+    print(f"   {n} 次单独请求: {elapsed * 1000:9.1f}ms  queries={counter.count}")
+
+    with QueryCounter() as counter:
+        start = time.perf_counter()
+        response = client.post('/api/search/forward/batch', json=queries)
+        first_byte = time.perf_counter() - start
+        lines = sum(1 for _ in response.response)
+        elapsed = time.perf_counter() - start
+    print(f"   1 次批量请求:     {elapsed * 1000:9.1f}ms  queries={counter.count}  "
+          f"首字节={first_byte * 1000:.1f}ms  行数={lines}")
+
+
+def stream_worker(case_index, mode):
+    """子进程内执行一次大查询，输出 首字节时间 总时间 峰值RSS增量(MB) 行数"""
+    url, body = LARGE_CASES[int(case_index)]
+    if mode == 'stream':
+        body = dict(body, stream=True)
+    client = wage_app.app.test_client()
+    # 预热：建立连接和内存索引，不计入内存增量
+    client.post(url, json=dict(body, limit=1)).close()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    response = client.post(url, json=body, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+    first_byte = time.perf_counter() - start
+    rows = first.count(b'\n') if mode == 'stream' else 0
+    for chunk in chunks:
+        rows += chunk.count(b'\n') if mode == 'stream' else 0
+    response.close()
+    total = time.perf_counter() - start
+    if mode != 'stream':
+        rows = len(wage_app.app.json.loads(first).get('results', []))
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+    print(f"{first_byte} {total} {peak} {rows}")
+
+
+def bench_stream():
+    """大结果集：一次性 jsonify vs NDJSON 流式（首字节时间、总时间、峰值 RSS 增量）"""
+    print("=== 流式输出 ===")
+    for index, (url, body) in enumerate(LARGE_CASES):
+        print(f"-- {url} {body}")
+        for mode, name in (('buffered', "一次性 jsonify"), ('stream', "NDJSON 流式")):
+            output = subprocess.run(
+                [sys.executable, __file__, '_stream_worker', str(index), mode],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            first_byte, total, peak, rows = (float(v) for v in output[-4:])
+            print(f"   {name:<16} 首字节={first_byte * 1000:8.1f}ms  总时间={total * 1000:8.1f}ms  "
+                  f"峰值RSS增量={peak:7.1f}MB  行数={int(rows)}")
+
+
+def bench_cache(rounds=20):
+    """查询结果缓存：关闭缓存 vs 命中缓存"""
+    print("=== 查询结果缓存 ===")
+    client = wage_app.app.test_client()
+    original = wage_app.app.config['RESULT_CACHE']
+    try:
+        for path, case in SEARCH_CASES:
+            print(f"-- {path} {case}")
+            for enabled, name in ((False, "无缓存"), (True, "缓存命中")):
+                wage_app.app.config['RESULT_CACHE'] = enabled
+                wage_app.result_cache.clear()
+                client.post(path, json=case)  # 预热（开启缓存时写入缓存）
+                samples = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    client.post(path, json=case)
+                    samples.append(time.perf_counter() - start)
+                report(name, samples)
+        print(f"   统计: {wage_app.result_cache.stats()}")
+    finally:
+        wage_app.app.config['RESULT_CACHE'] = original
+
+
+# 大结果集的根据薪资查询（加利福尼亚全部地区、全部 Level）
+PAYLOAD_CASE = {"min_salary": 40000, "max_salary": 200000, "location": "California", "levels": [1, 2, 3, 4]}
+
+
+def cpu_time(func, rounds):
+    """func 的 CPU 时间样本（秒），返回 (样本, 最后一次的返回值)"""
+    samples, result = [], None
+    for _ in range(rounds):
+        start = time.process_time()
+        result = func()
+        samples.append(time.process_time() - start)
+    return samples, result
+
+
+def bench_payload(rounds=5):
+    """大结果集响应：默认 JSON vs compact，标准库 json vs orjson，不压缩 vs gzip / br（字节数、序列化 CPU）"""
+    from flask.json.provider import DefaultJSONProvider
+    from responses import OrjsonProvider, brotli, compact_results, compress, orjson
+    print("=== 响应体积与序列化 ===")
+    client = wage_app.app.test_client()
+    rows = client.post('/api/search/reverse', json=PAYLOAD_CASE).get_json()['results']
+    print(f"   /api/search/reverse {PAYLOAD_CASE}: {len(rows)} 行")
+    providers = [('json', DefaultJSONProvider(wage_app.app))]
+    if orjson is not None:
+        providers.append(('orjson', OrjsonProvider(wage_app.app)))
+    shapes = [('默认', lambda: {'results': rows}), ('compact', lambda: compact_results(rows))]
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+
+    print("-- 序列化 CPU（含 compact 编码）")
+    bodies = {}
+    with wage_app.app.app_context():
+        for shape, build in shapes:
+            for name, provider in providers:
+                samples, response = cpu_time(lambda: provider.response(build()), rounds)
+                bodies[shape] = response.get_data()
+                report(f"{shape} / {name}", samples)
+
+    print("-- 传输字节数（压缩 CPU）")
+    for shape, body in bodies.items():
+        print(f"   {shape + ' / identity':<28} {len(body):>10} 字节")
+        for encoding in encodings:
+            samples, compressed = cpu_time(lambda: compress(body, encoding), rounds)
+            print(f"   {shape + ' / ' + encoding:<28} {len(compressed):>10} 字节  "
+                  f"{len(body) / len(compressed):5.1f}x  p50={statistics.median(samples) * 1000:7.1f}ms")
+
+    print("-- 端到端（查询 + 序列化 + 压缩）")
+    for shape, body in (('默认', PAYLOAD_CASE), ('compact', {**PAYLOAD_CASE, 'format': 'compact'})):
+        for encoding in ['identity'] + encodings:
+            samples, response = cpu_time(
+                lambda: client.post('/api/search/reverse', json=body, headers={'Accept-Encoding': encoding}), rounds)
+            print(f"   {shape + ' / ' + encoding:<28} {len(response.data):>10} 字节  "
+                  f"CPU p50={statistics.median(samples) * 1000:7.1f}ms")
+
+
+# 可缓存的 GET 请求：列表、自动完成和 GET 形式的搜索
+HTTP_CACHE_URLS = [
+    '/api/occupations',
+    '/api/locations',
+    '/api/search/occupations?q=software',
+    '/api/search/forward?position=Manager&location=California',
+    '/api/search/reverse?min_salary=60000&max_salary=100000&location=California&county=Orange+County',
+    '/api/search/location?position=Software&target_level=2&target_salary=90000',
+]
+
+
+def bench_http_cache(rounds=20):
+    """HTTP 缓存：完整 200 响应 vs 带 If-None-Match 的条件请求（304，不执行查询）"""
+    print("=== HTTP 缓存（ETag 条件请求） ===")
+    client = wage_app.app.test_client()
+    for url in HTTP_CACHE_URLS:
+        print(f"-- GET {url}")
+        etag = client.get(url).headers['ETag']
+        for name, headers in (('200 完整响应', {}), ('304 条件请求', {'If-None-Match': etag})):
+            samples = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                response = client.get(url, headers=headers)
+                samples.append(time.perf_counter() - start)
+            report(name, samples)
+            print(f"   {'':<28} 状态 {response.status_code}，{len(response.data)} 字节")
+
+
+@contextlib.contextmanager
+def serve(command, env):
+    """在子进程中启动服务器（关闭结果缓存），就绪后 yield 端口，结束时停止"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    command = [arg.format(port=port) for arg in command]
+    env = {key: value.format(port=port) for key, value in env.items()}
+    process = subprocess.Popen(command, env={**os.environ, 'RESULT_CACHE': '0', **env},
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', '/health')
+                if conn.getresponse().status == 200:
+                    break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        yield port, process.pid
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def http_request(port, method, url, body, timeout=60, conn=None):
+    """发一个请求并读完响应，返回状态码；传入 conn 时复用该连接（keep-alive）"""
+    reuse = conn is not None
+    if not reuse:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request(method, url, body=json.dumps(body) if body is not None else None,
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        conn.close()
+        raise
+    finally:
+        if not reuse:
+            conn.close()
+
+
+def abandon_request(port, method, url, body, after):
+    """发出请求后 after 秒不等响应直接断开（模拟用户关闭页面）"""
+    payload = json.dumps(body).encode()
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(f'{method} {url} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+        time.sleep(after)
+
+
+def run_server_load(port, duration, fast_clients, broad_clients, abandon_after=None, keepalive=False):
+    """fast_clients 个线程循环发小请求，broad_clients 个线程循环发宽查询（abandon_after 不为空时中途断开），
+    keepalive=True 时每个小请求线程复用一个连接；返回 (小请求耗时样本, 小请求状态码计数, 完成的宽查询数)"""
+    samples, statuses, broad_done = [], {}, [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def fast_worker():
+        i = 0
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60) if keepalive else None
+        while time.perf_counter() < stop:
+            method, url, body = LOAD_REQUESTS[i % len(LOAD_REQUESTS)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                status = http_request(port, method, url, body, conn=conn)
+            except OSError:
+                status = 'error'
+            with lock:
+                samples.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    def broad_worker(k):
+        i = k
+        while time.perf_counter() < stop:
+            method, url, body = BROAD_REQUESTS[i % len(BROAD_REQUESTS)]
+            i += 1
+            try:
+                if abandon_after is None:
+                    http_request(port, method, url, body)
+                else:
+                    abandon_request(port, method, url, body, abandon_after)
+            except OSError:
+                pass
+            with lock:
+                broad_done[0] += 1
+
+    threads = [threading.Thread(target=fast_worker) for _ in range(fast_clients)]
+    threads += [threading.Thread(target=broad_worker, args=(k,)) for k in range(broad_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, statuses, broad_done[0]
+
+
+def bench_asgi(duration=10, fast_clients=8, broad_clients=4):
+    """服务器模式：gunicorn 同步 worker vs ASGI（不同线程数），宽查询与小请求混合、宽查询中途断开"""
+    print("=== 服务器模式 (ASGI) ===")
+    scenarios = (
+        ("宽查询占满 worker", None),
+        ("宽查询 0.3s 后断开", 0.3),
+    )
+    for scenario, abandon_after in scenarios:
+        print(f"-- {scenario}：{broad_clients} 个宽查询客户端 + {fast_clients} 个小请求客户端，{duration}s")
+        for name, command, env in SERVER_MODES:
+            with serve(command, env) as (port, _):
+                samples, statuses, broad = run_server_load(port, duration, fast_clients, broad_clients, abandon_after)
+            report(name, samples)
+            print(f"   {'':<28} 小请求={len(samples) / duration:6.1f} req/s  状态={statuses}  宽查询={broad}")
+
+
+def process_tree(pid):
+    """进程及其全部子进程的 pid"""
+    pids, pending = [], [pid]
+    while pending:
+        p = pending.pop()
+        pids.append(p)
+        try:
+            with open(f'/proc/{p}/task/{p}/children') as f:
+                pending.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def process_memory(pid):
+    """进程的 RSS / PSS / USS（MB），不支持 /proc/<pid>/smaps_rollup 时返回 None
+
+    PSS 把共享页面按共享的进程数分摊，USS 只计进程独占的页面。
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[1:2] != []
+                      and line.split()[1].isdigit()}
+    except OSError:
+        return None
+    return {
+        'rss': fields['Rss'] / 1024,
+        'pss': fields['Pss'] / 1024,
+        'uss': (fields['Private_Clean'] + fields['Private_Dirty']) / 1024,
+    }
+
+
+def tree_pss(pid):
+    """进程树的 PSS 之和（MB），不支持时返回 None"""
+    stats = [process_memory(p) for p in process_tree(pid)]
+    return sum(m['pss'] for m in stats) if all(stats) else None
+
+
+def wait_idle(pid, quiet=1.0, timeout=120):
+    """等进程树的 CPU 时间在 quiet 秒内不再增长（worker 都加载完毕）"""
+    def cpu_ticks():
+        total = 0
+        for p in process_tree(pid):
+            try:
+                with open(f'/proc/{p}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except OSError:
+                pass
+        return total
+    deadline = time.time() + timeout
+    last = cpu_ticks()
+    while time.time() < deadline:
+        time.sleep(quiet)
+        current = cpu_ticks()
+        if current == last:
+            return
+        last = current
+
+
+def bench_memory(workers=8, requests=400):
+    """多 worker 内存：numpy 引擎各 worker 自行加载 vs 主进程 preload 到共享内存（每个 worker 的 RSS/PSS/USS）"""
+    print("=== 多 worker 内存 (WAGE_ENGINE=numpy) ===")
+    modes = (
+        ("各 worker 自行加载", {'GUNICORN_PRELOAD': '0'}),
+        ("主进程 preload", {}),
+    )
+    for name, extra in modes:
+        env = {'PORT': '{port}', 'WEB_CONCURRENCY': str(workers), 'WAGE_ENGINE': 'numpy', **extra}
+        with serve([sys.executable, '-m', 'serve'], env) as (port, pid):
+            wait_idle(pid)
+            # 让每个 worker 都实际执行几次三种查询
+            with concurrent.futures.ThreadPoolExecutor(workers * 2) as pool:
+                list(pool.map(lambda i: http_request(port, 'POST', *SEARCH_CASES[i % len(SEARCH_CASES)]),
+                              range(requests)))
+            wait_idle(pid)
+            stats = [process_memory(p) for p in process_tree(pid)[1:]]
+            master = process_memory(pid)
+        if master is None or not all(stats):
+            print(f"   {name}: 当前系统不支持 /proc/<pid>/smaps_rollup")
+            continue
+        avg = {key: statistics.mean(m[key] for m in stats) for key in ('rss', 'pss', 'uss')}
+        total = master['pss'] + sum(m['pss'] for m in stats)
+        print(f"   {name:<20} {len(stats)} 个 worker，每个 worker 平均 RSS={avg['rss']:6.0f}MB  "
+              f"PSS={avg['pss']:6.0f}MB  USS={avg['uss']:6.0f}MB；主进程 RSS={master['rss']:.0f}MB；"
+              f"合计 PSS={total:.0f}MB")
+
+
+def bench_server(duration=10, clients=16):
+    """生产启动器：Flask 开发服务器（app.run）vs serve.py（gunicorn preload + gthread），keep-alive 连接"""
+    print("=== 生产启动器 (serve.py) ===")
+    print(f"-- {clients} 个客户端循环发小请求（keep-alive），{duration}s")
+    for name, command, env in LAUNCHER_MODES:
+        with serve(command, env) as (port, pid):
+            samples, statuses, _ = run_server_load(port, duration, clients, 0, keepalive=True)
+            pss = tree_pss(pid)
+        report(name, samples)
+        print(f"   {'':<28} 吞吐量={len(samples) / duration:7.1f} req/s  状态={statuses}  "
+              f"进程树 PSS={f'{pss:.0f}MB' if pss is not None else '未知'}")
+
+
+def legacy_location_wages(cursor, soc_code, target_level, target_hourly):
+    """旧版地区查询：每个职业 JOIN geography 后 GROUP BY (州, 县) 再按最低值排序，仅供对比"""
+    level_column = 'level' + str(target_level)
+    return cursor.execute('''
+        SELECT w.level1, w.level2, w.level3, w.level4, w.average, w.label,
+               g.state, g.county_town_name, MIN(w.''' + level_column + ''') as min_target_salary
+        FROM wage_data w
+        JOIN geography g ON w.area = g.area
+        WHERE w.soc_code = ? AND w.''' + level_column + ''' IS NOT NULL AND w.''' + level_column + ''' >= ?
+        GROUP BY g.state, g.county_town_name
+        ORDER BY min_target_salary ASC
+    ''', (soc_code, target_hourly)).fetchall()
+
+
+def bench_leaderboard(target_salary=80000, top_k=10):
+    """地区查询：全部职业逐个查询，GROUP BY vs 预排序的 location_leaderboard（全部 / 前 top_k 个 / 限定州）"""
+    print("=== 地区查询排行 (location_leaderboard) ===")
+    conn = sqlite3.connect(wage_app.DB_PATH)
+    cursor = conn.cursor()
+    soc_codes = [soc for soc, in cursor.execute('SELECT DISTINCT soc_code FROM wage_data')]
+    engine = ColumnarWageEngine.load(conn)
+    target_hourly = target_salary / 2080
+    runs = (
+        ("GROUP BY", lambda soc, level: legacy_location_wages(cursor, soc, level, target_hourly)),
+        ("leaderboard", lambda soc, level: list(wage_app.fetch_location_wages(cursor, soc, level, target_hourly))),
+        (f"leaderboard top {top_k}", lambda soc, level: list(itertools.islice(
+            wage_app.fetch_location_wages(cursor, soc, level, target_hourly), top_k))),
+        ("leaderboard 限定州", lambda soc, level: list(wage_app.fetch_location_wages(
+            cursor, soc, level, target_hourly, {'California', 'Texas'}))),
+        ("numpy", lambda soc, level: engine.location(soc, level, target_hourly)),
+    )
+    for level in (1, 2, 4):
+        print(f"-- Level {level}，{len(soc_codes)} 个职业，目标年薪 ${target_salary:,}")
+        for name, run in runs:
+            samples = []
+            rows = 0
+            for soc in soc_codes:
+                start = time.perf_counter()
+                rows += len(run(soc, level))
+                samples.append(time.perf_counter() - start)
+            report(name, samples)
+            print(f"   {'':<28} 总计={sum(samples) * 1000:9.0f}ms  行数={rows}")
+    conn.close()
+
+
+# 列式文件覆盖的数据：wage_data 本身和三种查询用到的排序结构
+COLUMN_TABLES = ('wage_data', 'wage_levels', 'location_leaderboard', 'idx_wage_soc_area')
+
+
+def first_query(loader):
+    """在子进程中加载数据（loader 为 'sqlite' 或 'columns'）并回答一次地区查询和一次根据薪资查询，返回总耗时"""
+    code = (
+        "import sys, time, sqlite3; start = time.perf_counter(); import build_db; "
+        "from wage_engine import ColumnarWageEngine; "
+        "engine = ColumnarWageEngine.open(build_db.columns_path('wage_data.db')) if sys.argv[1] == 'columns' "
+        "else ColumnarWageEngine.load(sqlite3.connect('wage_data.db')); "
+        "engine.location('15-1252', 2, 40.0); engine.reverse(engine.area_codes[0], 30.0, 45.0); "
+        "print(time.perf_counter() - start)"
+    )
+    output = subprocess.run([sys.executable, '-c', code, loader], capture_output=True, text=True, check=True)
+    return float(output.stdout.split()[-1])
+
+
+def bench_columns(rounds=5):
+    """wage_data 的三种载入方式：CSV（pandas）、SQLite 逐列读取、mmap 列式文件（文件大小、加载时间、首次查询）"""
+    import pandas as pd
+    print("=== 列式文件 ===")
+    path = build_db.columns_path(wage_app.DB_PATH)
+    if not os.path.exists(path):
+        build_db.export_columns(wage_app.DB_PATH)
+    conn = sqlite3.connect(wage_app.DB_PATH)
+    placeholders = ','.join('?' * len(COLUMN_TABLES))
+    tables_size = conn.execute(f'SELECT SUM(pgsize) FROM dbstat WHERE name IN ({placeholders})',
+                               COLUMN_TABLES).fetchone()[0]
+    sizes = [
+        ('ALC_Export.csv', os.path.getsize('ALC_Export.csv')),
+        (f'{wage_app.DB_PATH}（整个文件）', os.path.getsize(wage_app.DB_PATH)),
+        ('  其中 wage_data + 查询索引', tables_size),
+        (os.path.basename(path), os.path.getsize(path)),
+    ]
+    for name, size in sizes:
+        print(f"   {name:<28} {size / 1e6:8.1f}MB")
+
+    loaders = [
+        ('CSV（只解析，不建索引）', lambda: pd.read_csv('ALC_Export.csv', dtype={'Area': str, 'SocCode': str})),
+        ('SQLite 逐列读取 + 建索引', lambda: ColumnarWageEngine.load(conn)),
+        ('列式文件 mmap', lambda: ColumnarWageEngine.open(path)),
+    ]
+    print("-- 加载")
+    for name, loader in loaders:
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            loader()
+            samples.append(time.perf_counter() - start)
+        report(name, samples)
+    conn.close()
+
+    print("-- 新进程：导入 + 加载 + 首次查询")
+    for name, loader in (('SQLite 逐列读取', 'sqlite'), ('列式文件 mmap', 'columns')):
+        report(name, [first_query(loader) for _ in range(rounds)])
+
+
+def legacy_build(db_path):
+    """旧版 init_database：pandas 读取 CSV，to_sql 默认参数导入，最后建索引（不含全文索引）"""
+    import pandas as pd
+    conn = sqlite3.connect(db_path)
+    for statement in build_db.SCHEMA[:3]:
+        conn.execute(statement)
+    for table, name, columns in (
+        ('wage_data', 'ALC_Export.csv',
+         ['area', 'soc_code', 'geo_lvl', 'level1', 'level2', 'level3', 'level4', 'average', 'label']),
+        ('geography', 'Geography.csv', ['area', 'area_name', 'state_ab', 'state', 'county_town_name']),
+        ('occupations', 'oes_soc_occs.csv', ['soc_code', 'title', 'description']),
+    ):
+        data = pd.read_csv(name)
+        data.columns = columns
+        data.to_sql(table, conn, if_exists='append', index=False)
+    for statement in build_db.INDEXES:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def bench_build(rounds=3):
+    """数据库构建：pandas to_sql vs executemany 单事务 + 原子替换"""
+    print("=== 数据库构建 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'wage_data.db')
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            legacy_build(db_path)
+            samples.append(time.perf_counter() - start)
+            os.remove(db_path)
+        report("pandas to_sql", samples)
+
+        samples = []
+        for _ in range(rounds):
+            stats = build_db.build_database(db_path)
+            samples.append(stats['seconds'])
+            os.remove(db_path)
+        report("executemany", samples)
+        print(f"   {stats['rows']}，{stats['rows_per_sec']} 行/秒")
+
+
+def bench_swap(threads=4, idle_seconds=5):
+    """后台重建 + 热切换：重建期间的查询延迟、错误数（完整数据，构建在临时目录中进行）"""
+    print("=== 数据集热切换 ===")
+    from dataset import DatasetManager
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in build_db.REQUIRED_FILES + (build_db.XWALK_FILE,):
+            os.symlink(os.path.abspath(name), os.path.join(tmp, name))
+        db_path = os.path.join(tmp, 'wage_data.db')
+        path, _ = build_db.build_version(db_path, tmp)
+        build_db.publish_version(db_path, path)
+        manager = DatasetManager(db_path, warm=wage_app.warm_dataset)
+        wage_app.warm_dataset(manager.current)
+        original, wage_app.datasets = wage_app.datasets, manager
+
+        def load(stop):
+            samples, errors, lock = [], [], threading.Lock()
+
+            def worker():
+                client = wage_app.app.test_client()
+                local, failed = [], 0
+                for url, body in itertools.cycle(SEARCH_CASES):
+                    if stop():
+                        break
+                    start = time.perf_counter()
+                    if client.post(url, json=body).status_code != 200:
+                        failed += 1
+                    local.append(time.perf_counter() - start)
+                with lock:
+                    samples.extend(local)
+                    errors.append(failed)
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            return samples, sum(errors)
+
+        try:
+            deadline = time.perf_counter() + idle_seconds
+            samples, errors = load(lambda: time.perf_counter() > deadline)
+            report("空闲时", samples)
+            job = manager.start_rebuild(tmp)
+            samples, errors = load(lambda: not job.is_alive())
+            report("重建 + 切换期间", samples)
+            status = manager.status()
+            print(f"   {len(samples)} 个请求，错误 {errors} 个，最慢 {max(samples) * 1000:.0f}ms；"
+                  f"构建 {status['build_seconds']:.1f}s，共 {status['seconds']:.1f}s 后切换（{status['state']}）")
+        finally:
+            wage_app.datasets = original
+
+
+def bench_metrics(rounds=20):
+    """指标采集的开销：METRICS=0（普通连接、无请求钩子）vs 开启（SQL 计时、Server-Timing），两种薪资引擎"""
+    print("=== 指标采集开销 ===")
+    from dataset import DatasetManager
+    client = wage_app.app.test_client()
+    instrumented = wage_app.datasets
+    plain = DatasetManager(wage_app.DB_PATH, pooled=instrumented.pooled, factory=sqlite3.Connection)
+    wage_app.warm_dataset(plain.current)
+    modes = ((False, plain, "关闭"), (True, instrumented, "开启"))
+    original = wage_app.app.config['METRICS'], wage_app.app.config['WAGE_ENGINE']
+    try:
+        for engine in ('sqlite', 'numpy'):
+            wage_app.app.config['WAGE_ENGINE'] = engine
+            samples = {name: [] for _, _, name in modes}
+            for i in range(rounds):
+                # 两种模式逐轮交替（先后顺序也交替），抵消机器负载的波动
+                for enabled, manager, name in (modes if i % 2 else modes[::-1]):
+                    wage_app.app.config['METRICS'], wage_app.datasets = enabled, manager
+                    start = time.perf_counter()
+                    for url, body in SEARCH_CASES:
+                        client.post(url, json=body)
+                    samples[name].append(time.perf_counter() - start)
+            for _, _, name in modes:
+                report(f"{engine} 指标{name}（{len(SEARCH_CASES)} 个查询）", samples[name])
+            off, on = (statistics.median(samples[name]) for _, _, name in modes)
+            print(f"   开销: {(on - off) * 1000:+.2f}ms（{(on / off - 1) * 100:+.1f}%）")
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            client.get('/metrics')
+            samples.append(time.perf_counter() - start)
+        series = sum(len(values) for values in metrics.registry.collect().values())
+        report(f"/metrics（{series} 个序列）", samples)
+    finally:
+        wage_app.app.config['METRICS'], wage_app.app.config['WAGE_ENGINE'] = original
+        wage_app.datasets = instrumented
+        plain.current.retire()
+
+
+def boot_worker(cwd):
+    """在子进程中导入 app（相当于一个 gunicorn worker 启动），返回 (导入总耗时, init_database 耗时)"""
+    code = (
+        "import time; start = time.perf_counter(); import app; total = time.perf_counter() - start; "
+        "start = time.perf_counter(); app.init_database(); print(total, time.perf_counter() - start)"
+    )
+    env = {**os.environ, 'PYTHONPATH': os.path.dirname(os.path.abspath(__file__))}
+    output = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env,
+                            capture_output=True, text=True, check=True).stdout.split()
+    return float(output[-2]), float(output[-1])
+
+
+def bench_startup(rounds=5):
+    """worker 启动：没有数据库（启动时从 CSV 导入）vs 预先构建的数据库"""
+    print("=== worker 启动 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in build_db.REQUIRED_FILES + (build_db.XWALK_FILE,):
+            os.symlink(os.path.abspath(name), os.path.join(tmp, name))
+        total, _ = boot_worker(tmp)
+        print(f"   {'启动时导入':<16} 启动={total * 1000:8.0f}ms")
+
+        samples, init_samples = [], []
+        for _ in range(rounds):
+            total, init = boot_worker(tmp)
+            samples.append(total)
+            init_samples.append(init)
+        report("预构建数据库", samples)
+        report("  其中校验版本", init_samples)
+
+
+def legacy_health(conn):
+    """旧版 /health 每次探针执行的查询（列出全部表 + 三张表 COUNT(*)），仅供对比"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in wage_app.READY_TABLES}
+    return tables, counts
+
+
+def bench_health(rounds=200, workers=9, interval=5):
+    """健康检查探针的开销：旧版每次探针 COUNT(*)（新建连接 / 长连接，只计 SQL）vs 内存中的就绪状态（/readyz）、
+    存活探针（/livez）（经过 Flask 的完整请求）"""
+    print("=== 健康检查探针 ===")
+    client = wage_app.app.test_client()
+
+    def fresh_connection():
+        conn = sqlite3.connect(f'file:{wage_app.DB_PATH}?mode=ro', uri=True)
+        try:
+            legacy_health(conn)
+        finally:
+            conn.close()
+
+    pooled = sqlite3.connect(f'file:{wage_app.DB_PATH}?mode=ro', uri=True)
+    cases = [
+        ("旧版：每次新建连接", fresh_connection, None),
+        ("旧版：长连接", lambda: legacy_health(pooled), None),
+        ("/readyz（内存）", lambda: client.get('/readyz'), '/readyz'),
+        ("/livez", lambda: client.get('/livez'), '/livez'),
+    ]
+    client.get('/readyz')  # 加载就绪状态
+    try:
+        for name, probe, url in cases:
+            samples = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                probe()
+                samples.append(time.perf_counter() - start)
+            # 旧版每次 4 条语句；新探针的语句数取自 Server-Timing（关闭指标时不显示）
+            queries = 4
+            if url is not None:
+                timing = client.get(url).headers.get('Server-Timing', '')
+                queries = int(timing.split('desc="')[1].split()[0]) if 'desc="' in timing else None
+            report(name, samples, queries)
+            per_minute = workers * 60 / interval
+            print(f"   {workers} 个 worker 每 {interval}s 探测一次：每分钟 {statistics.mean(samples) * per_minute * 1000:.1f}ms")
+    finally:
+        pooled.close()
+
+
+# 全部接口的基准：(名称, 方法, URL, 请求体)；/init-db-simple 会触发重建，不在其中
+ROUTE_CASES = [
+    ('index', 'GET', '/', None),
+    ('health', 'GET', '/health', None),
+    ('debug', 'GET', '/debug', None),
+    ('forward', 'POST', '/api/search/forward', {"position": "Manager", "location": "California"}),
+    ('forward_county', 'GET', '/api/search/forward?position=Engineer&location=Texas&county=Harris', None),
+    ('forward_batch', 'POST', '/api/search/forward/batch', [
+        {"position": "Software", "location": "Washington"},
+        {"position": "Nurse", "location": "New York", "county": "Kings"},
+        {"position": "Accountant", "location": "Illinois"},
+    ]),
+    ('reverse', 'POST', '/api/search/reverse', {"min_salary": 60000, "max_salary": 100000, "location": "California"}),
+    ('reverse_county', 'GET', '/api/search/reverse?min_salary=60000&max_salary=100000&location=New%20York&county=Kings', None),
+    ('reverse_stream', 'POST', '/api/search/reverse',
+     {"min_salary": 60000, "max_salary": 100000, "location": "Texas", "stream": True}),
+    ('location', 'POST', '/api/search/location', {"position": "Marketing Manager", "target_level": 2, "target_salary": 80000}),
+    ('location_top_k', 'GET', '/api/search/location?position=Software&target_level=4&target_salary=150000&top_k=10', None),
+    ('occupations', 'GET', '/api/occupations', None),
+    ('locations', 'GET', '/api/locations', None),
+    ('autocomplete_occupations', 'GET', '/api/search/occupations?q=soft', None),
+    ('autocomplete_states', 'GET', '/api/search/states?q=new', None),
+    ('autocomplete_counties', 'GET', '/api/search/counties?q=ora', None),
+    ('cache_stats', 'GET', '/api/cache/stats', None),
+    ('slow_queries', 'GET', '/api/slow-queries', None),
+    ('metrics', 'GET', '/metrics', None),
+    ('rebuild_status', 'GET', '/api/init-db', None),
+]
+# 与基线比较时允许的变化（单次运行的波动约 ±30%，p95 只有 20 个样本，波动更大）：
+# 延迟同时高出 (比例, 毫秒)、并发吞吐量低出 THROUGHPUT_TOLERANCE、内存高出 MEMORY_TOLERANCE 算作退化
+LATENCY_TOLERANCE = {'p50_ms': (0.5, 2.0), 'p95_ms': (1.0, 5.0)}
+THROUGHPUT_TOLERANCE = 0.3
+MEMORY_TOLERANCE = 0.2
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def route_request(client, method, url, body):
+    """发送一个请求并读完响应体（流式响应在读取时才生成），返回状态码"""
+    response = client.open(url, method=method, json=body)
+    response.get_data()
+    response.close()
+    return response.status_code
+
+
+def latency_summary(samples, elapsed):
+    """毫秒延迟百分位 + 吞吐量"""
+    return {
+        'p50_ms': round(statistics.median(samples) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'rps': round(len(samples) / elapsed, 1),
+    }
+
+
+def process_rss():
+    """当前进程的 RSS 和峰值 RSS（MB）"""
+    with open('/proc/self/status') as f:
+        status = dict(line.split(':', 1) for line in f)
+    return {'rss_mb': round(int(status['VmRSS'].split()[0]) / 1024, 1),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def compare_baseline(results, baseline):
+    """与基线比较，返回退化项的描述列表"""
+    regressions = []
+    routes = baseline.get('routes', {})
+    for name, current in results['routes'].items():
+        base = routes.get(name)
+        if base is None:
+            continue
+        for key, (ratio, slack_ms) in LATENCY_TOLERANCE.items():
+            if current[key] > base[key] * (1 + ratio) and current[key] - base[key] > slack_ms:
+                regressions.append(f"{name} {key}: {base[key]} → {current[key]}")
+    base, current = baseline.get('concurrent'), results['concurrent']
+    if base and current['rps'] < base['rps'] * (1 - THROUGHPUT_TOLERANCE):
+        regressions.append(f"并发吞吐量: {base['rps']} → {current['rps']} req/s")
+    base, current = baseline.get('memory'), results['memory']
+    if base and current['rss_mb'] > base['rss_mb'] * (1 + MEMORY_TOLERANCE):
+        regressions.append(f"RSS: {base['rss_mb']} → {current['rss_mb']} MB")
+    return regressions
+
+
+def bench_routes(rounds=20, threads=8, duration=10, save_baseline=False):
+    """全部接口：逐个接口的延迟分布，混合请求的并发吞吐量，进程内存；与 benchmark_baseline.json 比较
+
+    基线只在同一数据版本（如 generate_alc 用同一种子生成的数据）、同一台机器上可比。
+    返回是否有退化。
+    """
+    print("=== 全部接口 ===")
+    client = wage_app.app.test_client()
+    results = {
+        'dataset_version': wage_app.dataset_version(),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'wage_engine': wage_app.app.config['WAGE_ENGINE'],
+        'routes': {},
+    }
+    for name, method, url, body in ROUTE_CASES:
+        status = route_request(client, method, url, body)  # 预热（内存结构、查询计划）
+        if status >= 400:
+            print(f"   ❌ {name} 返回 {status}")
+        samples = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            begin = time.perf_counter()
+            route_request(client, method, url, body)
+            samples.append(time.perf_counter() - begin)
+        summary = results['routes'][name] = latency_summary(samples, time.perf_counter() - start)
+        print(f"   {name:<26} p50={summary['p50_ms']:9.2f}ms  p95={summary['p95_ms']:9.2f}ms  "
+              f"p99={summary['p99_ms']:9.2f}ms  {summary['rps']:8.1f} req/s")
+
+    samples, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        local_client, local, failed = wage_app.app.test_client(), [], 0
+        cases = ROUTE_CASES[offset:] + ROUTE_CASES[:offset]
+        for _, method, url, body in itertools.cycle(cases):
+            if time.perf_counter() > deadline:
+                break
+            begin = time.perf_counter()
+            if route_request(local_client, method, url, body) >= 400:
+                failed += 1
+            local.append(time.perf_counter() - begin)
+        with lock:
+            samples.extend(local)
+            errors.append(failed)
+
+    workers = [threading.Thread(target=worker, args=(i * 3 % len(ROUTE_CASES),)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    concurrent = results['concurrent'] = latency_summary(samples, time.perf_counter() - start)
+    concurrent.update(threads=threads, errors=sum(errors))
+    print(f"   {'并发混合（' + str(threads) + ' 线程）':<22} p50={concurrent['p50_ms']:9.2f}ms  "
+          f"p95={concurrent['p95_ms']:9.2f}ms  p99={concurrent['p99_ms']:9.2f}ms  {concurrent['rps']:8.1f} req/s  "
+          f"错误 {concurrent['errors']} 个")
+    memory = results['memory'] = process_rss()
+    print(f"   内存: RSS {memory['rss_mb']}MB，峰值 {memory['peak_rss_mb']}MB")
+
+    if save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"   已保存基线 {os.path.basename(BASELINE_PATH)}")
+        return False
+    try:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    except OSError:
+        print("   没有基线（--save-baseline 保存本次结果）")
+        return False
+    if baseline.get('dataset_version') != results['dataset_version'] or baseline.get('cpus') != results['cpus']:
+        print(f"   ⚠️  基线来自数据版本 {baseline.get('dataset_version')}、{baseline.get('cpus')} CPU，"
+              f"当前为 {results['dataset_version']}、{results['cpus']} CPU，不比较")
+        return False
+    regressions = compare_baseline(results, baseline)
+    for regression in regressions:
+        print(f"   ❌ 退化 {regression}")
+    if not regressions:
+        print("   ✅ 与基线相比没有退化")
+    return bool(regressions)
+
+
+BENCHMARKS = {
+    'forward': bench_forward,
+    'pool': bench_pool,
+    'engine': bench_engine,
+    'fts': bench_fts,
+    'autocomplete': bench_autocomplete,
+    'batch': bench_batch,
+    'stream': bench_stream,
+    'cache': bench_cache,
+    'payload': bench_payload,
+    'http_cache': bench_http_cache,
+    'leaderboard': bench_leaderboard,
+    'asgi': bench_asgi,
+    'server': bench_server,
+    'memory': bench_memory,
+    'columns': bench_columns,
+    'build': bench_build,
+    'swap': bench_swap,
+    'metrics': bench_metrics,
+    'health': bench_health,
+    'routes': bench_routes,
+    'startup': bench_startup,
+}
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['_stream_worker']:
+        stream_worker(*sys.argv[2:])
+        sys.exit()
+    options = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    selected = [arg for arg in sys.argv[1:] if not arg.startswith('--')] or list(BENCHMARKS)
+    regressed = False
+    for name in selected:
+        if name == 'routes':
+            regressed |= bench_routes(save_baseline='--save-baseline' in options)
+        else:
+            BENCHMARKS[name]()
+    sys.exit(1 if regressed else 0)
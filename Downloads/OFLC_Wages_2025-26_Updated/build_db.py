@@ -0,0 +1,591 @@
+# -*- coding: utf-8 -*-
+"""
+数据库构建
+把 ALC_Export.csv / Geography.csv / oes_soc_occs.csv（以及可选的 xwalk_plus.csv）导入 SQLite。
+- 用 csv 模块流式读取，executemany 在同一个事务里批量插入，不经过 pandas DataFrame
+- 导入期间关闭回滚日志和同步写盘（journal_mode=OFF, synchronous=OFF），数据导入完成后再建索引
+- 写到同目录下的临时文件，全部完成后原子地 rename 为目标文件：进程中途退出不会留下半成品数据库
+- 构建信息（结构版本、源数据校验和、行数）写入 build_info 表，数据库文件的 SHA-256 写入同名 .sha256 文件，
+  部署时可以预先构建好，应用启动时只需校验版本
+- 同时把 wage_data 导出为列式文件 <db>.columns（见 wage_engine.py），numpy 引擎直接 mmap 打开，不再逐列读取 SQLite
+- build-db 把每次构建写到 versions/ 下的新文件，校验通过后把 wage_data.db（符号链接）原子地指向它，
+  运行中的应用不必删除正在使用的数据库（热切换见 dataset.py）；versions/ 下保留当前和上一个版本
+
+用法:
+    python3 -m build_db build-db [--source 目录] [--output wage_data.db] [--force]
+    python3 -m build_db export-columns [wage_data.db]
+    python3 -m build_db verify [wage_data.db]
+"""
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，不做跨进程互斥
+    fcntl = None
+
+# 数据库结构版本：表结构或索引变化时加一，旧版本的数据库在启动时会被重建
+SCHEMA_VERSION = 4
+
+# 构建时需要的数据文件
+REQUIRED_FILES = ('ALC_Export.csv', 'Geography.csv', 'oes_soc_occs.csv')
+# 可选：O*NET 交叉引用，作为职业的别名标题
+XWALK_FILE = 'xwalk_plus.csv'
+
+# 默认的数据库文件
+DEFAULT_DB_PATH = 'wage_data.db'
+# 各版本数据库所在的目录（与数据库文件同目录下），数据库文件是指向当前版本的符号链接
+VERSIONS_DIR = 'versions'
+# versions/ 下保留的版本数：当前版本 + 上一个版本（切换后仍可能有请求在读旧版本）
+KEEP_VERSIONS = 2
+
+# 构建阶段（按顺序），progress 回调收到 (阶段, 本阶段已导入行数)
+BUILD_STAGES = ('wage_data', 'geography', 'occupations', 'fulltext', 'indexes', 'columns', 'checksum')
+# 导入大表时每这么多行报告一次进度
+PROGRESS_ROWS = 50000
+
+# 只在构建连接上使用的导入参数（构建失败时临时文件直接丢弃，不需要日志和 fsync）
+BUILD_PRAGMAS = (
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',    # 256MB 页缓存，建索引时排序用
+)
+
+SCHEMA = (
+    '''
+    CREATE TABLE wage_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        area TEXT,
+        soc_code TEXT,
+        geo_lvl INTEGER,
+        level1 REAL,
+        level2 REAL,
+        level3 REAL,
+        level4 REAL,
+        average REAL,
+        label TEXT
+    )
+    ''',
+    # 查询表按连接键聚簇存储（WITHOUT ROWID，主键为 连接键 + 原行号）：
+    # 按 area / soc_code 连接时直接在主键 B 树上取到整行，不再经过二级索引回表
+    '''
+    CREATE TABLE geography (
+        id INTEGER NOT NULL,
+        area TEXT NOT NULL,
+        area_name TEXT,
+        state_ab TEXT,
+        state TEXT,
+        county_town_name TEXT,
+        PRIMARY KEY (area, id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE occupations (
+        id INTEGER NOT NULL,
+        soc_code TEXT NOT NULL,
+        title TEXT,
+        description TEXT,
+        PRIMARY KEY (soc_code, id)
+    ) WITHOUT ROWID
+    ''',
+    # 薪资按 Level 展开（每行 wage_data 的每个非空 Level 一条），按 (地区, Level, 时薪) 聚簇：
+    # 根据薪资查询对每个选中的 Level 做一次区间查找
+    '''
+    CREATE TABLE wage_levels (
+        area TEXT NOT NULL,
+        level INTEGER NOT NULL,
+        wage REAL NOT NULL,
+        wage_id INTEGER NOT NULL,
+        PRIMARY KEY (area, level, wage, wage_id)
+    ) WITHOUT ROWID
+    ''',
+    # 地区查询排行：每个 (职业, Level) 的薪资行按时薪升序聚簇，州/县通过 geography 的 (area, id) 主键连接；
+    # "哪里能以 $X 达到 Level N" 从 target 起顺序读取即可，不再每次 GROUP BY + 排序
+    '''
+    CREATE TABLE location_leaderboard (
+        soc_code TEXT NOT NULL,
+        level INTEGER NOT NULL,
+        wage REAL NOT NULL,
+        wage_id INTEGER NOT NULL,
+        area TEXT NOT NULL,
+        PRIMARY KEY (soc_code, level, wage, wage_id)
+    ) WITHOUT ROWID
+    ''',
+    # 构建信息：schema_version、data_version、built_at、各表行数
+    '''
+    CREATE TABLE build_info (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''',
+    # 职业全文索引（标题、O*NET别名标题、描述），查询时按BM25相关度排序
+    '''
+    CREATE VIRTUAL TABLE occupations_fts USING fts5(
+        soc_code UNINDEXED,
+        title,
+        alt_titles,
+        description,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''',
+)
+
+# 数据导入完成后再建，比边插入边维护索引快得多。按各查询的 EXPLAIN QUERY PLAN 选择
+# （根据薪资查询走 wage_levels 的主键，地区查询走 location_leaderboard 的主键）：
+INDEXES = (
+    # 正向查询、批量查询：按 (职业, 地区) 组合取薪资
+    'CREATE INDEX idx_wage_soc_area ON wage_data(soc_code, area)',
+    'CREATE INDEX idx_geo_state ON geography(state)',
+)
+
+
+def insert_csv(cursor, table, columns, path, numbered=False, progress=None):
+    """把 CSV（跳过表头，按列顺序对应 columns）逐行插入 table，返回行数
+
+    csv.reader 直接交给 executemany，不在 Python 里逐行处理；
+    空字段由 NULLIF 转换为 NULL（与原来 pandas 读成 NaN 再写入 NULL 一致）。
+    numbered=True 时按文件顺序写入 id 列（WITHOUT ROWID 表没有自增行号）。
+    progress(已读行数) 每 PROGRESS_ROWS 行调用一次。
+    """
+    values = ["NULLIF(?, '')"] * len(columns)
+    if numbered:
+        columns, values = ('id', *columns), ['?', *values]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(columns), ', '.join(values))
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        if numbered:
+            reader = ([i, *row] for i, row in enumerate(reader, 1))
+        if progress is not None:
+            reader = _report_rows(reader, progress)
+        cursor.executemany(sql, reader)
+    return cursor.rowcount
+
+
+def _report_rows(rows, progress):
+    """逐行透传，每 PROGRESS_ROWS 行报告一次已读行数"""
+    for count, row in enumerate(rows, 1):
+        if count % PROGRESS_ROWS == 0:
+            progress(count)
+        yield row
+
+
+def read_alt_titles(path):
+    """xwalk_plus.csv → {soc_code: [O*NET 标题]}"""
+    alt_titles = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            if row.get('OES_SOCCODE') and row.get('ONetTitle'):
+                alt_titles.setdefault(row['OES_SOCCODE'], []).append(row['ONetTitle'])
+    return alt_titles
+
+
+def file_sha256(path):
+    """文件内容的 SHA-256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_version(source_dir='.'):
+    """源数据版本：各数据文件内容的联合校验和（前 16 位）"""
+    digest = hashlib.sha256()
+    for name in REQUIRED_FILES + (XWALK_FILE,):
+        path = os.path.join(source_dir, name)
+        if os.path.exists(path):
+            digest.update(f'{name}:{file_sha256(path)}\n'.encode())
+    return digest.hexdigest()[:16]
+
+
+def load_build_info(conn):
+    """读取数据库的 build_info，旧数据库没有这张表时返回 None"""
+    try:
+        return dict(conn.execute('SELECT key, value FROM build_info').fetchall())
+    except sqlite3.Error:
+        return None
+
+
+def read_build_info(db_path):
+    """只读打开 db_path 读取 build_info；文件不存在或无法读取时返回 None"""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        return load_build_info(conn)
+    finally:
+        conn.close()
+
+
+def is_current(info):
+    """build_info 是否属于当前结构版本的完整构建"""
+    return bool(info) and info.get('schema_version') == str(SCHEMA_VERSION)
+
+
+def matches_source(info, source_dir='.'):
+    """build_info 记录的源数据版本是否与 source_dir 下的数据文件一致；数据文件不全时无从比较，视为一致"""
+    if missing_files(source_dir):
+        return True
+    return info.get('data_version') == source_version(source_dir)
+
+
+def dataset_version(info):
+    """数据集版本标识：结构版本 + 源数据版本"""
+    return f"{info['schema_version']}-{info['data_version']}"
+
+
+@contextlib.contextmanager
+def build_lock(db_path):
+    """构建数据库时的跨进程文件锁（<db>.lock），多个 worker 同时启动时只有一个在构建"""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{db_path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def try_build_lock(db_path):
+    """不等待地取得构建锁：返回持有锁的文件对象（关闭即释放），锁已被持有时返回 None
+
+    flock 锁属于打开的文件，同一进程内另一个线程再次获取同样会失败。
+    """
+    lock = open(f'{db_path}.lock', 'w')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+    return lock
+
+
+def verify_database(db_path):
+    """校验数据库文件：与 .sha256 记录的校验和一致、结构版本为当前版本。返回问题列表（空表示通过）
+
+    db_path 是符号链接时校验它指向的版本（校验和文件在版本文件旁边）。
+    """
+    problems = []
+    db_path = os.path.realpath(db_path)
+    checksum_path = f'{db_path}.sha256'
+    if not os.path.exists(checksum_path):
+        problems.append(f'缺少校验和文件 {checksum_path}')
+    else:
+        with open(checksum_path) as f:
+            expected = f.read().split()[0]
+        if file_sha256(db_path) != expected:
+            problems.append('数据库文件与校验和不一致')
+    info = read_build_info(db_path)
+    if not is_current(info):
+        problems.append(f'结构版本不是当前版本 {SCHEMA_VERSION}: {info}')
+    return problems
+
+
+def check_database(db_path):
+    """切换到新构建的数据库之前的检查：verify_database，再加上页面完整性（quick_check）
+    和各表行数（与构建信息一致且不为空）。返回问题列表
+    """
+    problems = verify_database(db_path)
+    try:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    except sqlite3.Error as e:
+        return problems + [f'无法打开数据库: {e}']
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            problems.append(f'quick_check 未通过: {result}')
+        info = load_build_info(conn) or {}
+        for table in ('wage_data', 'geography', 'occupations'):
+            count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            if not count or str(count) != info.get(f'rows_{table}'):
+                problems.append(f"{table} 行数 {count} 与构建信息 {info.get(f'rows_{table}')} 不符")
+    except sqlite3.Error as e:
+        problems.append(f'无法读取数据库: {e}')
+    finally:
+        conn.close()
+    return problems
+
+
+def columns_path(db_path):
+    """数据库对应的列式文件"""
+    return f'{db_path}.columns'
+
+
+def export_columns(db_path, path=None):
+    """把数据库的 wage_data 导出为列式文件（默认 <db>.columns），返回文件字节数；没有安装 numpy 时返回 None"""
+    try:
+        from wage_engine import ColumnarWageEngine
+    except ImportError:
+        return None
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        info = load_build_info(conn)
+        engine = ColumnarWageEngine.load(conn, dataset_version(info) if is_current(info) else None)
+    finally:
+        conn.close()
+    return engine.save(path or columns_path(os.path.realpath(db_path)))
+
+
+def missing_files(source_dir='.'):
+    """返回缺少的必需数据文件"""
+    return [name for name in REQUIRED_FILES if not os.path.exists(os.path.join(source_dir, name))]
+
+
+def build_database(db_path, source_dir='.', progress=None):
+    """从 source_dir 下的 CSV 构建数据库并原子地替换 db_path，返回构建统计
+
+    {'rows': {表名: 行数}, 'seconds': 耗时, 'rows_per_sec': 每秒导入行数}
+    progress(阶段, 已导入行数) 在每个阶段开始时和导入大表期间调用（阶段见 BUILD_STAGES）。
+    """
+    def stage(name, message):
+        print(message)
+        if progress is not None:
+            progress(name, 0)
+
+    missing = missing_files(source_dir)
+    if missing:
+        raise FileNotFoundError(f"缺少数据文件: {', '.join(missing)}")
+
+    start = time.perf_counter()
+    tmp_path = f'{db_path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        for pragma in BUILD_PRAGMAS:
+            conn.execute(pragma)
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+        rows = {}
+        stage('wage_data', "正在导入薪资数据...")
+        rows['wage_data'] = insert_csv(
+            cursor, 'wage_data',
+            ('area', 'soc_code', 'geo_lvl', 'level1', 'level2', 'level3', 'level4', 'average', 'label'),
+            os.path.join(source_dir, 'ALC_Export.csv'),
+            progress=(lambda count: progress('wage_data', count)) if progress is not None else None)
+        for level in (1, 2, 3, 4):
+            cursor.execute(f'''
+                INSERT INTO wage_levels (area, level, wage, wage_id)
+                SELECT area, {level}, level{level}, id FROM wage_data WHERE level{level} IS NOT NULL AND area IS NOT NULL
+                ORDER BY area, level{level}, id
+            ''')
+            cursor.execute(f'''
+                INSERT INTO location_leaderboard (soc_code, level, wage, wage_id, area)
+                SELECT soc_code, {level}, level{level}, id, area FROM wage_data
+                WHERE level{level} IS NOT NULL AND soc_code IS NOT NULL AND area IS NOT NULL
+                ORDER BY soc_code, level{level}, id
+            ''')
+
+        stage('geography', "正在导入地理数据...")
+        rows['geography'] = insert_csv(
+            cursor, 'geography', ('area', 'area_name', 'state_ab', 'state', 'county_town_name'),
+            os.path.join(source_dir, 'Geography.csv'), numbered=True)
+
+        stage('occupations', "正在导入职业数据...")
+        rows['occupations'] = insert_csv(
+            cursor, 'occupations', ('soc_code', 'title', 'description'),
+            os.path.join(source_dir, 'oes_soc_occs.csv'), numbered=True)
+
+        stage('fulltext', "正在建立职业全文索引...")
+        xwalk_path = os.path.join(source_dir, XWALK_FILE)
+        alt_titles = read_alt_titles(xwalk_path) if os.path.exists(xwalk_path) else {}
+        occupations = cursor.execute('SELECT soc_code, title, description FROM occupations ORDER BY id').fetchall()
+        cursor.executemany(
+            'INSERT INTO occupations_fts (soc_code, title, alt_titles, description) VALUES (?, ?, ?, ?)',
+            [(soc_code, title, '; '.join(t for t in alt_titles.get(soc_code, []) if t != title), description)
+             for soc_code, title, description in occupations]
+        )
+
+        stage('indexes', "正在建立索引...")
+        for statement in INDEXES:
+            cursor.execute(statement)
+        # 收集统计信息，让查询规划器在多个候选索引之间做出正确选择
+        cursor.execute('ANALYZE')
+
+        info = {
+            'schema_version': str(SCHEMA_VERSION),
+            'data_version': source_version(source_dir),
+            'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            **{f'rows_{table}': str(count) for table, count in rows.items()},
+        }
+        cursor.executemany('INSERT INTO build_info (key, value) VALUES (?, ?)', info.items())
+        cursor.execute('COMMIT')
+        conn.close()
+
+        stage('columns', "正在导出列式文件...")
+        columns_bytes = export_columns(tmp_path, columns_path(tmp_path))
+
+        stage('checksum', "正在计算校验和...")
+        # 校验和文件、列式文件与数据库一起替换（列式文件带数据集版本，替换间隙中读到的旧文件会因版本不符被忽略）
+        with open(f'{tmp_path}.sha256', 'w') as f:
+            f.write(f'{file_sha256(tmp_path)}  {os.path.basename(db_path)}\n')
+        os.replace(tmp_path, db_path)
+        os.replace(f'{tmp_path}.sha256', f'{db_path}.sha256')
+        if columns_bytes is not None:
+            os.replace(columns_path(tmp_path), columns_path(db_path))
+    except BaseException:
+        conn.close()
+        for path in (tmp_path, f'{tmp_path}.sha256', columns_path(tmp_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    seconds = time.perf_counter() - start
+    total = sum(rows.values())
+    return {'rows': rows, 'seconds': round(seconds, 3), 'rows_per_sec': round(total / seconds),
+            'data_version': info['data_version'], 'columns_bytes': columns_bytes}
+
+
+def versions_dir(db_path):
+    """db_path 各版本所在的目录"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), VERSIONS_DIR)
+
+
+def version_path(db_path, when=None):
+    """versions/ 下以构建时间命名的版本文件（文件名按字典序即按时间排序）"""
+    root, ext = os.path.splitext(os.path.basename(db_path))
+    stamp = (when or datetime.now(timezone.utc)).strftime('%Y%m%d-%H%M%S-%f')
+    return os.path.join(versions_dir(db_path), f'{root}-{stamp}{ext}')
+
+
+def build_version(db_path, source_dir='.', progress=None):
+    """在 versions/ 下构建一个新版本，不改动 db_path。返回 (版本文件, 构建统计)"""
+    path = version_path(db_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path, build_database(path, source_dir, progress)
+
+
+def archive_legacy(db_path):
+    """db_path 还是普通文件（旧的部署方式）时，把它和附属文件硬链接到 versions/ 下，返回新路径；否则返回 None
+
+    之后 db_path 被替换为符号链接，仍在读旧文件的连接和进程不受影响（inode 不变）。
+    """
+    if os.path.islink(db_path) or not os.path.exists(db_path):
+        return None
+    path = version_path(db_path, datetime.fromtimestamp(os.stat(db_path).st_mtime, timezone.utc))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for source, target in ((db_path, path), (f'{db_path}.sha256', f'{path}.sha256'),
+                           (columns_path(db_path), columns_path(path))):
+        if os.path.exists(source) and not os.path.exists(target):
+            os.link(source, target)
+    return path
+
+
+def publish_version(db_path, path):
+    """把 db_path 原子地替换为指向 path 的符号链接（相对路径，目录整体移动后仍然有效）"""
+    archive_legacy(db_path)
+    link = f'{db_path}.{os.getpid()}.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.relpath(path, os.path.dirname(os.path.abspath(db_path))), link)
+    os.replace(link, db_path)
+    # 旧部署方式留在 db_path 旁边的附属文件已随版本归档，读取方都按符号链接指向的版本查找
+    for sidecar in (f'{db_path}.sha256', columns_path(db_path)):
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+
+
+def remove_version(path):
+    """删除一个版本及其附属文件"""
+    for name in (path, f'{path}.sha256', columns_path(path)):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def prune_versions(db_path, keep=KEEP_VERSIONS):
+    """删除 versions/ 下较旧的版本：保留 db_path 当前指向的版本和最近的其他版本，共 keep 个。返回删除的文件"""
+    directory = versions_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+    root, ext = os.path.splitext(os.path.basename(db_path))
+    current = os.path.realpath(db_path)
+    paths = sorted((os.path.join(directory, name) for name in os.listdir(directory)
+                    if name.startswith(f'{root}-') and name.endswith(ext)), reverse=True)
+    kept = [path for path in paths if os.path.realpath(path) == current]
+    removed = []
+    for path in paths:
+        if path in kept:
+            continue
+        if len(kept) < keep:
+            kept.append(path)
+        else:
+            remove_version(path)
+            removed.append(path)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m build_db', description='构建/校验 OFLC 薪资数据库')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build-db', help='从 CSV 构建数据库')
+    build.add_argument('--source', default='.', help='CSV 所在目录')
+    build.add_argument('--output', default=DEFAULT_DB_PATH, help='输出的数据库文件')
+    build.add_argument('--force', action='store_true', help='源数据未变化时也重新构建')
+    export = commands.add_parser('export-columns', help='把已有数据库导出为列式文件')
+    export.add_argument('path', nargs='?', default=DEFAULT_DB_PATH)
+    verify = commands.add_parser('verify', help='校验数据库文件（校验和、结构版本、完整性、行数）')
+    verify.add_argument('path', nargs='?', default=DEFAULT_DB_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'verify':
+        problems = check_database(args.path)
+        for problem in problems:
+            print(f"❌ {problem}")
+        if not problems:
+            info = read_build_info(args.path)
+            print(f"✅ {args.path} 校验通过，数据版本 {dataset_version(info)}，构建于 {info['built_at']}")
+        return 1 if problems else 0
+
+    if args.command == 'export-columns':
+        size = export_columns(args.path)
+        if size is None:
+            print("❌ 导出列式文件需要 numpy")
+            return 1
+        print(f"✅ 已导出 {columns_path(os.path.realpath(args.path))}（{size / 1e6:.1f}MB）")
+        return 0
+
+    missing = missing_files(args.source)
+    if missing:
+        print(f"❌ 缺少数据文件: {', '.join(missing)}")
+        return 1
+    with build_lock(args.output):
+        info = read_build_info(args.output)
+        if not args.force and is_current(info) and info.get('data_version') == source_version(args.source):
+            print(f"✅ {args.output} 已是最新（数据版本 {dataset_version(info)}），无需构建")
+            return 0
+        path, stats = build_version(args.output, args.source)
+        problems = check_database(path)
+        if problems:
+            remove_version(path)
+            for problem in problems:
+                print(f"❌ {problem}")
+            return 1
+        publish_version(args.output, path)
+        prune_versions(args.output)
+    print(f"✅ 已构建 {path}，{args.output} 已指向新版本：{stats['rows']}")
+    print(f"   耗时 {stats['seconds']:.1f}s，{stats['rows_per_sec']} 行/秒，数据版本 {SCHEMA_VERSION}-{stats['data_version']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
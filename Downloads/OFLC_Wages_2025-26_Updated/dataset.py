@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+数据集热切换
+重建数据库时不再删除正在使用的文件：新版本在 versions/ 下构建、校验、预热，完成后原子地切换
+wage_data.db（指向当前版本的符号链接）和进程内的当前数据集，正在进行的查询不受影响。
+- Dataset：一个数据库版本，连同它的连接池和基于它建立的内存结构（列式引擎、自动完成索引等）；
+  请求第一次访问数据库时绑定当时的数据集并增加引用计数，整个请求（包括流式响应）读同一个版本；
+  被替换的数据集在最后一个使用它的请求结束后关闭全部连接
+- DatasetManager：持有当前数据集，在后台线程中重建并报告进度（状态文件 versions/rebuild.json，各 worker 共享）；
+  其他 worker 每秒至多检查一次 wage_data.db 指向的文件，发现被替换时在后台预热新版本后再切换
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import build_db
+from db import ConnectionManager
+
+# 检查数据库文件是否被其他进程替换的最小间隔（秒）
+CHECK_INTERVAL = 1.0
+# 重建进行中的各个状态
+BUSY_STATES = ('building', 'validating', 'warming', 'swapping')
+
+
+def file_identity(path):
+    """文件身份（设备、inode、大小、修改时间），跟随符号链接；文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class Dataset:
+    """一个数据库版本：只读连接池 + 内存结构 + 使用中的请求数"""
+
+    def __init__(self, path, pooled=True, factory=sqlite3.Connection):
+        self.path = os.path.realpath(path)
+        self.identity = file_identity(self.path)
+        self.pool = ConnectionManager(self.path, pooled, factory)
+        self.objects = {}
+        self.refs = 0
+        self.retired = False
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def load(self, name, loader):
+        """取得名为 name 的内存结构，不存在时用 loader(conn) 从本数据集构建"""
+        obj = self.objects.get(name)
+        if obj is None:
+            with self._load_lock:
+                obj = self.objects.get(name)
+                if obj is None:
+                    conn = self.pool.acquire()
+                    try:
+                        obj = self.objects[name] = loader(conn)
+                    finally:
+                        self.pool.release(conn)
+        return obj
+
+    def retarget(self, path):
+        """数据库文件被归档到 versions/ 后改用新路径打开连接（同一个 inode，内容不变）"""
+        self.path = self.pool.db_path = path
+
+    def retain(self):
+        with self._lock:
+            self.refs += 1
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            drained = self.retired and self.refs == 0
+        if drained:
+            self.pool.close_all()
+
+    def retire(self):
+        """已被新版本替换：没有请求在用时立即关闭连接，否则由最后一个请求结束时关闭"""
+        with self._lock:
+            self.retired = True
+            drained = self.refs == 0
+        if drained:
+            self.pool.close_all()
+
+
+class DatasetManager:
+    """当前数据集的指针：请求取用 / 归还、后台重建、检测其他进程完成的替换
+
+    warm(dataset) 在切换之前于后台线程中调用，预先建立新版本的内存结构；抛出异常时放弃切换。
+    on_swap(dataset) 在切换之后调用（如清理基于旧版本的缓存），抛出异常时只打印，不影响切换。
+    factory 为各数据集连接池使用的连接类。
+    """
+
+    def __init__(self, db_path, pooled=True, warm=None, check_interval=CHECK_INTERVAL, factory=sqlite3.Connection,
+                 on_swap=None):
+        self.db_path = db_path
+        self.pooled = pooled
+        self.factory = factory
+        self.warm = warm
+        self.on_swap = on_swap
+        self.check_interval = check_interval
+        self.swaps = 0
+        self._current = None
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._pending = None    # 正在后台预热的文件身份
+        self._failed = None     # 预热失败的文件身份，不再重试
+        self._status = {}
+        self._status_lock = threading.Lock()
+
+    @property
+    def current(self):
+        """当前数据集（第一次访问时打开）"""
+        dataset = self._current
+        if dataset is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = Dataset(self.db_path, self.pooled, self.factory)
+                dataset = self._current
+        return dataset
+
+    def acquire(self):
+        """请求开始时取得当前数据集并增加引用计数，与 release() 成对调用"""
+        self.refresh()
+        while True:
+            dataset = self.current
+            dataset.retain()
+            if not dataset.retired:
+                return dataset
+            dataset.release()  # 恰好在切换的瞬间取到了旧版本，改用新的当前数据集
+
+    def release(self, dataset):
+        dataset.release()
+
+    def refresh(self):
+        """检查数据库文件是否已被其他进程替换（至多每 check_interval 秒一次），是则在后台预热并切换"""
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        identity = file_identity(self.db_path)
+        current = self._current
+        if current is None or identity is None or identity in (current.identity, self._pending, self._failed):
+            return
+        self._pending = identity
+        threading.Thread(target=self._follow, args=(identity,), name='dataset-refresh', daemon=True).start()
+
+    def _follow(self, identity):
+        try:
+            dataset = Dataset(self.db_path, self.pooled, self.factory)
+            if dataset.identity == self.current.identity:  # 本进程已经切换过
+                dataset.retire()
+                return
+            if self.warm is not None:
+                self.warm(dataset)
+            self._swap(dataset)
+            print(f"数据库已被替换，切换到 {dataset.path}")
+        except Exception as e:
+            self._failed = identity
+            print(f"无法加载替换后的数据库，继续使用当前版本: {e}")
+        finally:
+            self._pending = None
+
+    def reload(self):
+        """立即按 db_path 当前指向的文件重新打开（不预热，内存结构在第一次使用时建立）"""
+        self._swap(Dataset(self.db_path, self.pooled, self.factory))
+
+    def _swap(self, dataset):
+        with self._lock:
+            old, self._current = self._current, dataset
+            self.swaps += 1
+        if old is not None:
+            old.retire()
+        if self.on_swap is not None:
+            try:
+                self.on_swap(dataset)
+            except Exception as e:
+                print(f"数据集切换后的清理失败: {e}")
+
+    def start_rebuild(self, source_dir='.'):
+        """在后台线程中重建数据库并热切换，返回该线程；已有重建在进行（本进程或其他进程）时返回 None"""
+        lock = build_db.try_build_lock(self.db_path)
+        if lock is None:
+            return None
+        with self._status_lock:
+            self._status = {}
+        self._update(state='building', started=time.time(),
+                     started_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                     stage=None, step=0, steps=len(build_db.BUILD_STAGES), rows=0, pid=os.getpid())
+        thread = threading.Thread(target=self._rebuild, args=(source_dir, lock), name='dataset-rebuild', daemon=True)
+        thread.start()
+        return thread
+
+    def _rebuild(self, source_dir, lock):
+        start = time.perf_counter()
+        path = dataset = None
+        try:
+            path, stats = build_db.build_version(self.db_path, source_dir, progress=self._progress)
+            self._update(state='validating', stage=None)
+            problems = build_db.check_database(path)
+            if problems:
+                raise ValueError('; '.join(problems))
+            self._update(state='warming')
+            dataset = Dataset(path, self.pooled, self.factory)
+            if self.warm is not None:
+                self.warm(dataset)
+            self._update(state='swapping')
+            self._pending = dataset.identity  # 发布到切换之间，refresh() 不把它当作其他进程的替换
+            legacy = build_db.archive_legacy(self.db_path)
+            current = self._current
+            if legacy is not None and current is not None and current.path == os.path.realpath(self.db_path):
+                current.retarget(legacy)
+            build_db.publish_version(self.db_path, path)
+            self._swap(dataset)
+            self._pending = None
+            removed = build_db.prune_versions(self.db_path)
+            info = build_db.read_build_info(path)
+            self._update(state='done', path=path, version=build_db.dataset_version(info), counts=stats['rows'],
+                         build_seconds=stats['seconds'], seconds=round(time.perf_counter() - start, 3),
+                         removed=[os.path.basename(name) for name in removed])
+            print(f"数据库已重建并切换到 {path}（{time.perf_counter() - start:.1f}s）")
+        except Exception as e:
+            self._pending = None
+            if dataset is not None:
+                dataset.retire()
+            if path is not None and os.path.realpath(self.db_path) != path:
+                build_db.remove_version(path)
+            self._update(state='failed', error=str(e), seconds=round(time.perf_counter() - start, 3))
+            print(f"重建数据库失败，继续使用当前版本: {e}")
+        finally:
+            lock.close()
+
+    def _progress(self, stage, rows):
+        self._update(stage=stage, step=build_db.BUILD_STAGES.index(stage) + 1, rows=rows)
+
+    def status_path(self):
+        return os.path.join(build_db.versions_dir(self.db_path), 'rebuild.json')
+
+    def _update(self, **fields):
+        """更新重建状态并写入状态文件（其他 worker 收到的进度查询也能读到）"""
+        with self._status_lock:
+            self._status.update(fields)
+            data = json.dumps(self._status)
+            path = self.status_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def status(self):
+        """最近一次重建的状态；{'state': 'idle'} 表示从未重建
+
+        状态文件显示进行中、但构建锁已经无人持有时，说明负责重建的进程已退出（'interrupted'）。
+        """
+        try:
+            with open(self.status_path()) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'idle'}
+        if status.get('state') in BUSY_STATES:
+            lock = build_db.try_build_lock(self.db_path)
+            if lock is not None:
+                lock.close()
+                status['state'] = 'interrupted'
+            else:
+                status['elapsed'] = round(time.time() - status['started'], 1)
+        return status
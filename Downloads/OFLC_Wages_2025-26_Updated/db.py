@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite 连接管理
+为每个线程（gevent 下为每个 greenlet）保留一个长连接，避免每个请求重复打开数据库、解析 schema
+"""
+
+import sqlite3
+import threading
+
+# 只读连接的调优参数
+READ_PRAGMAS = (
+    'PRAGMA query_only = ON',
+    'PRAGMA mmap_size = 268435456',   # 256MB 内存映射读取
+    'PRAGMA cache_size = -65536',     # 64MB 页缓存
+    'PRAGMA temp_store = MEMORY',
+)
+
+# 每个连接缓存的预编译语句数量
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionManager:
+    """按线程分配只读 SQLite 连接
+
+    pooled=False 时退化为每次取用都新建连接、用完即关闭（旧行为，便于对比）。
+    factory 为连接类（如带指标采集的 metrics.InstrumentedConnection），默认 sqlite3.Connection。
+    数据库文件被重建后调用 reset()，各线程在下一次取用时会重新打开连接；
+    数据集被替换且不再有请求使用时调用 close_all() 关闭所有线程的连接。
+    """
+
+    def __init__(self, db_path, pooled=True, factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.pooled = pooled
+        self.factory = factory
+        self._local = threading.local()
+        self._generation = 0
+        self._connections = set()  # 各线程的长连接，close_all() 时关闭
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            f'file:{self.db_path}?mode=ro',
+            uri=True,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=self.factory,
+        )
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """取得当前线程的连接"""
+        if not self.pooled:
+            return self._open()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+        if conn is not None:
+            self._discard(conn)
+        conn = self._open()
+        with self._lock:
+            self._connections.add(conn)
+        self._local.conn = conn
+        self._local.generation = self._generation
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+        conn.close()
+
+    def release(self, conn, error=None):
+        """请求结束时归还连接：长连接只回滚未结束的事务，出错的连接直接丢弃"""
+        if not self.pooled:
+            conn.close()
+            return
+        if isinstance(error, sqlite3.Error):
+            if getattr(self._local, 'conn', None) is conn:
+                self._local.conn = None
+            self._discard(conn)
+            return
+        if conn.in_transaction:
+            conn.rollback()
+
+    def close(self):
+        """关闭当前线程的长连接（gunicorn 主进程 fork 出 worker 之前调用，子进程不继承打开的连接）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._discard(conn)
+            self._local.conn = None
+
+    def reset(self):
+        """使所有线程的现有连接失效（数据库重建后调用）
+
+        不在这里跨线程关闭连接，以免打断其他线程正在执行的查询；
+        各线程在下一次 acquire() 时自行关闭旧连接并重新打开。
+        """
+        self._generation += 1
+
+    def close_all(self):
+        """关闭所有线程的长连接（数据集被替换、最后一个使用它的请求结束后调用）
+
+        之后仍有线程取用时会重新打开连接。
+        """
+        self._generation += 1
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+
+    def open_connections(self):
+        """当前打开的长连接数"""
+        return len(self._connections)
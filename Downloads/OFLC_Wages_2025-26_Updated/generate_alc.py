@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+合成 ALC_Export.csv
+OFLC 导出的 ALC_Export.csv（各地区 × 职业的四级现行工资）不在仓库中。这里按 Geography.csv 的全部地区和
+oes_soc_occs.csv 的全部职业生成同样规模、同样格式的文件，供测试和性能基准使用：
+- 工资为时薪：职业的基准工资取决于 SOC 大类（管理、医疗、餐饮……），再叠加职业自身的差异；
+  地区按所在州的工资水平调整，非都市区再低一些
+- Level 1 / Level 4 约为当地工资分布的第 17 / 67 百分位，Level 2、Level 3 按 OFLC 的做法在两者之间等距插值，
+  Average 略高于中位数；Level 1 不低于联邦最低时薪
+- GeoLvl 大多为 1（本地区数据），样本不足的组合（非都市区更常见）退到 2 / 3 / 4（相邻地区、全州、全国）
+- 少量单元为空（Level 4 超出上限、Average 缺失），少量行带 Label
+- 固定随机种子：同样的参数生成逐字节相同的文件，构建出的数据库数据版本也相同
+
+用法:
+    python3 -m generate_alc                          # 写入 ./ALC_Export.csv（约 45 万行）
+    python3 -m generate_alc --output /tmp/ALC_Export.csv --fraction 0.1 --seed 7
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+import time
+
+DEFAULT_SEED = 2025
+HEADER = ('Area', 'SocCode', 'GeoLvl', 'Level1', 'Level2', 'Level3', 'Level4', 'Average', 'Label')
+
+# SOC 大类的全国中位时薪（美元，约为 OEWS 的水平）
+MAJOR_GROUP_WAGES = {
+    '11': 58.0, '13': 39.0, '15': 50.0, '17': 44.0, '19': 38.0, '21': 26.0, '23': 47.0, '25': 28.0,
+    '27': 28.0, '29': 40.0, '31': 18.0, '33': 24.0, '35': 15.0, '37': 17.0, '39': 16.0, '41': 18.0,
+    '43': 21.0, '45': 17.0, '47': 27.0, '49': 26.0, '51': 21.0, '53': 19.0,
+}
+DEFAULT_GROUP_WAGE = 25.0
+# 各州（按 StateAb）相对全国的工资水平，未列出的取 STATE_DEFAULT
+STATE_LEVELS = {
+    'DC': 1.25, 'CA': 1.18, 'MA': 1.17, 'NY': 1.15, 'WA': 1.14, 'NJ': 1.12, 'CT': 1.10, 'MD': 1.10,
+    'AK': 1.08, 'HI': 1.06, 'CO': 1.06, 'RI': 1.04, 'MN': 1.03, 'OR': 1.03, 'VA': 1.02, 'IL': 1.02,
+    'MS': 0.82, 'AR': 0.84, 'WV': 0.85, 'AL': 0.87, 'LA': 0.88, 'OK': 0.88, 'KY': 0.88, 'SD': 0.88,
+    'NM': 0.89, 'SC': 0.89, 'TN': 0.90, 'ID': 0.90, 'MT': 0.90, 'PR': 0.70, 'GU': 0.80, 'VI': 0.85,
+}
+STATE_DEFAULT = 0.96
+NONMETRO_LEVEL = 0.88
+# Level 1 不低于联邦最低时薪
+MIN_HOURLY = 7.25
+# GeoLvl 1..4 的权重：都市区 / 非都市区
+GEO_LEVEL_WEIGHTS = ((0.80, 0.12, 0.06, 0.02), (0.55, 0.25, 0.14, 0.06))
+# Level 4 为空（超出上限）、Average 为空、带 Label 的比例
+MISSING_LEVEL4 = 0.015
+MISSING_AVERAGE = 0.005
+LABELED = 0.05
+LABEL = 'FLC Data Center'
+
+
+def read_areas(path):
+    """Geography.csv → [(地区代码, 州缩写, 是否非都市区)]，每个地区一项，按代码排序"""
+    areas = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            if row['Area'] not in areas:
+                state = row['StateAb'].split('-')[0]
+                areas[row['Area']] = (state, 'nonmetropolitan' in row['AreaName'].lower())
+    return [(area, *areas[area]) for area in sorted(areas)]
+
+
+def read_soc_codes(path):
+    """oes_soc_occs.csv → SOC 代码列表（文件顺序）"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return [row['soccode'] for row in csv.DictReader(f) if row['soccode']]
+
+
+def _money(value):
+    return f'{value:.2f}'
+
+
+def generate_rows(areas, soc_codes, seed=DEFAULT_SEED, fraction=1.0):
+    """逐行生成 ALC 记录（字符串元组，空单元为 ''）；fraction < 1 时随机保留这个比例的 地区 × 职业 组合"""
+    rng = random.Random(seed)
+    # 职业、地区各自的固定差异（对数正态），先于逐行的随机数生成，改变 fraction 不影响它们
+    occupations = {soc: MAJOR_GROUP_WAGES.get(soc[:2], DEFAULT_GROUP_WAGE) * math.exp(rng.gauss(0, 0.25))
+                   for soc in soc_codes}
+    places = {area: STATE_LEVELS.get(state, STATE_DEFAULT) * (NONMETRO_LEVEL if nonmetro else 1.0)
+              * math.exp(rng.gauss(0, 0.06)) for area, state, nonmetro in areas}
+    for area, _, nonmetro in areas:
+        weights = GEO_LEVEL_WEIGHTS[nonmetro]
+        for soc in soc_codes:
+            if fraction < 1.0 and rng.random() >= fraction:
+                continue
+            median = occupations[soc] * places[area] * math.exp(rng.gauss(0, 0.05))
+            level1 = max(median * rng.uniform(0.62, 0.72), MIN_HOURLY)
+            level4 = median * rng.uniform(1.30, 1.50)
+            step = (level4 - level1) / 3
+            average = median * rng.uniform(1.04, 1.12)
+            geo_level = rng.choices((1, 2, 3, 4), weights)[0]
+            yield (
+                area, soc, str(geo_level),
+                _money(level1), _money(level1 + step), _money(level1 + 2 * step),
+                '' if rng.random() < MISSING_LEVEL4 else _money(level4),
+                '' if rng.random() < MISSING_AVERAGE else _money(average),
+                LABEL if rng.random() < LABELED else '',
+            )
+
+
+def write_alc(output, source_dir='.', seed=DEFAULT_SEED, fraction=1.0):
+    """生成 ALC_Export.csv（写临时文件后原子替换），返回行数"""
+    areas = read_areas(os.path.join(source_dir, 'Geography.csv'))
+    soc_codes = read_soc_codes(os.path.join(source_dir, 'oes_soc_occs.csv'))
+    tmp = f'{output}.{os.getpid()}.tmp'
+    count = 0
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(HEADER)
+        for row in generate_rows(areas, soc_codes, seed, fraction):
+            writer.writerow(row)
+            count += 1
+    os.replace(tmp, output)
+    return count
+
+
+def ensure_alc(path='ALC_Export.csv', source_dir='.'):
+    """path 不存在时用默认种子生成合成数据（供性能基准等在没有原始导出的目录中运行），返回是否新生成"""
+    if os.path.exists(path):
+        return False
+    print(f"未找到 {path}，生成合成数据（种子 {DEFAULT_SEED}）…")
+    count = write_alc(path, source_dir)
+    print(f"✅ 已生成 {path}：{count} 行")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m generate_alc', description='生成合成的 ALC_Export.csv')
+    parser.add_argument('--source', default='.', help='Geography.csv / oes_soc_occs.csv 所在目录')
+    parser.add_argument('--output', default='ALC_Export.csv', help='输出文件')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='随机种子')
+    parser.add_argument('--fraction', type=float, default=1.0, help='保留的 地区 × 职业 组合比例（0-1）')
+    args = parser.parse_args(argv)
+    if not 0 < args.fraction <= 1:
+        parser.error('--fraction 须在 (0, 1] 之间')
+    start = time.perf_counter()
+    count = write_alc(args.output, args.source, args.seed, args.fraction)
+    print(f"✅ 已生成 {args.output}：{count} 行（种子 {args.seed}），耗时 {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+地区解析
+把用户输入的州/地区（可选县/镇）解析为 geography 中匹配的 (area, area_name, state, county_town_name) 行。
+匹配语义与原来的
+    (area_name LIKE '%loc%' OR state LIKE '%loc%' OR county_town_name LIKE '%loc%') AND county_town_name LIKE '%county%'
+完全一致，只是改为在内存中用后缀有序数组查找，并缓存每个输入的解析结果。
+原查询找不到任何地区时，再依次尝试州缩写精确匹配（如 "TX"）和拼写容错的模糊匹配（如 "Califrnia"）。
+"""
+
+import difflib
+import threading
+from collections import OrderedDict
+
+from autocomplete import InfixIndex
+
+# 解析结果缓存的条目数
+CACHE_SIZE = 1024
+# 模糊匹配的相似度阈值（difflib ratio）
+FUZZY_CUTOFF = 0.8
+
+
+class _ColumnIndex:
+    """某一列的去重取值 → 行号，支持子串查找和模糊查找"""
+
+    def __init__(self, values):
+        rows_by_value = {}
+        for row_id, value in enumerate(values):
+            if value is not None:
+                rows_by_value.setdefault(value, []).append(row_id)
+        self._values = list(rows_by_value)
+        self._rows = [rows_by_value[v] for v in self._values]
+        self._index = InfixIndex(self._values)
+        self._lower = {}
+        for i, value in enumerate(self._values):
+            self._lower.setdefault(value.lower(), []).append(i)
+
+    def search(self, query):
+        """包含 query（不区分大小写）的行号集合"""
+        return {row for i in self._index.search(query) for row in self._rows[i]}
+
+    def fuzzy(self, query):
+        """与 query 拼写相近的取值对应的行号集合"""
+        matches = difflib.get_close_matches(query.lower(), self._lower, n=3, cutoff=FUZZY_CUTOFF)
+        return {row for m in matches for i in self._lower[m] for row in self._rows[i]}
+
+
+class LocationResolver:
+    """geography 的内存副本 + 地区解析缓存"""
+
+    def __init__(self, geo_rows):
+        # geo_rows: [(area, area_name, state_ab, state, county_town_name)]，按表中顺序；
+        # 与 SELECT DISTINCT 一致，只保留每个 (area, area_name, state, county) 第一次出现的位置
+        seen = set()
+        self._rows = []
+        abbrevs = []
+        for area, area_name, state_ab, state, county in geo_rows:
+            key = (area, area_name, state, county)
+            if key not in seen:
+                seen.add(key)
+                self._rows.append(key)
+                abbrevs.append(state_ab)
+        self._area_names = _ColumnIndex([r[1] for r in self._rows])
+        self._states = _ColumnIndex([r[2] for r in self._rows])
+        self._counties = _ColumnIndex([r[3] for r in self._rows])
+        self._abbrevs = {}
+        for row_id, state_ab in enumerate(abbrevs):
+            if state_ab:
+                self._abbrevs.setdefault(state_ab.upper(), set()).add(row_id)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, conn):
+        """从 SQLite 读取 geography"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT area, area_name, state_ab, state, county_town_name
+            FROM geography ORDER BY id
+        ''')
+        return cls(cursor.fetchall())
+
+    def resolve(self, location, county=''):
+        """返回匹配的 [(area, area_name, state, county_town_name)]，顺序与原 SQL 查询一致"""
+        key = (location.lower(), county.lower())
+        with self._lock:
+            rows = self._cache.get(key)
+            if rows is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return rows
+            self.misses += 1
+        rows = [self._rows[i] for i in sorted(self._resolve(location, county))]
+        with self._lock:
+            self._cache[key] = rows
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return rows
+
+    def _resolve(self, location, county):
+        matched = self._match_location(location)
+        if not matched:
+            # 原查询无结果：州缩写精确匹配，再退到模糊匹配
+            matched = set(self._abbrevs.get(location.strip().upper(), ()))
+            if not matched:
+                matched = (self._area_names.fuzzy(location) | self._states.fuzzy(location)
+                           | self._counties.fuzzy(location))
+        if county and matched:
+            in_county = matched & self._counties.search(county)
+            matched = in_county or (matched & self._counties.fuzzy(county))
+        return matched
+
+    def _match_location(self, location):
+        return (self._area_names.search(location) | self._states.search(location)
+                | self._counties.search(location))
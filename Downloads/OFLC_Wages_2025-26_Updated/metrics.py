@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+指标采集
+各接口的耗时分布、每个请求执行的 SQL 语句数、每条 SQL 的耗时 / 返回行数 / 扫描量、缓存命中率，
+以 Prometheus 文本格式在 /metrics 输出；响应头 Server-Timing 给出本请求的总耗时和 SQL 耗时。
+- 不依赖 prometheus_client：计数器和直方图是加锁的字典，记录一次只是几次加法
+- SQL 计时：连接使用 InstrumentedConnection，游标的 execute / fetch* / 迭代分别计时，按语句"形状"
+  （合并空白，字面量和 IN 列表替换为占位符）归类；迭代游标时按批 fetchmany，不逐行计时
+- 扫描量：Python 的 sqlite3 不提供 sqlite3_stmt_status，用进度回调每 PROGRESS_STEPS 条虚拟机指令计一次，
+  作为扫描行数的近似
+- 慢查询：超过 SLOW_QUERY_MS 的语句交给 slow_queries.SlowQueryLog（按形状汇总，附查询计划）
+- 多个 gunicorn worker：设置 METRICS_DIR 时各进程的后台线程把自己的快照写入该目录（有更新时每秒一次），
+  /metrics 汇总目录中全部进程的快照（已退出的 worker 的计数保留，计数器不会倒退）
+"""
+
+import bisect
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import slow_queries
+
+# 请求、SQL 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个请求 SQL 语句数的桶上限
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# 进度回调的间隔（SQLite 虚拟机指令数）
+PROGRESS_STEPS = 1000
+# 迭代游标时 fetchmany 的批量：从小批开始（只取前几行的调用方不多读），逐批翻倍
+FETCH_BATCH = 16
+MAX_FETCH_BATCH = 1024
+# 写入 METRICS_DIR 快照的最小间隔（秒）
+SNAPSHOT_INTERVAL = 1.0
+# 语句形状（指标标签值）的最大长度，超出部分截断
+MAX_SHAPE_LENGTH = 1000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_TUPLE_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_shape(sql):
+    """SQL 的形状：合并空白，数字 / 字符串字面量替换为 ?，(?, ?, ...) 列表合并为 (...)，
+    多个元组（VALUES (?, ?),(?, ?),...）再合并为一个 (...)，长度不超过 MAX_SHAPE_LENGTH
+
+    同一条查询无论参数个数（如 IN 列表长度、批量查询的组数）都归为同一类，标签值的种类和长度有上限。
+    """
+    shape = _LITERALS.sub('?', ' '.join(sql.split()))
+    shape = _TUPLE_LISTS.sub('(...)', _PARAMETER_LISTS.sub('(...)', shape))
+    return shape if len(shape) <= MAX_SHAPE_LENGTH else shape[:MAX_SHAPE_LENGTH - 1] + '…'
+
+
+def label_key(labels):
+    """标签值元组 → 快照中的键"""
+    return json.dumps(labels, ensure_ascii=False)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """一个指标：counter / gauge / histogram，值按标签值元组存放"""
+
+    def __init__(self, registry, name, kind, help, labels, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self._lock = registry.lock
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self.values[labels] = value
+
+    def observe(self, labels, value):
+        """直方图记录一次观测：各桶的（非累积）计数、总和、次数"""
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+
+class Registry:
+    """进程内的指标集合；collect() 汇总各进程的快照，render() 输出 Prometheus 文本格式"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self._collectors = []
+        self._dirty = False
+        self._writer = None     # 启动写入线程的进程号（fork 出的 worker 需要自己的线程）
+
+    def _add(self, name, kind, help, labels, buckets=None):
+        metric = self.metrics[name] = Metric(self, name, kind, help, tuple(labels), buckets)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(name, 'counter', help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._add(name, 'gauge', help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(name, 'histogram', help, labels, buckets)
+
+    def collector(self, func):
+        """登记在取快照前调用的函数（把其他模块自己维护的计数同步到指标中）"""
+        self._collectors.append(func)
+        return func
+
+    def snapshot(self):
+        """本进程的全部指标：{指标名: {标签键: 值}}"""
+        for func in self._collectors:
+            func()
+        with self.lock:
+            return {name: {label_key(labels): json.loads(json.dumps(value))
+                           for labels, value in metric.values.items()}
+                    for name, metric in self.metrics.items()}
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+
+    def save(self):
+        """把本进程的快照写入 METRICS_DIR（写临时文件后原子替换）"""
+        self._dirty = False
+        path = self._snapshot_path()
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def changed(self):
+        """指标有更新（请求结束时调用）：设置了 METRICS_DIR 时由后台线程至多每 SNAPSHOT_INTERVAL 秒写入一次"""
+        if not self.directory:
+            return
+        self._dirty = True
+        if self._writer != os.getpid():
+            self._writer = os.getpid()
+            threading.Thread(target=self._write_loop, name='metrics-writer', daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            if self._dirty:
+                try:
+                    self.save()
+                except OSError as e:
+                    print(f"写入指标快照失败: {e}")
+
+    def collect(self):
+        """汇总后的快照：没有 METRICS_DIR 时只有本进程，否则为目录中所有进程的快照之和"""
+        if not self.directory:
+            return self.snapshot()
+        self.save()
+        merged = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # 进程正在替换文件
+            for metric, values in snapshot.items():
+                target = merged.setdefault(metric, {})
+                kind = self.metrics[metric].kind if metric in self.metrics else 'counter'
+                for key, value in values.items():
+                    if kind == 'gauge' or key not in target:
+                        target[key] = value
+                    elif kind == 'histogram':
+                        current = target[key]
+                        target[key] = [[a + b for a, b in zip(current[0], value[0])],
+                                       current[1] + value[1], current[2] + value[2]]
+                    else:
+                        target[key] += value
+        return merged
+
+    def render(self, snapshot):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for name, metric in self.metrics.items():
+            values = snapshot.get(name)
+            if not values:
+                continue
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, value in sorted(values.items()):
+                pairs = [f'{label}="{_escape(v)}"' for label, v in zip(metric.labels, json.loads(key))]
+                suffix = '{%s}' % ','.join(pairs) if pairs else ''
+                if metric.kind != 'histogram':
+                    lines.append(f'{name}{suffix} {_number(value)}')
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket in zip((*metric.buckets, '+Inf'), counts):
+                    cumulative += bucket
+                    le = bound if bound == '+Inf' else _number(float(bound))
+                    bucket_labels = ','.join(pairs + ['le="%s"' % le])
+                    lines.append(f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+                lines.append(f'{name}_sum{suffix} {_number(float(total))}')
+                lines.append(f'{name}_count{suffix} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(os.environ.get('METRICS_DIR') or None)
+
+# 慢查询日志（本进程），阈值为 SLOW_QUERY_MS 毫秒
+slow_log = slow_queries.SlowQueryLog(slow_queries.threshold_from_env(os.environ.get('SLOW_QUERY_MS')))
+
+REQUESTS = registry.counter('oflc_http_requests_total', '按接口、方法、状态码统计的请求数',
+                            ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = registry.histogram('oflc_http_request_duration_seconds', '请求耗时（含流式响应的生成）',
+                                     ('endpoint',))
+REQUEST_QUERIES = registry.histogram('oflc_http_request_sql_queries', '每个请求执行的 SQL 语句数',
+                                     ('endpoint',), QUERY_COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = registry.counter('oflc_http_request_sql_seconds_total', '各接口在 SQLite 中花费的总时间',
+                                       ('endpoint',))
+REQUEST_ROWS = registry.counter('oflc_http_request_sql_rows_total', '各接口从 SQLite 取回的总行数',
+                                ('endpoint',))
+STATEMENT_SECONDS = registry.histogram('oflc_sql_statement_duration_seconds',
+                                       '每条 SQL 的耗时（执行 + 取回全部结果），按语句形状', ('statement',))
+STATEMENT_ROWS = registry.counter('oflc_sql_rows_returned_total', '各语句返回的行数', ('statement',))
+STATEMENT_STEPS = registry.counter('oflc_sql_vm_steps_total',
+                                   f'各语句执行的 SQLite 虚拟机指令数（每 {PROGRESS_STEPS} 条计一次），近似扫描量',
+                                   ('statement',))
+SLOW_STATEMENTS = registry.counter('oflc_sql_slow_statements_total', '超过慢查询阈值的语句数（按接口、语句形状）',
+                                   ('endpoint', 'statement'))
+
+
+_local = threading.local()
+
+
+class RequestStats:
+    """一个请求的计时与 SQL 统计"""
+
+    __slots__ = ('endpoint', 'start', 'queries', 'sql_seconds', 'rows', 'cursors')
+
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.cursors = []
+
+    def server_timing(self):
+        """Server-Timing 响应头：到目前为止的总耗时和 SQL 耗时（流式响应只含响应头发出之前的部分）"""
+        total = (time.perf_counter() - self.start) * 1000
+        return (f'app;dur={total:.2f}, '
+                f'sql;dur={self.sql_seconds * 1000:.2f};desc="{self.queries} queries, {self.rows} rows"')
+
+
+def begin_request(endpoint=None):
+    """请求开始：之后当前线程执行的 SQL 计入这个请求"""
+    stats = _local.request = RequestStats(endpoint)
+    return stats
+
+
+def end_request(stats, endpoint, method, status):
+    """请求结束：结算未读完的游标，记录请求指标"""
+    _local.request = None
+    for cursor in stats.cursors:
+        cursor._finish()
+    labels = (endpoint,)
+    REQUESTS.inc((endpoint, method, str(status)))
+    REQUEST_SECONDS.observe(labels, time.perf_counter() - stats.start)
+    REQUEST_QUERIES.observe(labels, stats.queries)
+    if stats.queries:
+        REQUEST_SQL_SECONDS.inc(labels, stats.sql_seconds)
+        REQUEST_ROWS.inc(labels, stats.rows)
+    registry.changed()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """对 execute / fetch* / 迭代计时的游标；一条语句在读完结果、再次 execute 或请求结束时记入指标"""
+
+    _shape = None
+
+    def _timed(self, method, *args):
+        conn = self.connection
+        steps = conn.steps
+        start = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._seconds += elapsed
+            self._steps += conn.steps - steps
+            if self._request is not None:
+                self._request.sql_seconds += elapsed
+
+    def _add_rows(self, count):
+        self._rows += count
+        if self._request is not None:
+            self._request.rows += count
+
+    def _finish(self):
+        shape = self._shape
+        if shape is None:
+            return
+        self._shape = None
+        labels = (shape,)
+        STATEMENT_SECONDS.observe(labels, self._seconds)
+        if self._rows:
+            STATEMENT_ROWS.inc(labels, self._rows)
+        if self._steps:
+            STATEMENT_STEPS.inc(labels, self._steps * PROGRESS_STEPS)
+        threshold = slow_log.threshold
+        if threshold is not None and self._seconds >= threshold:
+            endpoint = self._request.endpoint if self._request is not None else None
+            SLOW_STATEMENTS.inc((endpoint or 'background', shape))
+            slow_log.record(self.connection, shape, self._sql, self._parameters, self._seconds, self._rows, endpoint)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._shape = statement_shape(sql)
+        self._sql, self._parameters = sql, parameters
+        self._seconds, self._rows, self._steps = 0.0, 0, 0
+        request = self._request = getattr(_local, 'request', None)
+        if request is not None:
+            request.queries += 1
+            request.cursors.append(self)
+        return self._timed(sqlite3.Cursor.execute, sql, parameters)
+
+    def fetchone(self):
+        if self._shape is None:
+            return super().fetchone()
+        row = self._timed(sqlite3.Cursor.fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._add_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        if self._shape is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        rows = self._timed(sqlite3.Cursor.fetchmany, self.arraysize if size is None else size)
+        self._add_rows(len(rows))
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._shape is None:
+            return super().fetchall()
+        rows = self._timed(sqlite3.Cursor.fetchall)
+        self._add_rows(len(rows))
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self._iterate() if self._shape is not None else super().__iter__()
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def _iterate(self):
+        size = FETCH_BATCH
+        while True:
+            rows = self.fetchmany(size)
+            if not rows:
+                return
+            yield from rows
+            size = min(size * 2, MAX_FETCH_BATCH)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """游标默认为 InstrumentedCursor，并用进度回调统计虚拟机指令数（ConnectionManager 的 factory）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = 0
+        self.set_progress_handler(self._tick, PROGRESS_STEPS)
+
+    def _tick(self):
+        self.steps += 1
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        # Connection.execute 在 C 中直接创建普通游标，这里改走 cursor()
+        return self.cursor().execute(sql, parameters)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+搜索接口的响应编码
+大结果集的响应里，occupation / location / county / label 等字符串在每一行重复，序列化和传输的开销都主要花在这些字段上：
+- OrjsonProvider：安装了 orjson 时代替 Flask 默认的 json 序列化（键排序、紧凑输出，与默认 provider 等价）
+- compact_results：format=compact 时按列输出，字符串列做字典编码（每列只列出一次不同取值，行里只放下标）
+- compress_response：按 Accept-Encoding 协商 br / gzip 压缩 JSON 响应（没有安装 brotli 时只用 gzip）
+"""
+
+import gzip
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 未安装时使用 Flask 默认的 json 序列化
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 未安装时只协商 gzip
+    brotli = None
+
+# 小于这个字节数的响应不压缩（压缩后省下的字节抵不过 CPU 和头部开销）
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+# brotli 质量 5：压缩率高于 gzip 6，耗时相近；更高的质量 CPU 开销成倍增加
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """用 orjson 序列化响应；日期、dataclass 等仍交给 Flask 默认的转换，输出格式与默认 provider 一致"""
+
+    def _options(self, indent=False):
+        options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | \
+            orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        return (options | orjson.OPT_INDENT_2) if indent else options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:  # 调用方指定了 json.dumps 的参数（如模板的 tojson），交给标准库
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def compact_results(rows):
+    """结果行（字典列表）→ 按列的紧凑结构
+
+    {'format': 'compact', 'count': 行数, 'columns': {列名: [各行的值]}, 'dictionaries': {列名: [取值表]}}，
+    全部取值为字符串（或 null）的列做字典编码，columns 中存取值表的下标。
+    """
+    columns, dictionaries = {}, {}
+    for name in (rows[0] if rows else ()):
+        values = [row[name] for row in rows]
+        if all(value is None or isinstance(value, str) for value in values):
+            lookup = {}
+            columns[name] = [lookup.setdefault(value, len(lookup)) for value in values]
+            dictionaries[name] = list(lookup)
+        else:
+            columns[name] = values
+    return {'format': 'compact', 'count': len(rows), 'columns': columns, 'dictionaries': dictionaries}
+
+
+def expand_compact(payload):
+    """compact_results 的逆变换（客户端解码的参考实现）"""
+    columns, dictionaries = payload['columns'], payload['dictionaries']
+    decoded = {name: [dictionaries[name][i] for i in values] if name in dictionaries else values
+               for name, values in columns.items()}
+    return [{name: values[i] for name, values in decoded.items()} for i in range(payload['count'])]
+
+
+def negotiate_encoding(accept_encodings):
+    """按客户端的 Accept-Encoding（werkzeug 的 Accept 对象）选择 'br' / 'gzip'，都不接受时返回 None"""
+    return accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+
+
+def compress(data, encoding):
+    """按协商出的编码压缩"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encodings):
+    """原地压缩可压缩的整体响应（流式响应逐块发送，不压缩）"""
+    if response.mimetype not in COMPRESSIBLE_TYPES or response.is_streamed or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None or response.content_length is None or response.content_length < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存
+一个薪资年度内数据不变，相同的正向/根据薪资/地区查询每次都重新计算没有意义。
+结果按 (接口, 规范化后的查询参数, 数据集版本) 缓存：
+- MemoryCache：进程内 LRU，按条目数和总结果行数限制大小，可选 TTL
+- DiskCache：可选的 SQLite 文件缓存，同一台机器上的多个 gunicorn worker 共享
+数据集版本是键的一部分，切换到新版本后旧条目不会再被命中；切换时（/api/init-db 重建、跟随其他进程的替换）
+再由 retain() 清空进程内缓存、删除磁盘缓存中其他版本的条目，不让它们继续占用空间。
+"""
+
+import hashlib
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 进程内缓存的默认条目数和总结果行数上限；缓存的一行（结果 dict）约占 1KB，
+# 默认上限约 50MB / worker（serve.py 启动 2×CPU+1 个 worker，各自一份）
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_ROWS = 50000
+# 单个结果超过这么多行时不缓存（避免一个大查询挤掉大部分条目）
+DEFAULT_MAX_RESULT_ROWS = 10000
+# 磁盘缓存的默认条目数上限
+DEFAULT_DISK_ENTRIES = 20000
+
+
+def make_key(endpoint, params, version):
+    """缓存键：接口名 + 规范化参数 + 数据集版本"""
+    return json.dumps([endpoint, version, params], sort_keys=True, separators=(',', ':'))
+
+
+def key_version(key):
+    """make_key 生成的键中的数据集版本"""
+    return json.loads(key)[1]
+
+
+class MemoryCache:
+    """进程内 LRU 缓存，值为结果行列表（调用方不得修改）"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_rows=DEFAULT_MAX_ROWS, ttl=0):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (写入时间, rows)
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, rows):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), rows)
+            self._rows += len(rows)
+            while self._entries and (len(self._entries) > self.max_entries or self._rows > self.max_rows):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def _remove(self, key):
+        _, rows = self._entries.pop(key)
+        self._rows -= len(rows)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'rows': self._rows}
+
+
+class DiskCache:
+    """SQLite 文件缓存，值以 JSON 存储；多个进程可同时读写同一个文件"""
+
+    def __init__(self, path, max_entries=DEFAULT_DISK_ENTRIES, ttl=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(result_cache)')}
+        if columns and 'version' not in columns:
+            conn.execute('DROP TABLE IF EXISTS result_cache')  # 旧格式的缓存文件：没有版本列，无法按版本清理
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key_hash TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                value TEXT NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache(accessed)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute('SELECT created, value FROM result_cache WHERE key_hash = ?',
+                           (self._hash(key),)).fetchone()
+        if row is None:
+            return None
+        if self.ttl and now - row[0] > self.ttl:
+            return None
+        conn.execute('UPDATE result_cache SET accessed = ? WHERE key_hash = ?', (now, self._hash(key)))
+        return json.loads(row[1])
+
+    def put(self, key, rows):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO result_cache VALUES (?, ?, ?, ?, ?)',
+                     (self._hash(key), key_version(key), now, now, json.dumps(rows, separators=(',', ':'))))
+        # 每写入一批再按最近访问时间淘汰，避免每次写入都统计条目数
+        self._writes += 1
+        if self._writes % 100 == 0:
+            conn.execute('''
+                DELETE FROM result_cache WHERE key_hash IN (
+                    SELECT key_hash FROM result_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def clear(self):
+        self._conn().execute('DELETE FROM result_cache')
+
+    def retain(self, version):
+        """删除其他数据集版本的条目，返回删除的条数"""
+        return self._conn().execute('DELETE FROM result_cache WHERE version != ?', (version,)).rowcount
+
+    def close(self):
+        """关闭当前线程的连接（fork 前调用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        entries = self._conn().execute('SELECT COUNT(*) FROM result_cache').fetchone()[0]
+        return {'path': self.path, 'entries': entries}
+
+
+class ResultCache:
+    """两级结果缓存：先查进程内 LRU，再查（可选的）磁盘缓存，并统计命中率"""
+
+    def __init__(self, memory=None, disk=None, max_result_rows=DEFAULT_MAX_RESULT_ROWS):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+        self.max_result_rows = max_result_rows
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        rows = self.memory.get(key)
+        if rows is None and self.disk is not None:
+            try:
+                rows = self.disk.get(key)
+            except sqlite3.Error:
+                rows = None  # 磁盘缓存不可用时只当作未命中
+            if rows is not None:
+                self.memory.put(key, rows)
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if rows is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return rows
+
+    def put(self, key, rows):
+        if len(rows) > self.max_result_rows:
+            return
+        self.memory.put(key, rows)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, rows)
+            except sqlite3.Error:
+                pass
+
+    def results(self, key, compute, stream=False):
+        """返回 key 对应结果的迭代器：命中时直接迭代缓存，未命中时
+
+        - 默认先读完 compute() 的完整结果写入缓存再迭代：与调用方读取多少无关（分页、limit 只取其中一段），
+          同一查询的其他页直接命中缓存
+        - stream=True（NDJSON 流式输出）时边生成边记录，不推迟第一行、不整体读入内存；结果被完整迭代后才写入缓存
+        """
+        rows = self.get(key)
+        if rows is not None:
+            return iter(rows)
+        return self._record(key, compute()) if stream else self._fill(key, compute())
+
+    def _fill(self, key, results):
+        # 第一次取结果时才读取（在调用方的取消检查之内），超过 max_result_rows 行时不缓存，其余照常逐行生成
+        rows = list(itertools.islice(results, self.max_result_rows + 1))
+        if len(rows) > self.max_result_rows:
+            yield from rows
+            yield from results
+            return
+        self.put(key, rows)
+        yield from rows
+
+    def _record(self, key, results):
+        rows = []
+        for row in results:
+            if rows is not None:
+                rows.append(row)
+                if len(rows) > self.max_result_rows:
+                    rows = None  # 太大，不缓存，也不再继续保存
+            yield row
+        if rows is not None:
+            self.put(key, rows)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            try:
+                self.disk.clear()
+            except sqlite3.Error:
+                pass
+
+    def retain(self, version):
+        """切换到数据集 version 后调用：清空进程内缓存（其中都是旧版本的结果），删除磁盘缓存中其他版本的条目"""
+        self.memory.clear()
+        if self.disk is not None:
+            try:
+                self.disk.retain(version)
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'memory': self.memory.stats(),
+        }
+        if self.disk is not None:
+            try:
+                stats['disk'] = self.disk.stats()
+            except sqlite3.Error as e:
+                stats['disk'] = {'path': self.disk.path, 'error': str(e)}
+        return stats
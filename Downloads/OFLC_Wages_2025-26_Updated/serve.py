@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+生产启动器
+用 gunicorn 运行应用，代替 `python3 app.py`（Flask 开发服务器）：
+- preload：主进程导入 app、建立只读内存结构（自动完成索引、地区解析、列式引擎等）后再 fork，
+  worker 通过写时复制共享这些页面；fork 前冻结 gc，避免子进程里的垃圾回收改写对象头、打散共享页面
+- worker 数、线程数按可用 CPU 计算（考虑容器的 cgroup CPU 配额），可用环境变量覆盖
+- gthread worker：空闲的 keep-alive 连接在 worker 的事件循环中等待，不占线程；
+  keep-alive 时间长于前端代理的空闲超时，由代理先关闭连接，避免复用到已被服务端关闭的连接
+- SERVER_MODE=asgi 时改用 uvicorn worker 运行 asgi.py（有界线程池，客户端断开时取消查询）
+- 各 worker 的指标快照写入同一个 METRICS_DIR（未设置时在内存文件系统上新建），/metrics 输出全部 worker 之和
+
+用法:
+    python3 -m serve                                   # 监听 0.0.0.0:$PORT（默认 8080）
+    WEB_CONCURRENCY=4 GUNICORN_THREADS=8 python3 -m serve
+
+环境变量: PORT, WEB_CONCURRENCY（worker 数）, GUNICORN_THREADS（每个 worker 的线程数）,
+         GUNICORN_KEEPALIVE（秒）, GUNICORN_TIMEOUT（秒）, GUNICORN_PRELOAD（0 时各 worker 自行加载）,
+         SERVER_MODE（wsgi / asgi）, METRICS_DIR（指标快照目录）
+"""
+
+import gc
+import math
+import os
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+DEFAULT_PORT = 8080
+# 每个 worker 的线程数：SQLite 查询期间释放 GIL，少量线程即可重叠 I/O 和查询
+THREADS_PER_WORKER = 4
+# 常见负载均衡/反向代理的空闲超时为 60s，这里取更长的时间
+KEEPALIVE = 75
+# 宽查询和首次构建数据库都可能超过 gunicorn 默认的 30s
+TIMEOUT = 120
+GRACEFUL_TIMEOUT = 30
+
+
+def _cgroup_cpu_quota():
+    """容器的 CPU 配额（可用的 CPU 数，可以是小数），未限制时返回 None"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:  # cgroup v2
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:  # cgroup v1
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def cpu_count():
+    """可用的 CPU 数：CPU 亲和性与 cgroup 配额取较小者"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        count = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota:
+        count = min(count, max(1, math.ceil(quota)))
+    return count
+
+
+def options(env=os.environ):
+    """gunicorn 配置（环境变量优先）"""
+    cpus = cpu_count()
+    asgi = env.get('SERVER_MODE', 'wsgi') == 'asgi'
+    opts = {
+        'bind': f"0.0.0.0:{env.get('PORT', DEFAULT_PORT)}",
+        'workers': int(env.get('WEB_CONCURRENCY', 2 * cpus + 1)),
+        'worker_class': 'uvicorn.workers.UvicornWorker' if asgi else 'gthread',
+        'threads': int(env.get('GUNICORN_THREADS', THREADS_PER_WORKER)),
+        'keepalive': int(env.get('GUNICORN_KEEPALIVE', KEEPALIVE)),
+        'timeout': int(env.get('GUNICORN_TIMEOUT', TIMEOUT)),
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'preload_app': env.get('GUNICORN_PRELOAD', '1') != '0',
+    }
+    # worker 心跳文件放在内存文件系统上，容器的 overlay 磁盘慢时不会被误判为超时
+    if os.path.isdir('/dev/shm'):
+        opts['worker_tmp_dir'] = '/dev/shm'
+    return opts
+
+
+class ProductionServer(BaseApplication):
+    """以给定配置运行 gunicorn，主进程中预先加载应用"""
+
+    def __init__(self, opts):
+        self.opts = opts
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.opts.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if self.opts['worker_class'] == 'gthread':
+            import app as wage_app
+            application = wage_app.app
+        else:
+            # asgi.py 的线程池大小与 gthread 模式的线程数一致
+            os.environ.setdefault('ASGI_THREADS', str(self.opts['threads']))
+            import app as wage_app
+            import asgi
+            application = asgi.app
+        wage_app.warm_dataset()
+        gc.freeze()
+        return application
+
+
+def main():
+    opts = options()
+    # 各 worker 共享的指标快照目录：未设置时为本次启动新建一个（须在导入 app 之前），主进程退出时删除
+    if not os.environ.get('METRICS_DIR'):
+        path = os.environ['METRICS_DIR'] = tempfile.mkdtemp(
+            prefix='oflc-metrics-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        opts['on_exit'] = lambda server: shutil.rmtree(path, ignore_errors=True)
+    print(f"启动 gunicorn（{opts['worker_class']}）：{opts['workers']} 个 worker × {opts['threads']} 线程，"
+          f"可用 CPU {cpu_count()}，keep-alive {opts['keepalive']}s，监听 {opts['bind']}")
+    ProductionServer(opts).run()
+
+
+if __name__ == '__main__':
+    main()
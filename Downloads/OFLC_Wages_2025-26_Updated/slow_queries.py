@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询日志
+宽泛的输入（如职位只输入 "a"）会让个别语句扫描大量行，以前只能从超时里发现。
+InstrumentedCursor（metrics.py）在一条语句读完结果后，把耗时超过阈值的语句交给 SlowQueryLog：
+- 按语句形状（与 /metrics 相同的归类）汇总次数、总耗时 / 最长耗时、返回行数、来自哪些接口
+- 保留每种形状最慢一次的耗时、行数，并在同一个连接上执行 EXPLAIN QUERY PLAN 记下当时的查询计划
+  （只在出现新的最慢记录时执行，不会每条慢查询都多跑一次）
+- 参数是用户的搜索输入，只用于生成查询计划，不保存也不打印；日志和汇总中只有归一化后的语句形状
+- 每条慢查询打印一行日志；/api/slow-queries（需管理令牌或本机访问）输出本进程的汇总，DELETE 清空
+"""
+
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# 默认阈值（毫秒），SLOW_QUERY_MS 覆盖，0 关闭
+DEFAULT_THRESHOLD_MS = 100
+# 最多汇总的语句形状数，超出时丢弃总耗时最少的
+MAX_SHAPES = 256
+# 日志行中 SQL 的最大长度
+LOG_SQL_LENGTH = 200
+
+
+def query_plan(conn, sql, parameters):
+    """EXPLAIN QUERY PLAN 的输出，按父子关系缩进为文本行（与 sqlite3 命令行的显示一致）"""
+    # 用 sqlite3.Connection.execute 得到普通游标，计划查询本身不计入指标和慢查询
+    rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    depth, lines = {0: -1}, []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return lines
+
+
+class SlowQueryLog:
+    """按语句形状汇总的慢查询（本进程）；threshold 为秒，None 表示关闭"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD_MS / 1000, max_shapes=MAX_SHAPES):
+        self.threshold = threshold
+        self.max_shapes = max_shapes
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, conn, shape, sql, parameters, seconds, rows, endpoint):
+        """记录一条耗时 seconds 的语句；成为该形状最慢的一次时捕获查询计划"""
+        endpoint = endpoint or 'background'
+        with self._lock:
+            entry = self._entries.get(shape)
+            if entry is None:
+                if len(self._entries) >= self.max_shapes:
+                    del self._entries[min(self._entries, key=lambda key: self._entries[key]['total_seconds'])]
+                entry = self._entries[shape] = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                                'rows': 0, 'endpoints': {}, 'slowest': None, 'plan': None}
+            entry['count'] += 1
+            entry['total_seconds'] += seconds
+            entry['rows'] += rows
+            entry['endpoints'][endpoint] = entry['endpoints'].get(endpoint, 0) + 1
+            slowest = seconds > entry['max_seconds']
+            if slowest:
+                entry['max_seconds'] = seconds
+                entry['slowest'] = {
+                    'rows': rows, 'ms': round(seconds * 1000, 2), 'endpoint': endpoint,
+                    'at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                }
+        print(f"慢查询 {seconds * 1000:.0f}ms [{endpoint}] {rows} 行: {shape[:LOG_SQL_LENGTH]}")
+        if slowest:
+            try:
+                plan = query_plan(conn, sql, parameters)
+            except sqlite3.Error as e:  # 连接已被中断或关闭
+                plan = [f'EXPLAIN QUERY PLAN 失败: {e}']
+            with self._lock:
+                if entry['max_seconds'] == seconds:
+                    entry['plan'] = plan
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def report(self):
+        """各语句形状的汇总，按总耗时从高到低排列"""
+        with self._lock:
+            entries = [(shape, dict(entry, endpoints=dict(entry['endpoints'])))
+                       for shape, entry in self._entries.items()]
+        entries.sort(key=lambda item: item[1]['total_seconds'], reverse=True)
+        return [{
+            'statement': shape,
+            'count': entry['count'],
+            'total_ms': round(entry['total_seconds'] * 1000, 2),
+            'avg_ms': round(entry['total_seconds'] * 1000 / entry['count'], 2),
+            'max_ms': round(entry['max_seconds'] * 1000, 2),
+            'rows': entry['rows'],
+            'endpoints': entry['endpoints'],
+            'slowest': entry['slowest'],
+            'plan': entry['plan'],
+        } for shape, entry in entries]
+
+    def stats(self):
+        return {
+            'enabled': self.threshold is not None,
+            'threshold_ms': None if self.threshold is None else round(self.threshold * 1000, 3),
+            'statements': self.report(),
+        }
+
+
+def threshold_from_env(value):
+    """SLOW_QUERY_MS 环境变量 → 阈值（秒）；0 表示关闭"""
+    ms = float(value) if value not in (None, '') else DEFAULT_THRESHOLD_MS
+    return ms / 1000 if ms > 0 else None
@@ -6,10 +6,76 @@ API测试脚本
 """
 
 import requests
+import asyncio
+import atexit
+import functools
 import json
+import io
+import itertools
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import build_db
+import generate_alc
+import numpy as np
+import pytest
 
 BASE_URL = "http://localhost:8080"
 
+# 进程内一致性测试使用的查询
+PARITY_CASES = [
+    ('/api/search/forward', {"position": "Manager", "location": "California"}),
+    ('/api/search/forward', {"position": "Manager", "location": "California", "county": "Orange County"}),
+    ('/api/search/forward', {"position": "nurse", "location": "ny"}),
+    ('/api/search/reverse', {"min_salary": 60000.0, "max_salary": 100000.0, "location": "California"}),
+    ('/api/search/reverse', {"min_salary": 60000.0, "max_salary": 100000.0, "location": "Texas", "county": "Harris"}),
+    ('/api/search/reverse', {"min_salary": 60000.0, "max_salary": 100000.0, "location": "California", "levels": [1, 3, 4]}),
+    ('/api/search/location', {"position": "Marketing Manager", "target_level": 2, "target_salary": 80000.0}),
+    ('/api/search/location', {"position": "Software", "target_level": 4, "target_salary": 150000.0}),
+    ('/api/search/location', {"position": "Nurse", "target_level": 1, "target_salary": 50000.0}),
+    ('/api/search/location', {"position": "Nurse", "target_level": 3, "target_salary": 90000.0, "state": "CA, texas"}),
+    ('/api/search/location', {"position": "Software", "target_level": 2, "target_salary": 90000.0, "top_k": 5}),
+]
+
+
+# 进程内测试的数据集：合成 ALC 数据中 地区 × 职业 组合的比例（约 4.5 万行，构建约 3 秒）
+FIXTURE_FRACTION = 0.1
+# 复制到测试数据集目录的数据文件（ALC_Export.csv 由 generate_alc 生成）
+FIXTURE_FILES = ('Geography.csv', 'oes_soc_occs.csv', 'xwalk_plus.csv')
+
+
+@functools.lru_cache(maxsize=None)
+def fixture_dataset():
+    """在临时目录中用 generate_alc + build_db 构建小规模数据集（每个测试会话一次），并切换到该目录
+
+    app 在导入时按相对路径打开 wage_data.db，进程内测试都使用这个数据集，不依赖本地是否构建过数据库；
+    必须在导入 app 之前调用。目录在进程退出时删除。
+    """
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    tmp = tempfile.mkdtemp(prefix='oflc-test-')
+    atexit.register(shutil.rmtree, tmp, True)
+    for name in FIXTURE_FILES:
+        shutil.copy(os.path.join(source_dir, name), tmp)
+    generate_alc.write_alc(os.path.join(tmp, 'ALC_Export.csv'), tmp, fraction=FIXTURE_FRACTION)
+    db_path = os.path.join(tmp, build_db.DEFAULT_DB_PATH)
+    path, _ = build_db.build_version(db_path, tmp)
+    build_db.publish_version(db_path, path)
+    os.chdir(tmp)
+    return tmp
+
+
+def local_client():
+    """进程内 Flask test client，使用 fixture_dataset() 构建的数据集"""
+    fixture_dataset()
+    import app as wage_app
+    client = wage_app.app.test_client()
+    assert client.get('/health').status_code == 200
+    return wage_app, client
+
 def test_forward_search():
     """测试根据职位名称查询"""
     print("=== 测试根据职位名称查询 ===")
@@ -53,7 +119,8 @@ def test_reverse_search():
             if result['results']:
                 first_result = result['results'][0]
                 print(f"   示例结果: {first_result['occupation']} in {first_result['location']}")
-                print(f"   符合薪资范围的Level: {[f'Level {level['level']}: ${level['salary']}' for level in first_result['matching_levels']]}")
+                matching = [f"Level {level['level']}: ${level['salary']}" for level in first_result['matching_levels']]
+                print(f"   符合薪资范围的Level: {matching}")
         else:
             print(f"❌ 根据薪资查询失败: {response.status_code} - {response.text}")
     except Exception as e:
@@ -138,6 +205,982 @@ def test_autocomplete():
     except Exception as e:
         print(f"❌ 县搜索异常: {e}")
 
+def test_wage_engine_parity():
+    """测试 numpy 列式引擎与 SQLite 查询结果一致（进程内）"""
+    print("\n=== 测试列式引擎一致性 ===")
+    wage_app, client = local_client()
+    original = wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE']
+    wage_app.app.config['RESULT_CACHE'] = False  # 两种引擎都要实际计算
+    try:
+        for url, data in PARITY_CASES:
+            wage_app.app.config['WAGE_ENGINE'] = 'sqlite'
+            expected = client.post(url, json=data)
+            wage_app.app.config['WAGE_ENGINE'] = 'numpy'
+            actual = client.post(url, json=data)
+            same = (expected.status_code, expected.get_json()) == (actual.status_code, actual.get_json())
+            if not same:
+                print(f"❌ 结果不一致: {url} {data}")
+            assert same
+        print(f"✅ {len(PARITY_CASES)} 个查询在两种引擎下结果一致")
+    finally:
+        wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = original
+
+
+def test_wage_engine_shared_memory():
+    """测试列式引擎的按行数据在只读共享内存中，fork 出的子进程读取时不复制页面（进程内，仅 Linux）"""
+    print("\n=== 测试列式引擎共享内存 ===")
+    if not hasattr(os, 'fork') or not os.path.exists('/proc/self/smaps_rollup'):
+        pytest.skip("需要 fork 和 /proc/self/smaps_rollup（Linux）")
+    fixture_dataset()
+    from wage_engine import ColumnarWageEngine
+    with sqlite3.connect('wage_data.db') as conn:
+        engine = ColumnarWageEngine.load(conn)
+    assert not any(array.flags.writeable for array in engine.arrays.values())
+    assert engine.soc_idx.dtype.itemsize <= 4 and engine.by_soc.dtype.itemsize == 4
+
+    def checksum_arrays(arrays):
+        # add.reduce 原地按块读取，不像 nansum 那样生成整列的临时数组
+        return [repr(float(np.add.reduce(array.ravel(), dtype=np.float64))) for array in arrays.values()]
+
+    def private_kb():
+        with open('/proc/self/smaps_rollup') as f:
+            return sum(int(line.split()[1]) for line in f if line.startswith('Private_'))
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # 子进程：读遍全部数组，报告独占内存的增量
+        try:
+            before = private_kb()
+            checksum = checksum_arrays(engine.arrays)
+            os.write(write_fd, json.dumps([private_kb() - before, checksum]).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        growth_kb, checksum = json.load(f)
+    os.waitpid(pid, 0)
+    assert checksum == checksum_arrays(engine.arrays)
+    # 读遍 nbytes 字节的数组后，子进程独占内存的增长应远小于数组本身
+    assert growth_kb * 1024 < engine.nbytes() * 0.1, f"子进程复制了 {growth_kb}KB"
+    print(f"✅ {engine.nbytes() / 1e6:.0f}MB 只读数组，子进程读取后独占内存只增加 {growth_kb / 1024:.1f}MB")
+
+
+def test_columns_file():
+    """测试列式文件：mmap 打开的引擎与从 SQLite 加载的完全一致，损坏或版本不符的文件不会被使用（进程内）"""
+    print("\n=== 测试列式文件 ===")
+    wage_app, _ = local_client()
+    from wage_engine import ColumnarWageEngine
+    version = wage_app.dataset_version()
+    with sqlite3.connect('wage_data.db') as conn, tempfile.TemporaryDirectory() as tmp:
+        loaded = ColumnarWageEngine.load(conn, version)
+        path = os.path.join(tmp, 'wage_data.db.columns')
+        size = loaded.save(path)
+        start = time.perf_counter()
+        opened = ColumnarWageEngine.open(path)
+        open_ms = (time.perf_counter() - start) * 1000
+
+        assert opened.dataset_version == version and opened.wage_scale == loaded.wage_scale
+        assert opened.arrays.keys() == loaded.arrays.keys()
+        for name, array in loaded.arrays.items():
+            assert opened.arrays[name].dtype == array.dtype and np.array_equal(opened.arrays[name], array), name
+            assert not opened.arrays[name].flags.writeable
+        assert opened.titles == loaded.titles and opened.geo_groups == loaded.geo_groups
+        assert opened.forward(['15-1252', '29-1141'], loaded.area_codes[:50]) == \
+            loaded.forward(['15-1252', '29-1141'], loaded.area_codes[:50])
+        assert opened.reverse(loaded.area_codes[0], 30.0, 45.5, (1, 2, 3, 4)) == \
+            loaded.reverse(loaded.area_codes[0], 30.0, 45.5, (1, 2, 3, 4))
+        assert opened.location('15-1252', 2, 48.08) == loaded.location('15-1252', 2, 48.08)
+
+        # 截断、不是列式文件：抛出 ValueError
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        try:
+            ColumnarWageEngine.open(path)
+            assert False, "截断的文件应当无法打开"
+        except ValueError:
+            pass
+        with open(path, 'wb') as f:
+            f.write(b'not a columnar file')
+        try:
+            ColumnarWageEngine.open(path)
+            assert False, "格式不对的文件应当无法打开"
+        except ValueError:
+            pass
+
+        # 数据库旁的列式文件版本与数据库不符时，改为从数据库加载
+        engine = wage_app.load_wage_engine(conn, 'other-version')
+        assert engine.dataset_version == 'other-version' and len(engine) == len(loaded)
+    print(f"✅ 列式文件 {size / 1e6:.1f}MB，打开用时 {open_ms:.1f}ms，与从数据库加载的引擎一致")
+
+
+def test_autocomplete_index_parity():
+    """测试进程内自动完成索引与 SQLite LIKE 查询结果一致（进程内）"""
+    print("\n=== 测试自动完成索引一致性 ===")
+    wage_app, client = local_client()
+    urls = [f"/api/search/states?q={q}" for q in ("ca", "New", "a", "w y", "TX", "zz")]
+    urls += [f"/api/search/counties?q={q}" for q in ("or", "Orange", "ange co", "county")]
+    urls += [f"/api/search/counties?q={q}&state={state}" for q in ("or", "san") for state in ("New", "cal")]
+    original = wage_app.app.config['AUTOCOMPLETE_INDEX']
+    try:
+        for url in urls:
+            wage_app.app.config['AUTOCOMPLETE_INDEX'] = False
+            expected = client.get(url).get_json()
+            wage_app.app.config['AUTOCOMPLETE_INDEX'] = True
+            actual = client.get(url).get_json()
+            if expected != actual:
+                print(f"❌ 结果不一致: {url}")
+            assert expected == actual
+        # 职业：标题以输入开头的排在最前
+        titles = [o['title'] for o in client.get("/api/search/occupations?q=soft").get_json()['occupations']]
+        assert titles and all(t.lower().startswith("soft") for t in titles[:2])
+        print(f"✅ {len(urls)} 个州/县查询结果一致，职业按前缀优先排序")
+    finally:
+        wage_app.app.config['AUTOCOMPLETE_INDEX'] = original
+
+
+def test_location_resolver_parity():
+    """测试地区解析器与原 geography LIKE 查询得到相同的地区（进程内）"""
+    print("\n=== 测试地区解析一致性 ===")
+    wage_app, _ = local_client()
+    import sqlite3
+    from location_resolver import LocationResolver
+    conn = sqlite3.connect(wage_app.DB_PATH)
+    resolver = LocationResolver.load(conn)
+    states = [row[0] for row in conn.execute("SELECT DISTINCT state FROM geography")]
+    cases = [(state, '') for state in states]
+    cases += [("California", "Orange"), ("ca", ""), ("a", ""), ("New", "King"), ("Virginia", "co"),
+              ("ny", ""), ("york", ""), ("w y", ""), ("Los Angeles", ""), ("Texas", "Harris County")]
+    for location, county in cases:
+        params = ('%' + location + '%',) * 3
+        if county:
+            rows = conn.execute('''
+                SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
+                FROM geography g
+                WHERE (g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?)
+                AND g.county_town_name LIKE ?
+            ''', params + ('%' + county + '%',)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT DISTINCT g.area, g.area_name, g.state, g.county_town_name
+                FROM geography g
+                WHERE g.area_name LIKE ? OR g.state LIKE ? OR g.county_town_name LIKE ?
+            ''', params).fetchall()
+        resolved = resolver.resolve(location, county)
+        if rows != resolved:
+            print(f"❌ 地区不一致: {location!r} {county!r}")
+        assert rows == resolved
+    # 原查询无结果时才启用缩写/模糊匹配
+    assert {row[2] for row in resolver.resolve("Califrnia")} == {"California"}
+    conn.close()
+    print(f"✅ {len(cases)} 个地区输入解析结果与 LIKE 查询一致")
+
+
+def test_forward_batch():
+    """测试批量正向查询与逐条查询结果一致（进程内）"""
+    print("\n=== 测试批量正向查询 ===")
+    _, client = local_client()
+    queries = [
+        {"position": "Manager", "location": "California", "county": "Orange County"},
+        {"position": "nurse", "location": "ny"},
+        {"position": "", "location": "Texas"},
+        {"position": "zzzz", "location": "Texas"},
+    ]
+    response = client.post('/api/search/forward/batch', json=queries)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.status_code == 200 and len(lines) == len(queries)
+    for query, line in zip(queries, lines):
+        single = client.post('/api/search/forward', json=query)
+        same = single.status_code == line['status'] and single.get_json().get('results') == line.get('results')
+        if not same:
+            print(f"❌ 批量结果与单独查询不一致: {query}")
+        assert same
+    # CSV 请求体
+    csv_body = "position,location,county\nManager,California,Orange County\n"
+    response = client.post('/api/search/forward/batch', data=csv_body, content_type='text/csv')
+    assert json.loads(response.get_data(as_text=True).splitlines()[0])['results'] == lines[0]['results']
+    # 非 UTF-8 的上传文件（如 Excel 导出的 cp1252 CSV）返回 400
+    upload = io.BytesIO("position,location\nCaf\u00e9 Manager,California\n".encode('cp1252'))
+    response = client.post('/api/search/forward/batch', data={'file': (upload, 'queries.csv')})
+    assert response.status_code == 400 and 'error' in response.get_json()
+    print(f"✅ 批量查询 {len(queries)} 组结果与逐条查询一致，CSV 输入正常，非 UTF-8 文件返回 400")
+
+
+def test_streaming_pagination():
+    """测试分页与 NDJSON 流式输出与一次性结果一致（进程内）"""
+    print("\n=== 测试分页与流式输出 ===")
+    _, client = local_client()
+    data = {"min_salary": 70000, "max_salary": 80000, "location": "Orange County"}
+    full = client.post('/api/search/reverse', json=data).get_json()['results']
+
+    pages, cursor = [], None
+    while True:
+        page = client.post('/api/search/reverse', json={**data, "limit": 50, **({"cursor": cursor} if cursor else {})}).get_json()
+        pages.extend(page['results'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == full
+
+    response = client.post('/api/search/reverse', json={**data, "stream": True})
+    streamed = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.mimetype == 'application/x-ndjson' and streamed == full
+    assert client.post('/api/search/reverse', json={**data, "limit": 0}).status_code == 400
+    print(f"✅ {len(full)} 行结果分页、流式输出与一次性返回一致")
+
+
+def test_location_leaderboard():
+    """测试预排序的地区查询排行与原 GROUP BY 查询结果一致，并支持州过滤和 top_k（进程内）"""
+    print("\n=== 测试地区查询排行 ===")
+    wage_app, client = local_client()
+    with wage_app.app.app_context():
+        cursor = wage_app.get_db().cursor()
+        soc_codes = [soc for soc, in cursor.execute('SELECT DISTINCT soc_code FROM wage_data ORDER BY soc_code')]
+        for soc_code, level, salary in itertools.product(soc_codes[::40], (1, 4), (0, 90000)):
+            level_column = f'level{level}'
+            expected = cursor.execute(f'''
+                SELECT w.level1, w.level2, w.level3, w.level4, w.average, w.label,
+                       g.state, g.county_town_name, MIN(w.{level_column})
+                FROM wage_data w JOIN geography g ON w.area = g.area
+                WHERE w.soc_code = ? AND w.{level_column} IS NOT NULL AND w.{level_column} >= ?
+                GROUP BY g.state, g.county_town_name ORDER BY MIN(w.{level_column}) ASC
+            ''', (soc_code, salary / 2080)).fetchall()
+            actual = list(wage_app.fetch_location_wages(cursor, soc_code, level, salary / 2080))
+            assert actual == expected, f"{soc_code} Level {level} ${salary} 结果不一致"
+
+    data = {"position": "Registered Nurse", "target_level": 2, "target_salary": 70000}
+    full = client.post('/api/search/location', json=data).get_json()['results']
+    in_state = client.post('/api/search/location', json={**data, "state": "TX"}).get_json()['results']
+    assert in_state and in_state == [r for r in full if r['location'] == 'Texas']
+    top = client.post('/api/search/location', json={**data, "top_k": 3}).get_json()['results']
+    for soc_code in {r['soc_code'] for r in full}:
+        assert [r for r in top if r['soc_code'] == soc_code] == [r for r in full if r['soc_code'] == soc_code][:3]
+    assert client.post('/api/search/location', json={**data, "top_k": 0}).status_code == 400
+    assert client.post('/api/search/location', json={**data, "target_level": 5}).status_code == 400
+    print(f"✅ 排行与 GROUP BY 查询一致，州过滤 {len(in_state)} 行，top_k 3 共 {len(top)} 行")
+
+
+async def call_asgi(asgi_app, path, data, disconnect_after=None):
+    """直接调用 ASGI 应用：返回 (状态码, 响应体)；disconnect_after 秒后模拟客户端断开"""
+    body = json.dumps(data).encode()
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        if disconnect_after is None:
+            await asyncio.Event().wait()  # 直到响应结束被取消
+        await asyncio.sleep(disconnect_after)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'', 'http_version': '1.1',
+             'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]}
+    await asgi_app(scope, receive, send)
+    while asgi_app.active:  # 等执行线程归还线程池
+        await asyncio.sleep(0.005)
+    status = next((m['status'] for m in sent if m['type'] == 'http.response.start'), None)
+    return status, b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+
+
+def test_asgi_entry():
+    """测试 ASGI 入口：结果与 WSGI 一致、线程和排队满时返回 503、客户端断开时取消查询（进程内）"""
+    print("\n=== 测试 ASGI 入口 ===")
+    wage_app, client = local_client()
+    import asgi
+    original = wage_app.app.config['RESULT_CACHE']
+    wage_app.app.config['RESULT_CACHE'] = False
+    asgi_app = asgi.AsgiApp(wage_app.app, threads=1, queue=0)
+    broad = {"position": "Manager", "target_level": 1, "target_salary": 30000}
+    fetch_location_wages = wage_app.fetch_location_wages
+
+    def stalled_location_wages(cursor, *args):
+        # 测试数据集很小，查询本身很快结束：先在同一个连接上执行一条长时间运行的语句，直到客户端断开时被中断
+        cursor.execute('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1e9) '
+                       'SELECT max(i) FROM n').fetchone()
+        return fetch_location_wages(cursor, *args)
+
+    async def scenario():
+        for url, data in PARITY_CASES[:4]:
+            status, body = await call_asgi(asgi_app, url, data)
+            expected = client.post(url, json=data)
+            assert (status, json.loads(body)) == (expected.status_code, expected.get_json())
+
+        # 唯一的线程被一个大查询占用时，新请求直接 503；客户端断开后大查询被中断，线程很快空出来
+        wage_app.fetch_location_wages = stalled_location_wages
+        start = time.perf_counter()
+        slow = asyncio.ensure_future(call_asgi(asgi_app, '/api/search/location', broad, disconnect_after=0.3))
+        await asyncio.sleep(0.1)
+        busy, _ = await call_asgi(asgi_app, '/api/search/forward', PARITY_CASES[0][1])
+        assert busy == 503 and asgi_app.rejected == 1
+        assert (await slow)[0] is None
+        return time.perf_counter() - start
+
+    original_engine = wage_app.app.config['WAGE_ENGINE']
+    wage_app.app.config['WAGE_ENGINE'] = 'sqlite'
+    try:
+        cancelled_after = asyncio.run(scenario())
+    finally:
+        asgi_app.executor.shutdown()
+        wage_app.fetch_location_wages = fetch_location_wages
+        wage_app.app.config['RESULT_CACHE'], wage_app.app.config['WAGE_ENGINE'] = original, original_engine
+    assert asgi_app.cancelled == 1 and cancelled_after < 1.5
+
+    # start_response 返回 write()，直接写出的数据在可迭代对象之前
+    def legacy_wsgi(environ, start_response):
+        write = start_response('200 OK', [('Content-Type', 'text/plain')])
+        write(b'written, ')
+        return [b'returned']
+    legacy = asgi.AsgiApp(legacy_wsgi, threads=1)
+    try:
+        assert asyncio.run(call_asgi(legacy, '/', {})) == (200, b'written, returned')
+    finally:
+        legacy.executor.shutdown()
+
+    # 被中断的语句直接抛出，不改走旧数据库的退回查询（新旧结构在每个数据集上只判断一次）；
+    # 用单独的连接，不替换连接池中连接统计虚拟机指令数的进度回调
+    dataset = wage_app.datasets.current
+    wage_app.dataset_tables(dataset)
+    conn = sqlite3.connect(f'file:{dataset.path}?mode=ro', uri=True)
+    try:
+        cursor = conn.cursor()
+        calls = [
+            lambda: wage_app.match_occupations(cursor, 'manager'),
+            lambda: list(wage_app.fetch_reverse_wages(cursor, '31084', 0, 100, [2])),
+            lambda: list(wage_app.fetch_location_wages(cursor, '11-1021', 1, 0)),
+        ]
+        for call in calls:
+            call()  # 先正常执行一次：读入 schema、连接 FTS 表，之后的中断发生在执行语句时
+            statements = []
+            conn.set_trace_callback(lambda sql: sql.startswith('--') or statements.append(sql))  # 略过 FTS5 的内部语句
+            conn.set_progress_handler(lambda: 1, 1)  # 第一条指令即中断，相当于 Connection.interrupt()
+            try:
+                call()
+                assert False, "被中断的语句应当抛出异常"
+            except sqlite3.OperationalError as e:
+                assert 'interrupt' in str(e)
+            finally:
+                conn.set_progress_handler(None, 0)
+                conn.set_trace_callback(None)
+            assert len(statements) == 1, statements
+    finally:
+        conn.close()
+    with wage_app.app.app_context():
+        pooled = wage_app.get_db()
+        if hasattr(pooled, 'steps'):  # 连接池的连接仍在统计虚拟机指令数
+            steps = pooled.steps
+            pooled.execute('SELECT COUNT(*) FROM wage_data WHERE level1 > 0').fetchone()
+            assert pooled.steps > steps
+    print(f"✅ ASGI 结果与 WSGI 一致，排队满时 503，断开后 {cancelled_after * 1000:.0f}ms 释放线程，中断的语句不改走退回查询，支持 write()")
+
+
+def test_production_launcher():
+    """测试生产启动器的配置计算，以及 preload 后主进程不持有打开的数据库连接（进程内）"""
+    print("\n=== 测试生产启动器 ===")
+    import serve
+    opts = serve.options({'PORT': '9000'})
+    assert opts['bind'] == '0.0.0.0:9000' and opts['preload_app'] and opts['worker_class'] == 'gthread'
+    assert opts['workers'] == 2 * serve.cpu_count() + 1 and opts['keepalive'] > 60
+    opts = serve.options({'WEB_CONCURRENCY': '2', 'GUNICORN_THREADS': '16', 'SERVER_MODE': 'asgi'})
+    assert (opts['workers'], opts['threads'], opts['worker_class']) == (2, 16, 'uvicorn.workers.UvicornWorker')
+
+    wage_app, client = local_client()
+    wage_app.warm_dataset()
+    assert getattr(wage_app.datasets.current.pool._local, 'conn', None) is None
+    assert all(name in wage_app.datasets.current.objects for name in ('autocomplete', 'location_resolver', 'version'))
+    assert client.get('/api/search/states?q=cal').status_code == 200
+    print(f"✅ {serve.cpu_count()} CPU → {2 * serve.cpu_count() + 1} 个 worker，preload 后未持有数据库连接")
+
+
+def test_result_cache():
+    """测试查询结果缓存：命中结果与未缓存一致，重建数据集后失效（进程内）"""
+    print("\n=== 测试查询结果缓存 ===")
+    wage_app, client = local_client()
+    cache = wage_app.result_cache
+    cache.clear()
+    data = {"min_salary": 70000, "max_salary": 80000, "location": "California", "county": "Orange County"}
+    uncached = client.post('/api/search/reverse', json=data).get_json()
+    hits = cache.hits
+    # 大小写、首尾空格不同的相同查询命中同一条缓存
+    cached = client.post('/api/search/reverse', json={**data, "location": " california "}).get_json()
+    assert cached == uncached and cache.hits == hits + 1
+
+    forward = {"position": "Manager", "location": "California"}
+    first = client.post('/api/search/forward', json=forward).get_json()
+    assert client.post('/api/search/forward', json=forward).get_json() == first
+
+    # 分页 / limit 只读取一部分结果，缓存的仍是完整结果：相同的分页请求和其他页都命中
+    paged = {**data, "location": "California", "county": "", "limit": 20}
+    page = client.post('/api/search/reverse', json=paged).get_json()
+    hits = cache.hits
+    assert client.post('/api/search/reverse', json=paged).get_json() == page and cache.hits == hits + 1
+    second = client.post('/api/search/reverse', json={**paged, "cursor": page['next_cursor']}).get_json()
+    assert cache.hits == hits + 2 and second['results'] != page['results']
+
+    # NDJSON 流式输出：未命中时边生成边记录，第一行不必等完整结果；完整读完后写入缓存
+    from result_cache import ResultCache
+    produced = []
+
+    def compute():
+        for i in range(1000):
+            produced.append(i)
+            yield {'row': i}
+    lazy = ResultCache().results('streamed', compute, stream=True)
+    assert next(lazy) == {'row': 0} and len(produced) == 1
+    streamed = {**data, "location": "Texas", "county": "Harris", "stream": True}
+    body = client.post('/api/search/reverse', json=streamed).get_data(as_text=True)
+    hits = cache.hits
+    assert client.post('/api/search/reverse', json=streamed).get_data(as_text=True) == body and cache.hits == hits + 1
+
+    stats = client.get('/api/cache/stats').get_json()['result_cache']
+    assert stats['memory']['entries'] == 4
+
+    wage_app.datasets.reload()  # 切换数据集时清空进程内缓存
+    assert cache.memory.stats()['entries'] == 0
+
+    # 磁盘缓存：切换后只保留当前版本的条目；没有版本列的旧缓存文件重新建表
+    from result_cache import DiskCache, MemoryCache, ResultCache, make_key
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.db')
+        old = sqlite3.connect(path)
+        old.execute('CREATE TABLE result_cache (key_hash TEXT PRIMARY KEY, created REAL, accessed REAL, value TEXT)')
+        old.close()
+        disk = DiskCache(path)
+        shared = ResultCache(MemoryCache(), disk)
+        for version in ('v1', 'v2'):
+            list(shared.results(make_key('reverse', [version], version), lambda: iter([{'version': version}])))
+        shared.retain('v2')
+        assert disk.stats()['entries'] == 1 and shared.memory.stats()['entries'] == 0
+        assert disk.get(make_key('reverse', ['v2'], 'v2')) == [{'version': 'v2'}]
+        disk.close()
+    print(f"✅ 缓存命中结果一致，统计: hits={stats['hits']} misses={stats['misses']}")
+
+
+def test_compact_responses():
+    """测试紧凑响应与压缩：compact 解码后与默认结果一致，按 Accept-Encoding 压缩，小响应不压缩（进程内）"""
+    print("\n=== 测试紧凑响应与压缩 ===")
+    wage_app, client = local_client()
+    import gzip
+    from responses import brotli, expand_compact
+    cases = [
+        ('/api/search/forward', {"position": "Manager", "location": "California"}),
+        ('/api/search/reverse', {"min_salary": 60000, "max_salary": 100000, "location": "California", "levels": [1, 2, 3, 4]}),
+        ('/api/search/location', {"position": "Nurse", "target_level": 2, "target_salary": 80000, "limit": 50}),
+    ]
+    for url, data in cases:
+        expected = client.post(url, json=data).get_json()
+        compact = client.post(url, json={**data, "format": "compact"}).get_json()
+        assert compact['format'] == 'compact' and compact['count'] == len(expected['results'])
+        assert expand_compact(compact) == expected['results']
+        assert compact.get('next_cursor') == expected.get('next_cursor')
+        # 重复的字符串只在取值表中出现一次
+        assert len(compact['dictionaries']['location']) < compact['count']
+    assert client.post(cases[0][0], json={**cases[0][1], "format": "xml"}).status_code == 400
+
+    url, data = cases[1]
+    plain = client.post(url, json=data)
+    assert plain.headers.get('Content-Encoding') is None and 'Accept-Encoding' in plain.headers['Vary']
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    for encoding in encodings:
+        response = client.post(url, json=data, headers={'Accept-Encoding': f'{encoding}, identity'})
+        assert response.headers['Content-Encoding'] == encoding
+        body = gzip.decompress(response.data) if encoding == 'gzip' else brotli.decompress(response.data)
+        assert json.loads(body) == plain.get_json() and len(response.data) < len(plain.data) / 4
+    # 拒绝所有编码、响应太小时都不压缩
+    assert client.post(url, json=data, headers={'Accept-Encoding': 'gzip;q=0'}).headers.get('Content-Encoding') is None
+    small = client.post(url, json={**data, "location": "Nowhere"}, headers={'Accept-Encoding': 'gzip'})
+    assert small.status_code == 404 and small.headers.get('Content-Encoding') is None
+    print(f"✅ 3 种查询的紧凑响应解码后一致，{'/'.join(encodings)} 压缩 {len(plain.data)} → {len(response.data)} 字节，"
+          f"序列化: {type(wage_app.app.json).__name__}")
+
+
+def test_http_caching():
+    """测试 HTTP 缓存：GET 搜索与 POST 结果一致，ETag / Last-Modified 条件请求返回 304，数据集版本变化后 ETag 随之变化（进程内）"""
+    print("\n=== 测试 HTTP 缓存 ===")
+    wage_app, client = local_client()
+    # GET 形式的搜索与 POST 结果一致，POST 不加缓存头
+    cases = [
+        ('/api/search/forward', {"position": "Manager", "location": "California", "county": "Orange County"}),
+        ('/api/search/reverse', {"min_salary": "60000", "max_salary": "100000", "location": "California", "levels": "1,3,4"}),
+        ('/api/search/location', {"position": "Nurse", "target_level": "3", "target_salary": "90000", "state": "CA, texas",
+                                  "top_k": "2", "limit": "5", "cursor": "5"}),
+    ]
+    for url, params in cases:
+        body = {**params, **({"levels": [1, 3, 4]} if 'levels' in params else {})}
+        posted = client.post(url, json=body)
+        fetched = client.get(url, query_string=params)
+        assert fetched.status_code == 200 and fetched.get_json() == posted.get_json(), url
+        assert posted.headers.get('ETag') is None and fetched.headers['ETag'].startswith('W/')
+        assert 'max-age' in fetched.headers['Cache-Control'] and 'public' in fetched.headers['Cache-Control']
+    streamed = client.get(cases[2][0], query_string={**cases[2][1], "stream": "1"})
+    assert streamed.mimetype == 'application/x-ndjson' and streamed.headers['ETag'] != fetched.headers['ETag']
+    assert [json.loads(line) for line in streamed.data.splitlines()][:-1] == fetched.get_json()['results']
+    ndjson = client.get(cases[2][0], query_string=cases[2][1], headers={'Accept': 'application/x-ndjson'})
+    assert ndjson.mimetype == 'application/x-ndjson' and ndjson.headers['ETag'] != fetched.headers['ETag']
+    assert ndjson.data == streamed.data
+    assert 'Accept' in ndjson.headers['Vary']
+
+    # 列表和自动完成接口：条件请求在执行查询之前返回 304
+    for url in ('/api/occupations', '/api/locations', '/api/search/occupations?q=nurse',
+                '/api/search/states?q=ca', '/api/search/counties?q=orange&state=California'):
+        first = client.get(url)
+        etag, modified = first.headers['ETag'], first.headers['Last-Modified']
+        assert first.status_code == 200 and etag.startswith('W/')
+        revalidated = client.get(url, headers={'If-None-Match': etag})
+        assert revalidated.status_code == 304 and revalidated.data == b'' and revalidated.headers['ETag'] == etag
+        assert client.get(url, headers={'If-Modified-Since': modified}).status_code == 304
+        assert client.get(url, headers={'If-None-Match': 'W/"stale"'}).status_code == 200
+    assert client.get('/api/search/occupations?q=manager').headers['ETag'] != \
+        client.get('/api/search/occupations?q=nurse').headers['ETag']
+    # 出错的响应不缓存
+    missing = client.get('/api/search/reverse', query_string={**cases[1][1], "location": "Nowhere"})
+    assert missing.status_code == 404 and missing.headers.get('ETag') is None
+    # 查询字符串中的数值参数不合法时返回 400
+    for url, params in ((cases[1][0], {**cases[1][1], "min_salary": "abc"}),
+                        (cases[2][0], {**cases[2][1], "target_level": "two"}),
+                        (cases[2][0], {**cases[2][1], "target_salary": "lots"})):
+        invalid = client.get(url, query_string=params)
+        assert invalid.status_code == 400 and 'error' in invalid.get_json(), params
+    # 数据库不存在时不计算 ETag，由视图照常处理
+    datasets = wage_app.datasets
+    wage_app.datasets = wage_app.DatasetManager(os.path.join(tempfile.gettempdir(), 'missing-wage-data.db'))
+    try:
+        assert client.get('/api/search/occupations?q=').get_json() == {'occupations': []}
+        empty = client.get('/api/search/forward', query_string={"position": "", "location": "Texas"})
+        assert empty.status_code == 400 and 'error' in empty.get_json() and empty.headers.get('ETag') is None
+    finally:
+        wage_app.datasets = datasets
+
+    # 数据集版本变化后旧 ETag 不再命中
+    wage_app.datasets.current.objects['version'] = 'test-version'
+    try:
+        assert client.get('/api/occupations', headers={'If-None-Match': etag}).status_code == 200
+    finally:
+        wage_app.datasets.reload()
+    print("✅ GET 搜索与 POST 一致，条件请求返回 304，数据集版本变化后 ETag 失效")
+
+
+def test_build_database():
+    """测试数据库构建：导入行数、空字段转 NULL、构建信息与校验和，失败时不留下临时文件（进程内）"""
+    print("\n=== 测试数据库构建 ===")
+    fixture_dataset()
+    with tempfile.TemporaryDirectory() as tmp:
+        # 取 ALC_Export.csv 的前 1000 行，其余数据文件原样复制
+        with open('ALC_Export.csv', encoding='utf-8-sig') as src, open(os.path.join(tmp, 'ALC_Export.csv'), 'w') as dst:
+            dst.writelines(itertools.islice(src, 1001))
+        for name in ('Geography.csv', 'oes_soc_occs.csv', 'xwalk_plus.csv'):
+            shutil.copy(name, tmp)
+        db_path = os.path.join(tmp, 'wage_data.db')
+        stats = build_db.build_database(db_path, source_dir=tmp)
+        assert stats['rows']['wage_data'] == 1000
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM wage_data WHERE label = ''").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM occupations_fts").fetchone()[0] == stats['rows']['occupations']
+        conn.close()
+
+        # 构建信息与校验和
+        info = build_db.read_build_info(db_path)
+        assert build_db.is_current(info) and info['data_version'] == build_db.source_version(tmp)
+        assert info['rows_wage_data'] == '1000'
+        assert build_db.verify_database(db_path) == []
+        from wage_engine import ColumnarWageEngine
+        engine = ColumnarWageEngine.open(build_db.columns_path(db_path))  # 同时写出的列式文件
+        assert len(engine) == 1000 and engine.dataset_version == build_db.dataset_version(info)
+        assert build_db.main(['build-db', '--source', tmp, '--output', db_path]) == 0  # 源数据未变化，不重建
+        assert build_db.read_build_info(db_path)['built_at'] == info['built_at']
+        assert build_db.matches_source(info, tmp)
+
+        # 导入中途出错（列数不对）：抛出异常，原数据库保持不变，也没有残留的临时文件
+        with open(os.path.join(tmp, 'oes_soc_occs.csv'), 'a') as f:
+            f.write('"99-9999","Broken","row","extra column"\n')
+        assert not build_db.matches_source(info, tmp)  # 数据文件变化后启动时会重新导入
+        try:
+            build_db.build_database(db_path, source_dir=tmp)
+            assert False, "数据有误时应当失败"
+        except sqlite3.Error:
+            pass
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM wage_data").fetchone()[0] == 1000
+        conn.close()
+        assert not [name for name in os.listdir(tmp) if '.tmp' in name]
+        assert build_db.verify_database(db_path) == []
+
+        # 数据库文件被改动后校验失败
+        with open(db_path, 'ab') as f:
+            f.write(b'\0')
+        assert build_db.verify_database(db_path)
+    print(f"✅ 构建 {stats['rows']} 用时 {stats['seconds']}s，{stats['rows_per_sec']} 行/秒")
+
+
+def test_synthetic_alc():
+    """测试合成 ALC 数据：同一种子生成相同的文件，格式与各级工资合理，可以直接构建数据库（进程内）"""
+    print("\n=== 测试合成 ALC 数据 ===")
+    import csv
+    with tempfile.TemporaryDirectory() as tmp:
+        first, second = os.path.join(tmp, 'a.csv'), os.path.join(tmp, 'ALC_Export.csv')
+        count = generate_alc.write_alc(first, seed=11, fraction=0.02)
+        assert generate_alc.write_alc(second, seed=11, fraction=0.02) == count
+        with open(first, 'rb') as a, open(second, 'rb') as b:
+            assert a.read() == b.read()
+        with open(second, newline='') as f:
+            reader = csv.reader(f)
+            assert tuple(next(reader)) == generate_alc.HEADER
+            rows = list(reader)
+        areas = {area for area, _, _ in generate_alc.read_areas('Geography.csv')}
+        assert len(rows) == count and {row[0] for row in rows} <= areas
+        for row in rows:
+            levels = [float(value) for value in row[3:6]]
+            assert generate_alc.MIN_HOURLY <= levels[0] < levels[1] < levels[2] and row[2] in '1234'
+            if row[6]:
+                # Level 2 / 3 在 Level 1 和 Level 4 之间等距
+                assert abs((levels[1] - levels[0]) - (float(row[6]) - levels[2])) < 0.02
+        assert any(not row[6] for row in rows)  # 少量 Level 4 为空
+
+        for name in ('Geography.csv', 'oes_soc_occs.csv'):
+            shutil.copy(name, tmp)
+        os.remove(first)
+        stats = build_db.build_database(os.path.join(tmp, 'wage_data.db'), source_dir=tmp)
+        assert stats['rows']['wage_data'] == count
+    print(f"✅ 生成 {count} 行（2% 的 地区 × 职业），两次生成逐字节相同，构建 {stats['seconds']}s")
+
+
+def test_dataset_hot_swap():
+    """测试后台重建 + 热切换：重建期间并发查询全部成功，旧版本的连接在请求结束后关闭，其他 worker 跟随切换（进程内）"""
+    print("\n=== 测试数据集热切换 ===")
+    wage_app, _ = local_client()
+    from dataset import DatasetManager
+
+    def write_source(tmp, rows):
+        with open('ALC_Export.csv', encoding='utf-8-sig') as src, open(os.path.join(tmp, 'ALC_Export.csv'), 'w') as dst:
+            dst.writelines(itertools.islice(src, rows + 1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_source(tmp, 5000)
+        for name in ('Geography.csv', 'oes_soc_occs.csv', 'xwalk_plus.csv'):
+            shutil.copy(name, tmp)
+        db_path = os.path.join(tmp, 'wage_data.db')
+        path, _ = build_db.build_version(db_path, tmp)
+        build_db.publish_version(db_path, path)
+        conn = sqlite3.connect(db_path)
+        state, title = conn.execute('''
+            SELECT g.state, o.title FROM wage_data w
+            JOIN geography g ON g.area = w.area JOIN occupations o ON o.soc_code = w.soc_code LIMIT 1
+        ''').fetchone()
+        conn.close()
+        cases = [
+            ('/api/search/forward', {"position": title.split()[0], "location": state}),
+            ('/api/search/reverse', {"min_salary": 30000, "max_salary": 200000, "location": state}),
+            ('/api/search/occupations', {"q": title[:3]}),
+        ]
+
+        manager = DatasetManager(db_path, warm=wage_app.warm_dataset, check_interval=0)
+        follower = DatasetManager(db_path, check_interval=0)  # 另一个 worker
+        first, follower_first = manager.current, follower.current
+        original, result_cache = wage_app.datasets, wage_app.app.config['RESULT_CACHE']
+        wage_app.datasets = manager
+        wage_app.app.config['RESULT_CACHE'] = False  # 每个请求都读数据库
+        errors, versions, states, done = [], set(), set(), threading.Event()
+
+        def hammer():
+            client = wage_app.app.test_client()
+            while not done.is_set():
+                for url, params in cases:
+                    response = client.get(url, query_string=params)
+                    if response.status_code != 200:
+                        errors.append((url, response.status_code, response.get_data(as_text=True)[:200]))
+                versions.add(client.get('/api/cache/stats').get_json()['dataset_version'])
+
+        try:
+            old_version = wage_app.dataset_version(first)
+            workers = [threading.Thread(target=hammer) for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            time.sleep(0.2)
+            write_source(tmp, 4999)  # 源数据变化后重建
+            job = manager.start_rebuild(tmp)
+            assert manager.start_rebuild(tmp) is None  # 同一时间只有一个重建
+            while job.is_alive():
+                states.add(manager.status()['state'])
+                time.sleep(0.02)
+            time.sleep(0.3)
+            done.set()
+            for worker in workers:
+                worker.join()
+
+            client = wage_app.app.test_client()
+            status = client.get('/api/init-db').get_json()
+            lock = build_db.try_build_lock(db_path)  # 模拟另一个进程正在重建
+            assert client.post('/api/init-db').status_code == 409
+            lock.close()
+        finally:
+            done.set()
+            wage_app.datasets = original
+            wage_app.app.config['RESULT_CACHE'] = result_cache
+
+        assert status['state'] == 'done' and status['counts']['wage_data'] == 4999, status
+        assert not errors, errors[:3]
+        assert 'building' in states and versions == {old_version, status['version']}, (states, versions)
+        # 旧版本在最后一个请求结束后关闭了全部连接
+        assert first.retired and first.refs == 0 and first.pool.open_connections() == 0
+        assert os.path.islink(db_path) and manager.current.path == os.path.realpath(db_path) == status['path']
+
+        # 另一个 worker 在下一个请求时发现文件被替换，后台切换
+        for _ in range(200):
+            follower.release(follower.acquire())
+            if follower.current is not follower_first:
+                break
+            time.sleep(0.05)
+        assert follower.current.path == manager.current.path and follower_first.retired
+
+        # 构建失败：保留当前版本，不留下半成品
+        current = manager.current
+        with open(os.path.join(tmp, 'oes_soc_occs.csv'), 'a') as f:
+            f.write('"99-9999","Broken","row","extra column"\n')
+        manager.start_rebuild(tmp).join()
+        assert manager.status()['state'] == 'failed' and manager.current is current
+        shutil.copy('oes_soc_occs.csv', tmp)
+
+        # versions/ 下只保留当前和上一个版本
+        write_source(tmp, 4998)
+        manager.start_rebuild(tmp).join()
+        assert manager.status()['counts']['wage_data'] == 4998
+        kept = sorted(name for name in os.listdir(build_db.versions_dir(db_path)) if name.endswith('.db'))
+        assert len(kept) == 2 and os.path.basename(manager.current.path) == kept[-1], kept
+    print(f"✅ 重建期间 4 个线程持续查询无错误，{status['seconds']}s 内完成构建、校验、预热并切换，旧连接已关闭")
+
+
+# 各查询接口访问 wage_data 时应当使用的索引
+QUERY_PLAN_CASES = [
+    ('/api/search/forward', {"position": "Manager", "location": "California"}, 'USING INDEX idx_wage_soc_area'),
+    ('/api/search/forward/batch', [{"position": "Nurse", "location": "Texas"}], 'USING INDEX idx_wage_soc_area'),
+    ('/api/search/reverse', {"min_salary": 60000, "max_salary": 100000, "location": "California"},
+     'SEARCH wage_levels USING PRIMARY KEY'),
+    ('/api/search/reverse', {"min_salary": 60000, "max_salary": 100000, "location": "California", "levels": [1, 3, 4]},
+     'SEARCH wage_levels USING PRIMARY KEY'),
+    ('/api/search/location', {"position": "Software", "target_level": 2, "target_salary": 90000},
+     'SEARCH l USING PRIMARY KEY'),
+    ('/api/search/location', {"position": "Software", "target_level": 4, "target_salary": 150000, "state": "Wyoming"},
+     'SEARCH l USING PRIMARY KEY'),
+]
+
+
+def test_query_plans():
+    """测试各查询接口的 SQL 使用为其设计的索引，不全表扫描 wage_data（EXPLAIN QUERY PLAN，进程内）"""
+    print("\n=== 测试查询计划 ===")
+    wage_app, client = local_client()
+    if not wage_app.datasets.pooled:
+        pytest.skip("未启用连接池（DB_POOL=0）")
+    original = wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE']
+    wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = 'sqlite', False
+    # test client 在当前线程处理请求，与这里取得的是同一个长连接
+    with wage_app.app.app_context():
+        conn = wage_app.get_db()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        for url, data, expected in QUERY_PLAN_CASES:
+            statements.clear()
+            assert client.post(url, json=data).status_code == 200
+            queries = [sql for sql in statements if 'wage_data' in sql]
+            assert queries, f"{url} 没有查询 wage_data"
+            for sql in queries:
+                plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+                ok = any(expected in step for step in plan) and \
+                    not any(step.split()[:2] in (['SCAN', 'w'], ['SCAN', 'wage_data']) for step in plan)
+                if not ok:
+                    print(f"❌ {url} 查询计划不符合预期: {plan}")
+                assert ok
+        print(f"✅ {len(QUERY_PLAN_CASES)} 个查询均使用预期的索引")
+    finally:
+        conn.set_trace_callback(None)
+        wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = original
+
+
+def test_metrics():
+    """测试指标：/metrics 的 Prometheus 输出、Server-Timing 响应头、语句形状归类、多进程快照汇总（进程内）"""
+    print("\n=== 测试指标 ===")
+    import metrics
+    shape = metrics.statement_shape("SELECT * FROM wage_data\n  WHERE soc_code IN (?, ?, ?) AND label = 'x' LIMIT 10")
+    assert shape == "SELECT * FROM wage_data WHERE soc_code IN (...) AND label = ? LIMIT ?"
+    # 批量查询的 VALUES 元组列表：不同组数归为同一形状，过长的语句截断
+    batch = "WITH wanted(soc_code, area) AS (VALUES %s) SELECT * FROM wanted"
+    shapes = {metrics.statement_shape(batch % ','.join(['(?, ?)'] * n)) for n in (1, 2, 3, 500, 5000)}
+    assert shapes == {"WITH wanted(soc_code, area) AS (VALUES (...)) SELECT * FROM wanted"}, shapes
+    assert metrics.statement_shape("SELECT x IN (?)") == metrics.statement_shape("SELECT x IN (?, ?)")
+    assert len(metrics.statement_shape("SELECT " + "a, " * 2000 + "b")) == metrics.MAX_SHAPE_LENGTH
+    # 两个进程的快照相加：计数器求和，直方图逐桶求和（另一个 worker 的快照直接写成文件）
+    with tempfile.TemporaryDirectory() as tmp:
+        for value in (0.003, 0.2):
+            registry = metrics.Registry(tmp)
+            registry.counter('demo_total', 'demo', ('kind',)).inc(('a',))
+            registry.histogram('demo_seconds', 'demo').observe((), value)
+            if value < 0.1:
+                with open(os.path.join(tmp, 'metrics-1.json'), 'w') as f:
+                    json.dump(registry.snapshot(), f)
+        merged = registry.collect()
+        assert merged['demo_total'] == {metrics.label_key(('a',)): 2}
+        text = registry.render(merged)
+        assert 'demo_total{kind="a"} 2' in text and 'demo_seconds_count 2' in text
+        assert 'demo_seconds_bucket{le="0.005"} 1' in text and 'demo_seconds_bucket{le="+Inf"} 2' in text
+
+    wage_app, client = local_client()
+    if not wage_app.app.config['METRICS']:
+        pytest.skip("未启用指标（METRICS=0）")
+    original = wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE']
+    wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = 'sqlite', True
+    try:
+        data = {"position": "Manager", "location": "California"}
+        wage_app.result_cache.clear()
+        response = client.post('/api/search/forward', json=data)
+        timing = response.headers['Server-Timing']
+        assert timing.startswith('app;dur=') and 'sql;dur=' in timing and ' queries, ' in timing
+        assert client.post('/api/search/forward', json=data).status_code == 200  # 命中结果缓存
+        client.get('/no-such-page')
+        for size in (1, 2, 3):  # 不同组数的批量查询
+            batch = [{"position": "Manager", "location": state} for state in ("Texas", "Ohio", "Utah")[:size]]
+            assert client.post('/api/search/forward/batch', json=batch).status_code == 200
+
+        response = client.get('/metrics')
+        assert response.status_code == 200 and response.mimetype == 'text/plain'
+        text = response.get_data(as_text=True)
+        for line in ('oflc_http_requests_total{endpoint="forward_search",method="POST",status="200"}',
+                     'oflc_http_requests_total{endpoint="unmatched",method="GET",status="404"}',
+                     'oflc_http_request_duration_seconds_bucket{endpoint="forward_search",le="+Inf"}',
+                     'oflc_http_request_sql_queries_count{endpoint="forward_search"}',
+                     'oflc_cache_lookups_total{cache="result",result="memory_hit"}',
+                     'oflc_cache_hit_ratio{cache="result"}'):
+            assert line in text, line
+        statements = [line for line in text.splitlines()
+                      if line.startswith('oflc_sql_statement_duration_seconds_count') and 'FROM wage_data' in line]
+        assert statements and not any('?, ?' in line for line in statements)  # 参数列表已合并为 (...)
+        batches = [line for line in text.splitlines()
+                   if line.startswith('oflc_sql_statement_duration_seconds_count{statement="WITH wanted')]
+        assert len(batches) == 1 and 'VALUES (...))' in batches[0], batches  # 批量查询只有一种形状
+        assert 'oflc_sql_rows_returned_total{' in text and 'oflc_sql_vm_steps_total{' in text
+        print(f"✅ /metrics 输出 {len(text.splitlines())} 行，wage_data 语句 {len(statements)} 种，Server-Timing: {timing}")
+    finally:
+        wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = original
+
+
+def test_slow_query_log():
+    """测试慢查询日志：按语句形状汇总，记录接口、参数和查询计划，阈值关闭时不记录（进程内）"""
+    print("\n=== 测试慢查询日志 ===")
+    import metrics
+    from slow_queries import query_plan, threshold_from_env
+    assert threshold_from_env(None) == 0.1 and threshold_from_env('250') == 0.25 and threshold_from_env('0') is None
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (a INTEGER, b TEXT)')
+    conn.execute('CREATE INDEX t_a ON t (a)')
+    plan = query_plan(conn, 'SELECT * FROM t WHERE a = ? UNION SELECT * FROM t WHERE b = ?', (1, 'x'))
+    assert any(line.startswith('  ') and 'USING INDEX t_a' in line for line in plan)
+    assert any('SCAN t' in line for line in plan)
+    conn.close()
+
+    wage_app, client = local_client()
+    if not wage_app.app.config['METRICS']:
+        pytest.skip("未启用指标（METRICS=0）")
+    log = metrics.slow_log
+    original = log.threshold, wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE']
+    wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = 'sqlite', False
+    try:
+        log.threshold = 0.0  # 记录全部语句
+        client.delete('/api/slow-queries')
+        data = {"position": "Manager", "location": "California"}
+        for _ in range(2):
+            assert client.post('/api/search/forward', json=data).status_code == 200
+        report = client.get('/api/slow-queries').get_json()
+        assert report['enabled'] and report['threshold_ms'] == 0
+        statements = [s for s in report['statements'] if 'FROM wage_data' in s['statement']]
+        assert statements, report['statements']
+        entry = statements[0]
+        assert entry['count'] == 2 and entry['endpoints'] == {'forward_search': 2}
+        assert entry['slowest']['rows'] == entry['rows'] // 2
+        assert 'Manager' not in json.dumps(report) and 'parameters' not in entry['slowest']  # 不含搜索输入
+        assert entry['plan'] and all(isinstance(line, str) for line in entry['plan'])
+        totals = [s['total_ms'] for s in report['statements']]
+        assert totals == sorted(totals, reverse=True)
+        assert 'oflc_sql_slow_statements_total{endpoint="forward_search"' in client.get('/metrics').get_data(as_text=True)
+
+        # 流式响应在请求 teardown 之后才执行查询，仍计入该接口
+        client.delete('/api/slow-queries')
+        stream = {"min_salary": 60000, "max_salary": 100000, "location": "California", "stream": True, "limit": 50}
+        response = client.post('/api/search/reverse', json=stream)
+        response.get_data()
+        response.close()
+        endpoints = {name for s in client.get('/api/slow-queries').get_json()['statements'] for name in s['endpoints']}
+        assert 'reverse_search' in endpoints and 'background' not in endpoints, endpoints
+
+        # 经代理转发的请求不算本机访问；设置 ADMIN_TOKEN 后必须带令牌
+        assert client.get('/api/slow-queries', headers={'X-Forwarded-For': '203.0.113.5'}).status_code == 403
+        assert client.get('/api/slow-queries', environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 403
+        wage_app.app.config['ADMIN_TOKEN'] = 'secret'
+        try:
+            assert client.delete('/api/slow-queries').status_code == 403
+            assert client.get('/api/slow-queries', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+            assert client.get('/api/slow-queries', headers={'Authorization': 'Bearer secret'}).status_code == 200
+        finally:
+            wage_app.app.config['ADMIN_TOKEN'] = None
+
+        assert client.delete('/api/slow-queries').get_json()['statements'] == []
+        log.threshold = None
+        client.post('/api/search/forward', json=data)
+        assert client.get('/api/slow-queries').get_json()['statements'] == []
+        print(f"✅ {len(report['statements'])} 种语句形状，wage_data 查询计划: {entry['plan']}")
+    finally:
+        log.threshold, wage_app.app.config['WAGE_ENGINE'], wage_app.app.config['RESULT_CACHE'] = original
+
+
+def test_health_probes():
+    """测试存活 / 就绪探针：就绪状态来自构建信息并缓存在数据集上，探针不执行 SQL；旧数据库退回一次 COUNT(*)（进程内）"""
+    print("\n=== 测试健康检查探针 ===")
+    from dataset import Dataset
+    wage_app, client = local_client()
+    assert client.get('/livez').get_json() == {'alive': True}
+    ready = client.get('/readyz')
+    state = ready.get_json()
+    info = build_db.read_build_info(wage_app.DB_PATH)
+    assert ready.status_code == 200 and state['ready'] and client.get('/health').get_json() == state
+    assert state['counts'] == {table: int(info[f'rows_{table}']) for table in wage_app.READY_TABLES}
+    assert state['dataset_version'] == build_db.dataset_version(info) and state['data_version'] == info['data_version']
+    with open(f"{os.path.realpath(wage_app.DB_PATH)}.sha256") as f:
+        assert state['checksum'] == f.read().split()[0]
+    if wage_app.app.config['METRICS']:
+        for url in ('/livez', '/readyz', '/health'):
+            assert 'desc="0 queries' in client.get(url).headers['Server-Timing'], url
+
+    # 没有构建信息的旧数据库：检查表和行数（只在加载数据集时执行）
+    def readiness(path):
+        dataset = Dataset(path)
+        try:
+            return wage_app.dataset_readiness(dataset)
+        finally:
+            dataset.retire()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE wage_data (id INTEGER)')
+        conn.execute('CREATE TABLE geography (id INTEGER)')
+        conn.commit()
+        assert readiness(path)['reason'] == 'tables_missing'
+        conn.execute('CREATE TABLE occupations (id INTEGER)')
+        conn.executemany('INSERT INTO wage_data VALUES (?)', [(1,), (2,)])
+        conn.execute('INSERT INTO geography VALUES (1)')
+        conn.commit()
+        empty = readiness(path)
+        assert not empty['ready'] and empty['reason'] == 'tables_empty' and empty['counts']['wage_data'] == 2
+        conn.execute('INSERT INTO occupations VALUES (1)')
+        conn.commit()
+        conn.close()
+        legacy = readiness(path)
+        assert legacy['ready'] and legacy['checksum'] is None and legacy['counts']['occupations'] == 1
+    print(f"✅ /livez、/readyz 不执行 SQL，就绪状态: {state['counts']}，数据版本 {state['dataset_version']}")
+
+
 if __name__ == "__main__":
     print("开始测试OFLC薪资查询系统...")
     print(f"测试地址: {BASE_URL}")
@@ -147,5 +1190,25 @@ if __name__ == "__main__":
     test_forward_search()
     test_reverse_search()
     test_location_search()
+    test_wage_engine_parity()
+    test_wage_engine_shared_memory()
+    test_columns_file()
+    test_autocomplete_index_parity()
+    test_location_resolver_parity()
+    test_forward_batch()
+    test_streaming_pagination()
+    test_location_leaderboard()
+    test_asgi_entry()
+    test_production_launcher()
+    test_result_cache()
+    test_compact_responses()
+    test_http_caching()
+    test_build_database()
+    test_synthetic_alc()
+    test_dataset_hot_swap()
+    test_query_plans()
+    test_metrics()
+    test_slow_query_log()
+    test_health_probes()
     
     print("\n测试完成！")
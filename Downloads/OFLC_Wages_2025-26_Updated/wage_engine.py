@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+内存列式薪资引擎
+wage_data 在 init_database 之后只读，这里一次性把它读成 NumPy 列数组（地区/职业代码整数编码 + 排序索引），
+正向、根据薪资、地区三种查询用向量化掩码和 searchsorted 代替逐行 SQLite 查询。
+返回值的结构与对应 SQL 查询的结果行一致，路由代码可以直接替换使用。
+
+按行的数据（地区/职业/标签编码、各 Level 时薪、排序索引）全部是定长数组，集中放在一块匿名共享内存中：
+gunicorn preload 时在主进程加载一次，fork 出的 worker 直接读同一批物理页面。数组只读且不含 Python 对象，
+worker 访问时不会因写时复制或引用计数改写而各自复制页面。
+时薪全部是整分时按 int32 分存储（与 float32 同样大小，但精确还原为与 SQLite 相同的 float64 值）。
+
+同样的布局可以保存为列式文件（build_db 构建时写出 <db>.columns）：JSON 文件头 + 按 64 字节对齐的数组，
+open() 直接 mmap 文件，不读取、不解析数据，毫秒级打开；页面由操作系统页缓存在所有进程间共享。
+"""
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# 共享内存块 / 列式文件中各数组起始位置的对齐字节数
+ALIGNMENT = 64
+# 列式文件：魔数 + 文件头长度（uint64 小端）+ JSON 文件头，之后是对齐的数组
+FILE_MAGIC = b'OFLCWCOL'
+FILE_FORMAT = 1
+_HEADER_LENGTH = struct.Struct('<Q')
+# 时薪按分存储时的比例，以及缺失值的标记
+WAGE_SCALE = 100
+MISSING_WAGE = np.iinfo(np.int32).min
+
+
+def _code_dtype(size):
+    """容纳 size 个编码的最小整数类型"""
+    return np.int16 if size < 2 ** 15 else np.int32
+
+
+def _sorted_codes(values):
+    """去重排序的编码表（None 排在最前）"""
+    return sorted(set(values), key=lambda v: (v is not None, v or ''))
+
+
+def _nan_to_none(values):
+    """NaN → None"""
+    return [v if v == v else None for v in values]
+
+
+def encode_wages(columns):
+    """时薪列（float64，缺失为 NaN）→ (存储数组列表, 比例)
+
+    全部是整分且在 int32 范围内时存为 int32 分（缺失为 MISSING_WAGE，比例 WAGE_SCALE），
+    否则原样保留 float64（比例 1）。
+    """
+    encoded = []
+    for values in columns:
+        present = ~np.isnan(values)
+        cents = np.round(values[present] * WAGE_SCALE)
+        if not np.array_equal(cents / WAGE_SCALE, values[present]) or \
+                (len(cents) and np.abs(cents).max() >= -MISSING_WAGE):
+            return list(columns), 1
+        stored = np.full(values.shape, MISSING_WAGE, dtype=np.int32)
+        stored[present] = cents
+        encoded.append(stored)
+    return encoded, WAGE_SCALE
+
+
+def _layout(sizes, start=0):
+    """{名称: 字节数} → 各数组在内存块中的起始位置（按 ALIGNMENT 对齐）和总长度"""
+    offsets, total = {}, start
+    for name, size in sizes.items():
+        total = -(-total // ALIGNMENT) * ALIGNMENT
+        offsets[name] = total
+        total += size
+    return offsets, total
+
+
+def _view(buffer, dtype, shape, offset):
+    """内存块中从 offset 开始的数组视图"""
+    count = int(np.prod(shape))
+    if not count:
+        return np.empty(shape, dtype=dtype)
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def share_arrays(arrays):
+    """把 {名称: 数组} 复制进一块匿名共享内存（MAP_SHARED），返回 (内存块, {名称: 只读视图})
+
+    fork 之后父子进程映射的是同一批页面，不经过写时复制。
+    """
+    offsets, total = _layout({name: array.nbytes for name, array in arrays.items()})
+    buffer = mmap.mmap(-1, max(total, 1))
+    views = {}
+    for name, array in arrays.items():
+        view = _view(buffer, array.dtype, array.shape, offsets[name])
+        view[...] = array
+        view.flags.writeable = False
+        views[name] = view
+    return buffer, views
+
+
+class ColumnarWageEngine:
+    """wage_data 的只读列式副本"""
+
+    def __init__(self, arrays, meta, buffer=None):
+        # arrays: 按行数据的只读数组（见 build），meta: 代码表、标签取值表、(州, 县) 分组、职业标题、时薪比例，
+        # buffer: 数组所在的内存块（匿名共享内存或 mmap 的列式文件），随引擎一起保持映射
+        self._buffer = buffer
+        self.arrays = arrays
+        self.dataset_version = meta.get('dataset_version')
+        self.area_codes = list(meta['area_codes'])
+        self.soc_codes = list(meta['soc_codes'])
+        self.label_values = list(meta['label_values'])
+        self.geo_groups = [tuple(group) for group in meta['geo_groups']]
+        self.titles = meta['titles']
+        self.wage_scale = meta['wage_scale']
+        self.area_lookup = {code: i for i, code in enumerate(self.area_codes)}
+        self.soc_lookup = {code: i for i, code in enumerate(self.soc_codes)}
+
+        a = arrays
+        self.area_idx, self.soc_idx, self.label_idx = a['area_idx'], a['soc_idx'], a['label_idx']
+        self.levels, self.average = a['levels'], a['average']
+        self.by_soc, self.by_soc_keys = a['by_soc'], a['by_soc_keys']
+        self.by_area_level = [(a[f'by_area_level{i}'], a[f'by_area_level{i}_keys'], a[f'by_area_level{i}_values'])
+                              for i in (1, 2, 3, 4)]
+        self.by_soc_level = [(a[f'by_soc_level{i}'], a[f'by_soc_level{i}_keys'], a[f'by_soc_level{i}_values'])
+                             for i in (1, 2, 3, 4)]
+        self.geo_count, self.geo_start, self.geo_group = a['geo_count'], a['geo_start'], a['geo_group']
+
+    @classmethod
+    def build(cls, columns, area_codes, soc_codes, label_values, geo_rows, occ_rows, dataset_version=None):
+        """由列数据建立排序索引，全部数组放进共享内存
+
+        columns: {'area_idx', 'soc_idx', 'label_idx': 各编码表中的位置, 'levels': (4, N) 时薪, 'average': 平均时薪}，
+        缺失的时薪为 NaN；area_codes / soc_codes 为按字符串排序的代码表，label_values 为标签取值表
+        """
+        area_idx, soc_idx = columns['area_idx'], columns['soc_idx']
+        (*levels, average), wage_scale = encode_wages([*columns['levels'], columns['average']])
+        levels = np.vstack(levels)
+        arrays = {'area_idx': area_idx, 'soc_idx': soc_idx, 'label_idx': columns['label_idx'],
+                  'levels': levels, 'average': average}
+
+        # (soc, area, 行号) 排序索引：正向查询按职业取连续区间
+        arrays['by_soc'] = np.lexsort((area_idx, soc_idx)).astype(np.int32)
+        arrays['by_soc_keys'] = soc_idx[arrays['by_soc']]
+
+        for level, values in enumerate(levels, 1):
+            valid = np.flatnonzero(values != MISSING_WAGE if wage_scale != 1 else ~np.isnan(values))
+            # (area, 时薪) 排序索引：根据薪资查询在每个地区内二分查找各 Level 的区间
+            order = valid[np.lexsort((values[valid], area_idx[valid]))].astype(np.int32)
+            arrays[f'by_area_level{level}'] = order
+            arrays[f'by_area_level{level}_keys'] = area_idx[order]
+            arrays[f'by_area_level{level}_values'] = values[order]
+            # (soc, 时薪, 行号) 排序索引：地区查询二分查找到 target 后直接取该职业的其余区间
+            order = valid[np.lexsort((valid, values[valid], soc_idx[valid]))].astype(np.int32)
+            arrays[f'by_soc_level{level}'] = order
+            arrays[f'by_soc_level{level}_keys'] = soc_idx[order]
+            arrays[f'by_soc_level{level}_values'] = values[order]
+
+        # 职业标题（对应 JOIN occupations）
+        titles = {}
+        for soc_code, title in occ_rows:
+            titles.setdefault(str(soc_code), []).append(title)
+
+        # 地理信息按地区编码分组（对应 JOIN geography），(州, 县) 按字符串顺序编号，与 GROUP BY 顺序一致
+        groups = sorted({(state, county) for _, state, county in geo_rows},
+                        key=lambda key: (key[0] is not None, key[0] or '', key[1] is not None, key[1] or ''))
+        group_lookup = {key: i for i, key in enumerate(groups)}
+        area_lookup = {code: i for i, code in enumerate(area_codes)}
+        geo_by_area = [[] for _ in range(len(area_codes))]
+        for area, state, county in geo_rows:
+            i = area_lookup.get(str(area))
+            if i is not None:
+                geo_by_area[i].append(group_lookup[(state, county)])
+        geo_count = np.array([len(g) for g in geo_by_area], dtype=np.int64)
+        arrays['geo_count'] = geo_count
+        arrays['geo_start'] = np.concatenate(([0], np.cumsum(geo_count)[:-1])).astype(np.int64)
+        arrays['geo_group'] = np.array([g for gs in geo_by_area for g in gs], dtype=np.int64)
+
+        meta = {'area_codes': area_codes, 'soc_codes': soc_codes, 'label_values': label_values,
+                'geo_groups': groups, 'titles': titles, 'wage_scale': wage_scale,
+                'dataset_version': dataset_version}
+        buffer, views = share_arrays(arrays)
+        return cls(views, meta, buffer)
+
+    @classmethod
+    def load(cls, conn, dataset_version=None):
+        """从 SQLite 按列流式读取（不在内存中生成逐行的元组列表）"""
+        cursor = conn.cursor()
+        count = cursor.execute('SELECT COUNT(*) FROM wage_data').fetchone()[0]
+
+        def column(name, convert, dtype):
+            rows = cursor.execute(f'SELECT {name} FROM wage_data ORDER BY id')
+            return np.fromiter((convert(v) for v, in rows), dtype=dtype, count=count)
+
+        def encode(name):
+            codes = _sorted_codes(v for v, in cursor.execute(f'SELECT DISTINCT {name} FROM wage_data'))
+            lookup = {code: i for i, code in enumerate(codes)}
+            return codes, column(name, lookup.__getitem__, _code_dtype(len(codes)))
+
+        def to_float(v):
+            return np.nan if v is None else v
+
+        area_codes, area_idx = encode('area')
+        soc_codes, soc_idx = encode('soc_code')
+        label_values, label_idx = encode('label')
+        columns = {
+            'area_idx': area_idx,
+            'soc_idx': soc_idx,
+            'label_idx': label_idx,
+            'levels': np.vstack([column(f'level{i}', to_float, np.float64) for i in (1, 2, 3, 4)]),
+            'average': column('average', to_float, np.float64),
+        }
+        cursor.execute('SELECT area, state, county_town_name FROM geography ORDER BY id')
+        geo_rows = cursor.fetchall()
+        cursor.execute('SELECT soc_code, title FROM occupations ORDER BY id')
+        occ_rows = cursor.fetchall()
+        return cls.build(columns, area_codes, soc_codes, label_values, geo_rows, occ_rows, dataset_version)
+
+    def save(self, path):
+        """把全部数组和代码表写成列式文件（先写临时文件再原子替换）"""
+        header = {
+            'format': FILE_FORMAT,
+            'dataset_version': self.dataset_version,
+            'rows': len(self),
+            'area_codes': self.area_codes,
+            'soc_codes': self.soc_codes,
+            'label_values': self.label_values,
+            'geo_groups': self.geo_groups,
+            'titles': self.titles,
+            'wage_scale': self.wage_scale,
+            'arrays': {name: [array.dtype.str, list(array.shape)] for name, array in self.arrays.items()},
+        }
+        header = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        start = len(FILE_MAGIC) + _HEADER_LENGTH.size + len(header)
+        offsets, total = _layout({name: array.nbytes for name, array in self.arrays.items()}, start)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(FILE_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+                for name, array in self.arrays.items():
+                    f.write(b'\0' * (offsets[name] - f.tell()))
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.write(b'\0' * (total - f.tell()))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return total
+
+    @classmethod
+    def open(cls, path):
+        """mmap 列式文件，数组直接是文件页面上的只读视图；文件不是当前格式时抛出 ValueError"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            prefix = len(FILE_MAGIC) + _HEADER_LENGTH.size
+            if len(buffer) < prefix or buffer[:len(FILE_MAGIC)] != FILE_MAGIC:
+                raise ValueError(f'{path} is not a columnar wage file')
+            length, = _HEADER_LENGTH.unpack(buffer[len(FILE_MAGIC):prefix])
+            header = json.loads(buffer[prefix:prefix + length].decode('utf-8'))
+            if header.get('format') != FILE_FORMAT:
+                raise ValueError(f"unsupported columnar file format: {header.get('format')}")
+            specs = {name: (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in header['arrays'].items()}
+            offsets, total = _layout({name: dtype.itemsize * int(np.prod(shape))
+                                      for name, (dtype, shape) in specs.items()}, prefix + length)
+            if total > len(buffer):
+                raise ValueError(f'{path} is truncated')
+            arrays = {name: _view(buffer, dtype, shape, offsets[name]) for name, (dtype, shape) in specs.items()}
+        except BaseException:
+            buffer.close()
+            raise
+        return cls(arrays, header, buffer)
+
+    def nbytes(self):
+        """共享内存块中按行数据的总字节数"""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def __len__(self):
+        return len(self.average)
+
+    def _wages(self, values):
+        """存储的时薪 → float64 时薪（缺失为 NaN）"""
+        if self.wage_scale == 1:
+            return values
+        wages = values / self.wage_scale
+        wages[values == MISSING_WAGE] = np.nan
+        return wages
+
+    def _rows(self, rows):
+        """行号数组 → [[level1..level4, average, label], ...]（批量转换为 Python 原生类型）"""
+        values = self._wages(np.vstack([self.levels[:, rows], self.average[rows]])).T.tolist()
+        labels = [self.label_values[i] for i in self.label_idx[rows].tolist()]
+        return [_nan_to_none(v) + [label] for v, label in zip(values, labels)]
+
+    def _soc_rows(self, soc_idx):
+        """职业编码 → 该职业的所有行号（按地区、行号排序）"""
+        lo = np.searchsorted(self.by_soc_keys, soc_idx, 'left')
+        hi = np.searchsorted(self.by_soc_keys, soc_idx, 'right')
+        return self.by_soc[lo:hi]
+
+    def forward(self, soc_codes, areas):
+        """正向查询：{(area, soc_code): [level1..level4, average, label]}，同一组合只取第一行"""
+        soc_ids = [self.soc_lookup[s] for s in soc_codes if s in self.soc_lookup]
+        area_ids = np.array([self.area_lookup[a] for a in areas if a in self.area_lookup], dtype=np.int64)
+        if not soc_ids or not len(area_ids):
+            return {}
+        rows = np.concatenate([self._soc_rows(s) for s in soc_ids])
+        rows = rows[np.isin(self.area_idx[rows], area_ids)]
+        result = {}
+        for a, s, row in zip(self.area_idx[rows].tolist(), self.soc_idx[rows].tolist(), self._rows(rows)):
+            result.setdefault((self.area_codes[a], self.soc_codes[s]), row)
+        return result
+
+    def reverse(self, area, min_hourly, max_hourly, levels=(2,)):
+        """根据薪资查询：该地区任一选中 Level 在 [min, max] 内的行，
+        返回 [(soc_code, level1..level4, average, label, title)]，按行号排序"""
+        a = self.area_lookup.get(area)
+        if a is None:
+            return []
+        matched = []
+        for level in levels:
+            order, keys, values = self.by_area_level[level - 1]
+            lo = np.searchsorted(keys, a, 'left')
+            hi = np.searchsorted(keys, a, 'right')
+            wages = self._wages(values[lo:hi])
+            start = lo + np.searchsorted(wages, min_hourly, 'left')
+            end = lo + np.searchsorted(wages, max_hourly, 'right')
+            matched.append(order[start:end])
+        rows = np.unique(np.concatenate(matched))
+        results = []
+        for s, row in zip(self.soc_idx[rows].tolist(), self._rows(rows)):
+            soc_code = self.soc_codes[s]
+            for title in self.titles.get(soc_code, ()):
+                results.append((soc_code, *row, title))
+        return results
+
+    def location(self, soc_code, target_level, target_hourly, states=None):
+        """地区查询：该职业目标 Level ≥ target 的行按 (州, 县) 分组取最低值，按最低值升序，
+        states 为州名集合时只保留这些州，返回 [(level1..level4, average, label, state, county, min_target_salary)]"""
+        if target_level not in (1, 2, 3, 4):
+            raise ValueError(f'invalid target level: {target_level}')
+        s = self.soc_lookup.get(soc_code)
+        if s is None:
+            return []
+        order, keys, values = self.by_soc_level[target_level - 1]
+        lo = np.searchsorted(keys, s, 'left')
+        hi = np.searchsorted(keys, s, 'right')
+        wages = self._wages(values[lo:hi])
+        start = np.searchsorted(wages, target_hourly, 'left')
+        rows, values = order[lo + start:hi], wages[start:]
+        if not len(rows):
+            return []
+
+        # 展开 JOIN geography：每行重复为其地区下的每个 (州, 县)
+        counts = self.geo_count[self.area_idx[rows]]
+        total = int(counts.sum())
+        if not total:
+            return []
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        geo_pos = np.repeat(self.geo_start[self.area_idx[rows]], counts) + np.arange(total) - offsets
+        groups = self.geo_group[geo_pos]
+        rows = np.repeat(rows, counts)
+        values = np.repeat(values, counts)
+        if states is not None:
+            keep = np.isin(groups, [i for i, (state, _) in enumerate(self.geo_groups) if state in states])
+            groups, rows, values = groups[keep], rows[keep], values[keep]
+
+        # 行已按 (时薪, 行号) 升序：每组第一次出现即最低值所在行，再按 (最低值, 分组顺序) 排序
+        _, first = np.unique(groups, return_index=True)
+        picked = first[np.lexsort((groups[first], values[first]))]
+
+        results = []
+        for group, row, value in zip(groups[picked].tolist(), self._rows(rows[picked]), values[picked].tolist()):
+            state, county = self.geo_groups[group]
+            results.append((*row, state, county, value))
+        return results